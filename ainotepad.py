@@ -1,25 +1,182 @@
+import time
+_STARTUP_MARKS = [("start", time.perf_counter())]
+
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog, font
 import os
 import sys
 from datetime import datetime
 import tempfile
+import codecs
+import io
+import queue
+import threading
+import mmap
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+import shutil
+import functools
+import collections
+import itertools
+import contextlib
+import json
+import zlib
+import argparse
+import socket
+import secrets
+import hmac
+import fnmatch
+import multiprocessing
+import concurrent.futures
+import glob
+import hashlib
+import difflib
+import unicodedata
+import random
+import gzip
 
-class Notepad(tk.Tk):
-    def __init__(self):
-        super().__init__()
+try:
+    import bz2
+except ImportError:     # Python built without it
+    bz2 = None
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+_STARTUP_MARKS.append(("imports", time.perf_counter()))
+
+# Background file loading
+LOAD_CHUNK_SIZE = 256 * 1024      # bytes read and decoded per chunk
+LOAD_SLICE_MS = 30                # max time spent inserting per after() callback
+LOAD_POLL_MS = 15                 # delay between insert batches when the reader is behind
+
+# Encodings offered by Save As: name -> (codec, byte order mark)
+ENCODINGS = {
+    "ANSI": ("cp1252", b""),
+    "UTF-16 LE": ("utf-16-le", codecs.BOM_UTF16_LE),
+    "UTF-16 BE": ("utf-16-be", codecs.BOM_UTF16_BE),
+    "UTF-8": ("utf-8", b""),
+    "UTF-8 with BOM": ("utf-8", codecs.BOM_UTF8),
+}
+DEFAULT_ENCODING = "UTF-8"
+SNIFF_SIZE = 64 * 1024            # bytes examined when detecting an encoding
+
+# Compressed files: name -> (magic bytes, extension, module, default level)
+COMPRESSIONS = {
+    "gzip": (b"\x1f\x8b", ".gz", gzip, 6),
+    "bzip2": (b"BZh", ".bz2", bz2, 9),
+    "xz": (b"\xfd7zXZ\x00", ".xz", lzma, 6),
+}
+
+# Large file mode: files at least this big are memory-mapped and shown read-only
+LARGE_FILE_THRESHOLD = int(os.environ.get("AINOTEPAD_LARGE_FILE_MB", "256")) * 1024 * 1024
+LINE_INDEX_STEP = 1024            # lines between samples in the sparse line index
+VIEWPORT_MARGIN = 200             # lines kept in the widget above and below the view
+LINE_INDEX_CACHE_MIN = 16 * 1024 * 1024  # files at least this big keep their line index on disk
+LINE_INDEX_CACHE_FILES = 64       # cached line indexes kept, most recently written first
+
+# Saving
+SAVE_FSYNC = os.environ.get("AINOTEPAD_FSYNC", "1") != "0"
+
+# Undo history
+UNDO_MEMORY_BUDGET = int(os.environ.get("AINOTEPAD_UNDO_MB", "64")) * 1024 * 1024
+UNDO_COMPRESS_MIN = 16 * 1024     # older steps at least this big are stored compressed
+
+# Pasting: payloads at least this long are inserted in line-aligned pieces
+# of about this size from after() callbacks
+PASTE_BATCH_CHARS = 256 * 1024
+
+# Crash recovery journal
+JOURNAL_ENABLED = os.environ.get("AINOTEPAD_JOURNAL", "1") != "0"
+JOURNAL_COMPACT_MIN = 1024 * 1024  # log size that triggers a snapshot, at the least
+
+# Reload on external change: middles longer than this (in lines) are
+# replaced as one hunk instead of being diffed
+RELOAD_DIFF_MAX_LINES = 20000
+
+# Follow mode
+FOLLOW_POLL_MS = 500              # polling interval where inotify is not available
+FOLLOW_READ_MAX = 1 << 20         # bytes appended per step while catching up
+
+# Title and status bar refreshes are merged to at most one per frame
+UI_FRAME_MS = 16
+
+# Find
+FIND_BATCH_LINES = 4096           # lines fetched from the widget per search step
+HIGHLIGHT_BATCH_LINES = 2000      # max lines re-scanned per highlight step
+HIGHLIGHT_SLICE_MS = 20           # time spent highlighting per idle callback
+WRAP_BATCH_LINES = 500            # lines measured per step while word wrap is on
+WRAP_BLOCK_LINES = 4096           # lines per cached display-line sum
+
+# Find in Files
+FIND_FILES_BATCH = 64             # files per worker task...
+FIND_FILES_BATCH_BYTES = 16 << 20  # ...or this many bytes, whichever comes first
+FIND_FILES_MAX_HITS = 10000       # the search stops after this many matching lines
+FIND_FILE_MAX_HITS = 1000         # matching lines reported per file
+FIND_BINARY_SNIFF = 8192          # a NUL in this many leading bytes marks a binary file
+FIND_SKIP_DIRS = {".git", ".hg", ".svn"}
+
+# Single-instance mode
+SINGLE_INSTANCE = os.environ.get("AINOTEPAD_SINGLE_INSTANCE", "0") == "1"
+INSTANCE_POLL_MS = 100            # how often the UI picks up files sent by other launches
+
+# Printing: paper sizes offered by Page Setup, in points (1/72 inch)
+PAPER_SIZES = {"Letter": (612, 792), "Legal": (612, 1008), "A4": (595, 842), "A5": (420, 595)}
+PRINT_RELAYOUT_MS = 300           # pause in editing before pages are laid out again
+
+# Tabs (--tabs): files open in tabs of one window instead of further windows
+TABS = os.environ.get("AINOTEPAD_TABS", "0") == "1"
+TAB_RESIDENT = 4                  # tabs kept in Text widgets, most recently shown first
+
+# Performance tracing (--trace): AINOTEPAD_TRACE=1, or the file to write the trace to on exit
+TRACE_SETTING = os.environ.get("AINOTEPAD_TRACE", "0")
+TRACE_HEARTBEAT_MS = 50           # main-loop lateness is sampled this often
+TRACE_STALL_MS = 50               # lateness also kept as a trace event
+TRACE_MAX_EVENTS = 200000         # trace events kept, most recent first
+
+class EditorWindow:
+    """One editor window: text area, menus, status bar and document state.
+
+    Mixed into Notepad, the process's main window, and EditorToplevel, the
+    further windows it opens (File > New Window, single-instance launches).
+    """
+
+    _font_families = None           # shared by all windows, see font_families()
+    _font_lister = None             # the _FontLister filling it in, if started
+    tabbed = TABS
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        _startup_mark("Tk()")
 
         self.title("Untitled - Notepad")
         self.geometry("800x600")
 
         # State
-        self.filename = None
-        self.modified = False
+        self._init_document_state()
+        self._tab_numbers = itertools.count(1)
+        self.tab = _Tab()
+        self.tabs = [self.tab]
+        self._resident = [self.tab]     # tabs with a Text widget, most recently shown first
         self.find_text = ""
         self.find_match_case = False
+        self.find_regex = False
+        self.highlight_all = False
+        self.match_status_var = tk.StringVar(value="")
+        self._save_done = tk.IntVar(value=0)
+        self._ui_job = None
+        self._ui_dirty = set()
+        self._ui_last = 0.0
+        self._title = None
+        self._status_message = None
+        self._text_hook = None
+        self.page_settings = PageSettings()
+        self._print_job = None
 
         # Font state
-        self.current_font_family = "Consolas" if "Consolas" in font.families() else "Courier New"
+        self.current_font_family = self._resolve_font_family("Consolas", "Courier New")
         self.current_font_size = 11
         self.current_font_weight = "normal"
         self.current_font_slant = "roman"
@@ -27,21 +184,67 @@ class Notepad(tk.Tk):
                                    size=self.current_font_size,
                                    weight=self.current_font_weight,
                                    slant=self.current_font_slant)
+        _startup_mark("fonts")
 
         # Word wrap & statusbar state
         self.word_wrap_var = tk.BooleanVar(value=False)
         self.status_bar_var = tk.BooleanVar(value=True)
+        self.follow_var = tk.BooleanVar(value=False)
 
         self._create_widgets()
+        _startup_mark("_create_widgets")
         self._create_menus()
+        _startup_mark("_create_menus")
         self._bind_shortcuts()
+        self._create_helpers()
 
         self.protocol("WM_DELETE_WINDOW", self.on_exit)
+        _startup_mark("__init__ (rest)")
+
+    # Attributes that belong to the document shown; each tab keeps its own
+    TAB_STATE = ("filename", "_clean_state", "encoding", "compression", "_edit_listeners", "document",
+                 "_loader", "_saver", "_edit_generation", "_line_count", "_char_count", "_sel_cache",
+                 "_read_only", "_inserter", "_pending_goto", "large_view", "paginator", "follower",
+                 "_file_offset", "_disk_stat", "_disk_digest", "_disk_check", "undo", "journal",
+                 "text", "_text_cmd", "highlighter", "wrap_index")
+
+    def _init_document_state(self):
+        self.filename = None
+        self.encoding = DEFAULT_ENCODING
+        self.compression = None         # (format, level) of a compressed file, see COMPRESSIONS
+        self._edit_listeners = []
+        self.document = Document()      # the text, kept in step with the widget
+        self._clean_state = (0, self.document.snapshot())  # (undo version, text) when opened or saved
+        self._loader = None
+        self._saver = None
+        self._edit_generation = 0
+        self._line_count = 1
+        self._char_count = 0
+        self._sel_cache = None
+        self._read_only = False
+        self._inserter = None
+        self._pending_goto = None       # Go To line still being loaded
+        self.large_view = None
+        self.paginator = Paginator(self)
+        self.follower = None
+        self._file_offset = 0           # size of the file when it was last loaded or saved
+        self._disk_stat = None          # (size, mtime_ns) of the file as last loaded or saved
+        self._disk_digest = None        # and a hash of its bytes
+        self._disk_check = None
+        self.undo = UndoHistory(self)
+        self.journal = RecoveryJournal(self)
 
     # ----------------------------------------------------------------------
     # UI creation
     # ----------------------------------------------------------------------
     def _create_widgets(self):
+        # Tab bar, shown in tabbed mode
+        self.tab_bar = tk.Frame(self)
+        self._tab_var = tk.IntVar(value=0)
+        if self.tabbed:
+            self.tab_bar.pack(side=tk.TOP, fill=tk.X)
+            self._add_tab_button(self.tab)
+
         # Text area + scrollbars
         self.text_frame = tk.Frame(self)
         self.text_frame.pack(fill=tk.BOTH, expand=True)
@@ -52,49 +255,75 @@ class Notepad(tk.Tk):
         self.h_scroll = tk.Scrollbar(self.text_frame, orient=tk.HORIZONTAL)
         self.h_scroll.pack(side=tk.BOTTOM, fill=tk.X)
 
+        self._create_text()
+        self.v_scroll.config(command=self.text.yview)
+        self.h_scroll.config(command=self.text.xview)
+
+        # Status bar
+        self.status_bar = tk.Label(self, text="Ln 1, Col 1", anchor="w", relief=tk.SUNKEN, bd=1)
+        if self.status_bar_var.get():
+            self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+
+    def _create_text(self):
+        # One Text widget per tab kept in memory
         self.text = tk.Text(
             self.text_frame,
             wrap="none",
-            undo=True,
-            maxundo=-1,
+            undo=False,     # see UndoHistory
             yscrollcommand=self.v_scroll.set,
             xscrollcommand=self.h_scroll.set,
             font=self.text_font
         )
         self.text.pack(fill=tk.BOTH, expand=True)
-
-        self.v_scroll.config(command=self.text.yview)
-        self.h_scroll.config(command=self.text.xview)
+        self._install_text_proxy()
 
         # Modified tracking
         self.text.bind("<<Modified>>", self._on_text_modified)
-        self.text.bind("<KeyRelease>", self._update_status_bar)
-        self.text.bind("<ButtonRelease>", self._update_status_bar)
+        self.text.bind("<KeyRelease>", lambda e: self._schedule_ui("status"))
+        self.text.bind("<ButtonRelease>", lambda e: self._schedule_ui("status"))
+        self.text.bind("<<Selection>>", lambda e: self._schedule_ui("status"))
+        self.text.bind("<FocusIn>", lambda e: self._check_disk(), add="+")
+        # Pasting goes through insert_text() instead of the class binding
+        self.text.bind("<<Paste>>", lambda e: self.edit_paste() or "break")
+        if self.tabbed:
+            # Ahead of the Text class bindings: Ctrl+T transposes, Ctrl+Tab moves the focus
+            for sequence, func in self._tab_shortcuts():
+                self.text.bind(sequence, TRACER.wrap(f"key {sequence}", lambda e, f=func: f(e) or "break"))
 
-        # Status bar
-        self.status_bar = tk.Label(self, text="Ln 1, Col 1", anchor="w", relief=tk.SUNKEN, bd=1)
-        if self.status_bar_var.get():
-            self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+    def _create_helpers(self):
+        # The objects bound to self.text, and the edit listeners
+        self.highlighter = SearchHighlighter(self)
+        self.wrap_index = WrapIndex(self)
+        self._edit_listeners = [self._sync_document, self.highlighter.on_edit, self.wrap_index.on_edit,
+                                self.undo.on_edit, self._count_edit, self._track_counts,
+                                self.journal.on_edit, self.paginator.on_edit]
 
     def _create_menus(self):
         self.menu_bar = tk.Menu(self)
 
         # File menu
-        file_menu = tk.Menu(self.menu_bar, tearoff=False)
+        file_menu = _Menu(self.menu_bar, tearoff=False)
         file_menu.add_command(label="New", command=self.new_file, accelerator="Ctrl+N")
+        if self.tabbed:
+            file_menu.add_command(label="New Tab", command=self.new_tab, accelerator="Ctrl+T")
+        file_menu.add_command(label="New Window", command=self.new_window, accelerator="Ctrl+Shift+N")
         file_menu.add_command(label="Open...", command=self.open_file, accelerator="Ctrl+O")
         file_menu.add_command(label="Save", command=self.save_file, accelerator="Ctrl+S")
         file_menu.add_command(label="Save As...", command=self.save_file_as, accelerator="Ctrl+Shift+S")
+        if self.tabbed:
+            file_menu.add_command(label="Close Tab", command=self.close_tab, accelerator="Ctrl+W")
         file_menu.add_separator()
         file_menu.add_command(label="Page Setup...", command=self.page_setup)
+        file_menu.add_command(label="Print Preview", command=self.print_preview)
         file_menu.add_command(label="Print...", command=self.print_file, accelerator="Ctrl+P")
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.on_exit)
         self.menu_bar.add_cascade(label="File", menu=file_menu)
 
         # Edit menu
-        self.edit_menu = tk.Menu(self.menu_bar, tearoff=False)
+        self.edit_menu = _Menu(self.menu_bar, tearoff=False)
         self.edit_menu.add_command(label="Undo", command=self.edit_undo, accelerator="Ctrl+Z")
+        self.edit_menu.add_command(label="Redo", command=self.edit_redo, accelerator="Ctrl+Y")
         self.edit_menu.add_separator()
         self.edit_menu.add_command(label="Cut", command=self.edit_cut, accelerator="Ctrl+X")
         self.edit_menu.add_command(label="Copy", command=self.edit_copy, accelerator="Ctrl+C")
@@ -104,6 +333,8 @@ class Notepad(tk.Tk):
         self.edit_menu.add_command(label="Find...", command=self.find_dialog, accelerator="Ctrl+F")
         self.edit_menu.add_command(label="Find Next", command=self.find_next, accelerator="F3")
         self.edit_menu.add_command(label="Replace...", command=self.replace_dialog, accelerator="Ctrl+H")
+        self.edit_menu.add_command(label="Find in Files...", command=self.find_in_files_dialog,
+                                   accelerator="Ctrl+Shift+F")
         self.edit_menu.add_command(label="Go To...", command=self.goto_dialog, accelerator="Ctrl+G")
         self.edit_menu.add_separator()
         self.edit_menu.add_command(label="Select All", command=self.select_all, accelerator="Ctrl+A")
@@ -111,45 +342,67 @@ class Notepad(tk.Tk):
         self.menu_bar.add_cascade(label="Edit", menu=self.edit_menu)
 
         # Format menu
-        format_menu = tk.Menu(self.menu_bar, tearoff=False)
+        # Opening the menu gives font enumeration a head start on the dialog
+        format_menu = _Menu(self.menu_bar, tearoff=False, postcommand=self._prefetch_font_families)
         format_menu.add_checkbutton(label="Word Wrap", command=self.toggle_word_wrap,
                                     variable=self.word_wrap_var)
         format_menu.add_command(label="Font...", command=self.font_dialog)
         self.menu_bar.add_cascade(label="Format", menu=format_menu)
 
         # View menu
-        self.view_menu = tk.Menu(self.menu_bar, tearoff=False)
+        self.view_menu = _Menu(self.menu_bar, tearoff=False)
         self.view_menu.add_checkbutton(label="Status Bar", command=self.toggle_status_bar,
                                        variable=self.status_bar_var)
+        self.view_menu.add_checkbutton(label="Follow", command=self.toggle_follow,
+                                       variable=self.follow_var)
+        self.view_menu.add_separator()
+        self.view_menu.add_command(label="Performance...", command=self.performance_window)
         self.menu_bar.add_cascade(label="View", menu=self.view_menu)
 
         # Help menu
-        help_menu = tk.Menu(self.menu_bar, tearoff=False)
+        help_menu = _Menu(self.menu_bar, tearoff=False)
         help_menu.add_command(label="View Help", command=self.view_help)
         help_menu.add_separator()
         help_menu.add_command(label="About Notepad", command=self.about_dialog)
         self.menu_bar.add_cascade(label="Help", menu=help_menu)
 
         self.config(menu=self.menu_bar)
-        self._update_view_menu_state()
 
     def _bind_shortcuts(self):
-        self.bind("<Control-n>", lambda e: self.new_file())
-        self.bind("<Control-o>", lambda e: self.open_file())
-        self.bind("<Control-s>", lambda e: self.save_file())
-        self.bind("<Control-S>", lambda e: self.save_file_as())
-        self.bind("<Control-p>", lambda e: self.print_file())
-        self.bind("<Control-z>", lambda e: self.edit_undo())
-        self.bind("<Control-x>", lambda e: self.edit_cut())
-        self.bind("<Control-c>", lambda e: self.edit_copy())
-        self.bind("<Control-v>", lambda e: self.edit_paste())
-        self.bind("<Delete>", lambda e: self.edit_delete())
-        self.bind("<Control-f>", lambda e: self.find_dialog())
-        self.bind("<F3>", lambda e: self.find_next())
-        self.bind("<Control-h>", lambda e: self.replace_dialog())
-        self.bind("<Control-g>", lambda e: self.goto_dialog())
-        self.bind("<Control-a>", lambda e: self.select_all())
-        self.bind("<F5>", lambda e: self.insert_time_date())
+        def bind(sequence, func):
+            self.bind(sequence, TRACER.wrap(f"key {sequence}", func))
+
+        bind("<Control-n>", lambda e: self.new_file())
+        bind("<Control-N>", lambda e: self.new_window())
+        bind("<Control-o>", lambda e: self.open_file())
+        bind("<Control-s>", lambda e: self.save_file())
+        bind("<Control-S>", lambda e: self.save_file_as())
+        bind("<Control-p>", lambda e: self.print_file())
+        bind("<Control-z>", lambda e: self.edit_undo())
+        bind("<Control-y>", lambda e: self.edit_redo())
+        bind("<Control-x>", lambda e: self.edit_cut())
+        bind("<Control-c>", lambda e: self.edit_copy())
+        bind("<Delete>", lambda e: self.edit_delete())
+        bind("<Control-f>", lambda e: self.find_dialog())
+        bind("<F3>", lambda e: self.find_next())
+        bind("<Control-h>", lambda e: self.replace_dialog())
+        bind("<Control-F>", lambda e: self.find_in_files_dialog())
+        bind("<Control-g>", lambda e: self.goto_dialog())
+        bind("<Control-a>", lambda e: self.select_all())
+        bind("<F5>", lambda e: self.insert_time_date())
+        bind("<Escape>", lambda e: self._cancel_insert() or self._cancel_load())
+        if self.tabbed:
+            for sequence, func in self._tab_shortcuts():
+                bind(sequence, func)
+
+    def _tab_shortcuts(self):
+        keys = [("<Control-t>", lambda e: self.new_tab()),
+                ("<Control-w>", lambda e: self.close_tab()),
+                ("<Control-Tab>", lambda e: self.select_next_tab(1)),
+                ("<Control-Shift-Tab>", lambda e: self.select_next_tab(-1))]
+        if self._windowingsystem == "x11":
+            keys.append(("<Control-ISO_Left_Tab>", lambda e: self.select_next_tab(-1)))
+        return keys
 
     # ----------------------------------------------------------------------
     # File operations
@@ -157,40 +410,183 @@ class Notepad(tk.Tk):
     def new_file(self):
         if not self._maybe_save_changes():
             return
+        self._wait_for_save()
+        self._cancel_insert()
+        self._cancel_load(keep_partial=False)
+        self._close_large_view()
+        self.set_follow(False)
         self.text.delete("1.0", tk.END)
+        self.undo.clear()
+        self.text.edit_modified(False)
         self.filename = None
         self.modified = False
+        self.encoding = DEFAULT_ENCODING
+        self.compression = None
+        self.journal.rebase()
         self._update_title()
+        self._update_status_bar()
 
-    def open_file(self):
-        if not self._maybe_save_changes():
+    def new_window(self):
+        self._root().open_windows([None])
+
+    def open_file(self, path=None, on_done=None):
+        # In tabbed mode the file gets a tab of its own, or its tab is shown
+        if not self.tabbed and not self._maybe_save_changes():
             return
-        filetypes = [
-            ("Text Documents", "*.txt"),
-            ("All Files", "*.*")
-        ]
-        path = filedialog.Open(self, filetypes=filetypes).show()
-        if path:
+        if path is None:
+            filetypes = [
+                ("Text Documents", "*.txt"),
+                ("All Files", "*.*")
+            ]
+            path = filedialog.Open(self, filetypes=filetypes).show()
+        if not path:
+            return
+        if self.tabbed:
+            tab = self._tab_for(path)
+            if tab is not None:
+                if self.select_tab(tab) and on_done is not None:
+                    on_done()
+                return
+            if not self._pristine() and not self.new_tab():
+                return
+        self._load_file(path, on_done)
+
+    def _load_file(self, path, on_done=None):
+        # The file is read and decoded on a worker thread; the chunks are
+        # inserted from after() callbacks so the window keeps repainting.
+        self._wait_for_save()
+        self._cancel_insert()
+        self._cancel_load(keep_partial=False)
+        self._close_large_view()
+        self.set_follow(False)
+        try:
+            large = os.path.getsize(path) >= LARGE_FILE_THRESHOLD
+            if large:
+                with open(path, "rb") as f:
+                    # The viewer maps the raw bytes and indexes b"\n", which
+                    # compressed files and UTF-16 do not use
+                    head = f.read(SNIFF_SIZE)
+                    large = not (sniff_compression(head) or detect_encoding(head).startswith("UTF-16"))
+        except OSError:
+            large = False
+        if large:
+            self._open_large_view(path, on_done)
+            return
+
+        self.text.delete("1.0", tk.END)
+        self._read_only = True
+        self.filename = path
+        self.modified = False
+        self._update_title()
+
+        self._loader = _FileLoader(path)
+        self._loader.on_done = on_done
+        self._loader.document = Document()
+        self._loader.started = time.perf_counter()
+        self._loader.insert_seconds = 0.0
+        self._loader.start()
+        self._set_status_message("Loading...")
+        self.after(LOAD_POLL_MS, self._poll_loader, self._loader)
+
+    def _poll_loader(self, loader):
+        if loader is not self._loader:
+            return  # cancelled or superseded
+        deadline = time.perf_counter() + LOAD_SLICE_MS / 1000.0
+        while time.perf_counter() < deadline:
             try:
-                with open(path, "r", encoding="utf-8") as f:
-                    content = f.read()
-            except UnicodeDecodeError:
-                with open(path, "r", encoding="cp1252", errors="replace") as f:
-                    content = f.read()
-            self.text.delete("1.0", tk.END)
-            self.text.insert("1.0", content)
-            self.filename = path
+                item = loader.chunks.get_nowait()
+            except queue.Empty:
+                break
+            if item is _FileLoader.EOF:
+                self._finish_load(loader)
+                return
+            else:
+                start = time.perf_counter()
+                self._raw_text("insert", "end-1c", item)
+                loader.insert_seconds += time.perf_counter() - start
+                loader.document.append(item)
+
+        if self._pending_goto is not None:
+            self._apply_pending_goto()
+        message = f"Loading... {loader.progress():.0%}"
+        if loader.line_count() is not None:
+            message += f" of {loader.line_count():,} lines"
+        self._set_status_message(message + "  (Esc to cancel)")
+        delay = 1 if not loader.chunks.empty() else LOAD_POLL_MS
+        self.after(delay, self._poll_loader, loader)
+
+    def _finish_load(self, loader):
+        TRACER.record("open", "io", loader.started, bytes=loader.bytes_read)
+        TRACER.record("open: decode", "io", loader.started, loader.decode_seconds, bytes=loader.bytes_read)
+        TRACER.record("open: Tk insert", "tcl", loader.started, loader.insert_seconds, chars=loader.chars)
+        self._loader = None
+        self._read_only = False
+        if loader.error is not None:
+            # Drop the partial text behind the proxy, so Undo cannot bring it back
+            self._pending_goto = None
+            self._raw_text("delete", "1.0", "end")
+            self._notify_text_reset(None)
             self.text.edit_modified(False)
+            self.filename = None
+            self.encoding = DEFAULT_ENCODING
+            self.compression = None
+            self._disk_stat = self._disk_digest = None
             self.modified = False
+            self._set_status_message(None)
+            self.journal.rebase()
             self._update_title()
+            messagebox.showerror("Error", f"Could not open file:\n{loader.error}", parent=self)
+            return
+        self._notify_text_reset(loader.document)
+        self._char_count = loader.chars
+        self._file_offset = loader.bytes_read
+        self._disk_stat = loader.stat
+        self._disk_digest = loader.digest
+        self.text.mark_set("insert", "1.0")
+        self.text.see("insert")
+        self.text.edit_modified(False)
+        self.modified = False
+        self.encoding = loader.encoding or DEFAULT_ENCODING
+        self.compression = loader.compression
+        self._set_status_message(None)
+        if self._pending_goto is not None:
+            self._apply_pending_goto(final=True)
+        self.journal.rebase()
+        self._update_title()
+        if loader.on_done is not None:
+            loader.on_done()
+
+    def _cancel_load(self, keep_partial=True):
+        loader = self._loader
+        if loader is None:
+            return
+        self._loader = None
+        loader.cancel()
+        self._read_only = False
+        if not keep_partial:
+            self.text.delete("1.0", tk.END)
+            self._pending_goto = None
+        elif self._pending_goto is not None:
+            self._apply_pending_goto(final=True)
+        self._notify_text_reset(loader.document if keep_partial else None)
+        # A partially loaded buffer must never be saved over the original file
+        self.filename = None
+        self.text.edit_modified(False)
+        self.modified = False
+        self.journal.rebase()
+        self._update_title()
+        self._set_status_message("Loading cancelled." if keep_partial else None)
 
-    def save_file(self):
+    def save_file(self, wait=False):
+        if self._loader is not None:
+            messagebox.showinfo("Notepad", "Please wait until the file has finished loading.", parent=self)
+            return False
         if self.filename is None:
-            return self.save_file_as()
+            return self.save_file_as(wait)
         else:
-            return self._write_to_file(self.filename)
+            return self._write_to_file(self.filename, wait)
 
-    def save_file_as(self):
+    def save_file_as(self, wait=False):
         filetypes = [
             ("Text Documents", "*.txt"),
             ("All Files", "*.*")
@@ -200,57 +596,303 @@ class Notepad(tk.Tk):
         if path:
             if not os.path.splitext(path)[1]:
                 path += ".txt"
-            return self._write_to_file(path)
+            encoding = None
+            if self.large_view is None:
+                encoding = EncodingDialog.ask(self, self.encoding)
+                if encoding is None:
+                    return False
+            return self._write_to_file(path, wait, encoding)
         return False
 
-    def _write_to_file(self, path):
+    def _write_to_file(self, path, wait=False, encoding=None):
+        # The buffer is streamed to a temp file by a worker thread and moved
+        # over the target only once it is complete. Returns whether the save
+        # started, or with `wait`, whether it succeeded.
+        if self.large_view is not None:
+            return self._copy_large_file(path)
+        if self._inserter is not None:
+            if not wait:
+                self.bell()
+                return False
+            while self._inserter is not None:     # finish the paste first
+                self._insert_step(self._inserter)
+        if self._saver is not None:
+            if not wait:
+                self.bell()
+                return False
+            self._wait_for_save()
+
+        # The saver reads a snapshot of the document, so editing can go on
+        # meanwhile; typing after this point starts a new undo step so that
+        # Undo can come back to the saved text
+        self.undo.seal()
+        saver = _FileSaver(path, encoding or self.encoding, compression=self._compression_for(path),
+                           source=self.document.snapshot().chunks())
+        saver.generation = self._edit_generation
+        saver.clean_state = (self.undo.version, self.document.snapshot())
+        saver.started = time.perf_counter()
+        self._saver = saver
+        saver.start()
+        self._update_title()
+        self.after(LOAD_POLL_MS, self._poll_saver, saver)
+        if wait:
+            self._wait_for_save()
+            return saver.error is None
+        return True
+
+    def _compression_for(self, path):
+        # The file keeps the format and level it was opened with; another
+        # name is compressed according to its extension
+        name = compression_for_path(path)
+        if self.compression is not None and (path == self.filename or name == self.compression[0]):
+            return self.compression
+        return (name, COMPRESSIONS[name][3]) if name else None
+
+    def _poll_saver(self, saver):
+        if not saver.done:
+            self.after(LOAD_POLL_MS, self._poll_saver, saver)
+            return
+        self._saver = None
+        TRACER.record("save", "io", saver.started, bytes=saver.bytes_written)
+        if saver.error is None:
+            self.filename = saver.path
+            self.encoding = saver.encoding
+            self.compression = saver.compression
+            # Text edited during the save stays modified, unless undone back
+            self._clean_state = saver.clean_state
+            if saver.generation == self._edit_generation:
+                self.text.edit_modified(False)
+                self.journal.rebase()
+                with contextlib.suppress(OSError):
+                    st = os.stat(saver.path)
+                    self._file_offset = st.st_size
+                    self._disk_stat = (st.st_size, st.st_mtime_ns)
+                    self._disk_digest = saver.digest
+                if self.follower is not None:
+                    self.follower.resync(self._file_offset)
+        self._update_title()
+        self._update_status_bar()
+        self._save_done.set(self._save_done.get() + 1)
+        if isinstance(saver.error, UnicodeEncodeError):
+            messagebox.showerror("Error", f"This file contains characters that cannot be saved "
+                                          f"as {saver.encoding}.\n\nUse Save As and choose a "
+                                          f"Unicode encoding.", parent=self)
+        elif saver.error is not None:
+            messagebox.showerror("Error", f"Could not save file:\n{saver.error}", parent=self)
+
+    def _wait_for_save(self):
+        # Keeps the event loop running until the save in progress completes
+        while self._saver is not None:
+            self.wait_variable(self._save_done)
+
+    def _open_large_view(self, path, on_done=None):
         try:
-            text = self.text.get("1.0", tk.END)
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(text.rstrip("\n") + "\n")
-            self.filename = path
-            self.text.edit_modified(False)
-            self.modified = False
-            self._update_title()
+            view = LargeFileView(self, path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not open file:\n{e}", parent=self)
+            return
+        self.large_view = view
+        self._read_only = True
+        self.document = Document()  # the view keeps only a window of the file in the widget
+        self.filename = path
+        self.modified = False
+        self.word_wrap_var.set(False)
+        self.toggle_word_wrap()
+        self.undo.clear()
+        self.highlighter.set_pattern(None)
+        self.text.config(yscrollcommand=view.on_text_scroll)
+        self.v_scroll.config(command=view.on_scrollbar)
+        self._update_title()
+        # The window height is needed to size the viewport
+        self.after_idle(view.show, 0)
+        if on_done is not None:
+            self.after_idle(on_done)
+
+    def _close_large_view(self):
+        view = self.large_view
+        if view is None:
+            return
+        self.large_view = None
+        view.close()
+        self._read_only = False
+        self.text.config(yscrollcommand=self.v_scroll.set)
+        self.v_scroll.config(command=self.text.yview)
+        self.text.delete("1.0", tk.END)
+        self.undo.clear()
+        self.text.edit_modified(False)
+        self.modified = False
+
+    def _copy_large_file(self, path):
+        try:
+            if os.path.abspath(path) != os.path.abspath(self.large_view.path):
+                shutil.copyfile(self.large_view.path, path)
             return True
         except Exception as e:
-            messagebox.showerror("Error", f"Could not save file:\n{e}")
+            messagebox.showerror("Error", f"Could not save file:\n{e}", parent=self)
             return False
 
     def page_setup(self):
-        # Simple stub; real Notepad uses printer/page options
-        messagebox.showinfo("Page Setup", "Page Setup is not implemented.\n\n"
-                             "You can still use Print... to print the current document.")
+        settings = PageSetupDialog.ask(self, self.page_settings)
+        if settings is not None:
+            self.page_settings = settings
+            self._update_page_layout()
+
+    def _page_layout(self):
+        # A new layout (other settings or font) means laying the pages out again
+        key = (self.page_settings, tuple(sorted(self.text_font.actual().items())))
+        layout = self.paginator.layout
+        if layout is None or layout.key != key:
+            layout = PageLayout(self.page_settings, self.text_font, float(self.tk.call("tk", "scaling")))
+            layout.key = key
+            self.paginator.set_layout(layout)
+        return layout
+
+    def _update_page_layout(self):
+        # After a font or Page Setup change; pages are only laid out again if they were before
+        if self.paginator.layout is not None:
+            self._page_layout()
+
+    def _can_print(self):
+        if self.large_view is not None:
+            messagebox.showinfo("Print", "Large files are shown a part at a time and cannot be printed.",
+                                parent=self)
+            return False
+        return True
+
+    def print_preview(self):
+        if self._can_print():
+            self._page_layout()
+            PrintPreview(self)
 
     def print_file(self):
-        # Simple Windows-oriented print: save to temp file and use default printer
-        if sys.platform.startswith("win"):
-            # Ensure content is saved somewhere
-            temp_dir = tempfile.gettempdir()
-            temp_path = os.path.join(temp_dir, "notepad_clone_print.txt")
-            try:
-                text = self.text.get("1.0", tk.END)
-                with open(temp_path, "w", encoding="utf-8") as f:
-                    f.write(text)
-                os.startfile(temp_path, "print")
-            except Exception as e:
-                messagebox.showerror("Print", f"Printing failed:\n{e}")
-        else:
-            messagebox.showinfo("Print", "Printing is only implemented on Windows using the default printer.")
+        # Prints to a PDF or PostScript file; pages are written as they are laid out
+        if not self._can_print():
+            return
+        if self._print_job is not None:
+            self.bell()
+            return
+        name = os.path.splitext(os.path.basename(self.filename or "Untitled"))[0]
+        path = filedialog.asksaveasfilename(parent=self, title="Print to File", initialfile=name + ".pdf",
+                                            defaultextension=".pdf",
+                                            filetypes=[("PDF", "*.pdf"), ("PostScript", "*.ps"),
+                                                       ("All Files", "*.*")])
+        if not path:
+            return
+        # _page_layout() drops the cached pages if the layout changed; any
+        # left are current, and the job's own are cached once it is done
+        layout = self._page_layout()
+        job = _PrintJob(path, self.document.snapshot(), layout, self.filename, self.paginator.starts)
+        job.paginator = self.paginator
+        job.generation = self.paginator.generation
+        job.started = time.perf_counter()
+        self._print_job = job
+        job.start()
+        self.after(LOAD_POLL_MS, self._poll_print_job, job)
 
-    def on_exit(self):
-        if not self._maybe_save_changes():
+    def _poll_print_job(self, job):
+        if not job.done:
+            self._set_status_message(f"Printing page {job.pages + 1}...")
+            self.after(LOAD_POLL_MS, self._poll_print_job, job)
             return
-        self.destroy()
+        self._print_job = None
+        TRACER.record("print", "io", job.started)
+        self._set_status_message(None)
+        if job.error is not None:
+            messagebox.showerror("Print", f"Could not print:\n{job.error}", parent=self)
+        elif not job.cancelled and job.layout is job.paginator.layout:
+            job.paginator.adopt(job.starts, job.generation)
+
+    def on_exit(self):
+        for tab in list(self.tabs):
+            if tab is not self.tab:
+                if not tab.modified:
+                    continue
+                if not self.select_tab(tab):
+                    return
+            if not self._maybe_save_changes():
+                return
+        self._wait_for_save()
+        self._cancel_insert()
+        self._cancel_load(keep_partial=False)
+        self._close_large_view()
+        self.set_follow(False)
+        self.journal.close()
+        for tab in list(self.tabs):
+            if tab is not self.tab:
+                self._discard_tab(tab)
+        self._close_window()
+
+    def _offer_recovery(self):
+        # Journals left behind by a session that is no longer running
+        for directory in find_orphan_journals():
+            try:
+                meta, base, records = read_journal(directory)
+            except (OSError, ValueError):
+                meta = None
+            if meta is None or (not records and not meta.get("modified")):
+                shutil.rmtree(directory, ignore_errors=True)
+                continue
+            name = os.path.basename(meta.get("filename") or "") or "Untitled"
+            when = datetime.fromtimestamp(meta.get("time", 0)).strftime("%Y-%m-%d %H:%M")
+            answer = messagebox.askyesnocancel(
+                "Notepad", f"Notepad closed while {name} had unsaved changes ({when}).\n\n"
+                           f"Recover them now?\n\nNo discards them, Cancel keeps them for later.",
+                parent=self)
+            if answer is None:
+                continue
+            if answer and not self._recover(meta, base, records):
+                continue
+            shutil.rmtree(directory, ignore_errors=True)
+            if answer:
+                break
+
+    def _recover(self, meta, base, records):
+        if base is None:
+            try:
+                base = read_journal_base(meta)
+            except (OSError, ValueError) as e:
+                messagebox.showerror("Notepad", f"Could not recover changes:\n{e}", parent=self)
+                return False
+        self._wait_for_save()
+        self._cancel_insert()
+        self._cancel_load(keep_partial=False)
+        self._close_large_view()
+        self._raw_text("delete", "1.0", "end")
+        self._raw_text("insert", "1.0", base)
+        applied = 0
+        try:
+            for record in records:
+                if record[0] == "i":
+                    self._raw_text("insert", record[1], record[2])
+                else:
+                    self._raw_text("delete", record[1], record[2])
+                applied += 1
+        except (tk.TclError, IndexError):
+            pass
+        self._notify_text_reset()
+        self.undo.clear()
+        self.text.mark_set("insert", "1.0")
+        self.filename = meta.get("filename")
+        self.encoding = meta.get("encoding") if meta.get("encoding") in ENCODINGS else DEFAULT_ENCODING
+        compression = meta.get("compression")
+        self.compression = tuple(compression) if compression and compression[0] in COMPRESSIONS else None
+        self.modified = True
+        self.journal.rebase()
+        self._update_title()
+        self._update_status_bar()
+        if applied < len(records):
+            messagebox.showwarning("Notepad", "Only part of the unsaved changes could be recovered.",
+                                   parent=self)
+        return True
 
     def _maybe_save_changes(self):
         if not self.modified:
             return True
-        result = messagebox.askyesnocancel("Notepad", "Do you want to save changes?")
+        result = messagebox.askyesnocancel("Notepad", "Do you want to save changes?", parent=self)
         if result is None:  # Cancel
             return False
         if result:  # Yes
-            if not self.save_file():
+            if not self.save_file(wait=True):
                 return False
         return True
 
@@ -258,10 +900,14 @@ class Notepad(tk.Tk):
     # Edit operations
     # ----------------------------------------------------------------------
     def edit_undo(self):
-        try:
-            self.text.edit_undo()
-        except tk.TclError:
-            pass
+        if self._read_only or not self.undo.undo():
+            self.bell()
+        self._schedule_ui("status")
+
+    def edit_redo(self):
+        if self._read_only or not self.undo.redo():
+            self.bell()
+        self._schedule_ui("status")
 
     def edit_cut(self):
         self.text.event_generate("<<Cut>>")
@@ -270,7 +916,11 @@ class Notepad(tk.Tk):
         self.text.event_generate("<<Copy>>")
 
     def edit_paste(self):
-        self.text.event_generate("<<Paste>>")
+        try:
+            text = self.clipboard_get()
+        except tk.TclError:
+            return  # empty clipboard
+        self.insert_text(text)
 
     def edit_delete(self):
         try:
@@ -285,7 +935,77 @@ class Notepad(tk.Tk):
 
     def insert_time_date(self):
         now = datetime.now().strftime("%H:%M %m/%d/%Y")
-        self.text.insert("insert", now)
+        self.insert_text(now)
+
+    def insert_text(self, text):
+        """Insert text at the cursor in place of the selection, as one undo step.
+
+        Large payloads are inserted in pieces from after() callbacks with
+        progress in the status bar; Esc cancels and takes the paste back out.
+        """
+        self._wait_for_save()
+        if self._read_only or self._inserter is not None:
+            self.bell()
+            return
+        ranges = self.text.tag_ranges("sel")
+        if len(text) < PASTE_BATCH_CHARS:
+            with self.undo.group():
+                if ranges:
+                    self.text.delete(ranges[0], ranges[1])
+                self.text.insert("insert", text)
+            self.text.see("insert")
+            return
+
+        self.undo.begin_group()
+        if ranges:
+            self.text.delete(ranges[0], ranges[1])
+        self.text.mark_set("paste_at", "insert")
+        self.text.mark_gravity("paste_at", "right")
+        job = _PendingInsert(text, self.undo.undo_stack[-1])
+        self._inserter = job
+        self._read_only = True      # typing waits until the paste is in
+        self._insert_step(job)
+
+    def _insert_step(self, job):
+        if job is not self._inserter:
+            return  # cancelled
+        text = job.text
+        deadline = time.perf_counter() + LOAD_SLICE_MS / 1000.0
+        while job.pos < len(text) and time.perf_counter() < deadline:
+            end = min(job.pos + PASTE_BATCH_CHARS, len(text))
+            if end < len(text):
+                newline = text.rfind("\n", job.pos, end)
+                if newline >= job.pos:
+                    end = newline + 1
+            self._read_only = False
+            try:
+                self.text.insert("paste_at", text[job.pos:end])
+            finally:
+                self._read_only = True
+            job.pos = end
+        if job.pos < len(text):
+            self._set_status_message(f"Pasting... {job.pos / len(text):.0%}  (Esc to cancel)")
+            self.after(1, self._insert_step, job)
+            return
+        self._inserter = None
+        self._read_only = False
+        self.undo.end_group()
+        self.text.mark_set("insert", "paste_at")
+        self.text.mark_unset("paste_at")
+        self.text.see("insert")
+        self._set_status_message(None)
+
+    def _cancel_insert(self):
+        job = self._inserter
+        if job is None:
+            return
+        self._inserter = None
+        self._read_only = False
+        self.undo.end_group()
+        if self.undo.undo_stack and self.undo.undo_stack[-1] is job.group:
+            self.undo.undo()
+        self.text.mark_unset("paste_at")
+        self._set_status_message("Paste cancelled.")
 
     # ----------------------------------------------------------------------
     # Find / Replace / Go To
@@ -297,75 +1017,185 @@ class Notepad(tk.Tk):
         if not self.find_text:
             self.find_dialog()
             return
-        self._do_find_next(self.find_text, self.find_match_case)
+        self._do_find_next(self.find_text, self.find_match_case, self.find_regex)
+
+    def _compile_find(self, text, match_case, regex):
+        try:
+            return compile_search(text, match_case, regex)
+        except re.error as e:
+            messagebox.showerror("Notepad", f"Invalid regular expression:\n{e}", parent=self)
+            return None
 
-    def _do_find_next(self, text, match_case):
+    def _do_find_next(self, text, match_case, regex=False):
         if not text:
             return
-        start = self.text.index("insert")
-        if self.text.compare(start, "==", "end-1c"):
-            start = "1.0"
-        flags = {} if match_case else {"nocase": 1}
-
-        pos = self.text.search(text, start, stopindex="end", **flags)
-        if not pos:
-            # Wrap search
-            pos = self.text.search(text, "1.0", stopindex="end", **flags)
-            if not pos:
-                messagebox.showinfo("Notepad", f"Cannot find '{text}'")
+        if self.large_view is not None:
+            try:
+                found = self.large_view.find_next(text, match_case, regex)
+            except re.error as e:
+                messagebox.showerror("Notepad", f"Invalid regular expression:\n{e}", parent=self)
                 return
-        end_pos = f"{pos}+{len(text)}c"
+            if not found:
+                messagebox.showinfo("Notepad", f"Cannot find '{text}'", parent=self)
+            self._update_status_bar()
+            return
+        pattern = self._compile_find(text, match_case, regex)
+        if pattern is None:
+            return
+        if self.highlight_all:
+            self.highlighter.set_pattern(pattern)
+
+        with TRACER.span("find", "edit"):
+            found = self._search_forward(pattern)
+        if found is None:
+            messagebox.showinfo("Notepad", f"Cannot find '{text}'", parent=self)
+            return
+        pos, end_pos = found
         self.text.tag_remove("sel", "1.0", "end")
         self.text.tag_add("sel", pos, end_pos)
         self.text.mark_set("insert", end_pos)
         self.text.see(pos)
+        if self.highlight_all:
+            self.highlighter.select_match(pos)
+
+    def _search_forward(self, pattern):
+        # Search from the cursor to the end and then wrap around, reading
+        # FIND_BATCH_LINES lines at a time from the document so a hit near
+        # the cursor costs little. A pattern that may match across lines is
+        # run over the whole text instead, as batches would cut its matches.
+        doc = self.document
+        cursor = doc.offset(self.text.index("insert"))
+        if crosses_lines(pattern):
+            text = doc.get()
+            m = search_nonempty(pattern, text, cursor) or search_nonempty(pattern, text)
+            return None if m is None else (doc.index(m.start()), doc.index(m.end()))
+        line = doc.position(cursor)[0]
+        last_line = doc.line_count
+        batches = [(a, min(a + FIND_BATCH_LINES - 1, last_line))
+                   for a in range(line, last_line + 1, FIND_BATCH_LINES)]
+        batches += [(a, min(a + FIND_BATCH_LINES - 1, line)) for a in range(1, line + 1, FIND_BATCH_LINES)]
+        for n, (first, last) in enumerate(batches):
+            start, end = doc.line_range(first, last)
+            chunk = doc.get(start, end)
+            m = search_nonempty(pattern, chunk, cursor - start if n == 0 else 0)
+            if m is not None:
+                return doc.index(start + m.start()), doc.index(start + m.end())
+        return None
+
+    def set_highlight_all(self, enabled, text=None, match_case=False, regex=False):
+        self.highlight_all = enabled
+        pattern = None
+        if enabled and text and self.large_view is None:
+            pattern = self._compile_find(text, match_case, regex)
+        self.highlighter.set_pattern(pattern)
+
+    def find_in_files_dialog(self):
+        FindInFilesDialog(self)
+
+    def open_location(self, path, line, col=0, end_col=None):
+        # Shows a Find in Files hit, opening the file first unless it is the open one
+        same = False
+        if self.filename and self._loader is None:
+            with contextlib.suppress(OSError):
+                same = os.path.samefile(path, self.filename)
+        if same:
+            self._show_location(line, col, end_col)
+        else:
+            self.open_file(path, on_done=lambda: self._show_location(line, col, end_col))
+
+    def _show_location(self, line, col, end_col=None):
+        self.lift()
+        self.text.focus_set()
+        if self.large_view is not None:
+            self.large_view.goto_line(line, col)
+        else:
+            index = f"{line}.{col}"
+            self.text.tag_remove("sel", "1.0", "end")
+            if end_col is not None:
+                self.text.tag_add("sel", index, f"{line}.{end_col}")
+            self.text.mark_set("insert", index)
+            self.text.see(index)
+        self._schedule_ui("status")
 
     def replace_dialog(self):
+        if self.large_view is not None:
+            messagebox.showinfo("Notepad", "This file is open read-only in large file mode.", parent=self)
+            return
         ReplaceDialog(self)
 
-    def _replace_once(self, find_text, replace_text, match_case):
+    def _replace_once(self, find_text, replace_text, match_case, regex=False):
         if not find_text:
             return
+        pattern = self._compile_find(find_text, match_case, regex)
+        if pattern is None:
+            return
 
-        # If selection matches the find text, replace it, else find next
+        # If the selection is a match, replace it, else find next. It is
+        # matched in place so that ^, $, \b and lookarounds see its context.
+        m = None
         try:
             sel_start = self.text.index("sel.first")
             sel_end = self.text.index("sel.last")
-            sel_text = self.text.get(sel_start, sel_end)
         except tk.TclError:
-            sel_text = ""
-
-        compare = (lambda a, b: a == b) if match_case else (lambda a, b: a.lower() == b.lower())
-
-        if sel_text and compare(sel_text, find_text):
-            self.text.delete(sel_start, sel_end)
-            self.text.insert(sel_start, replace_text)
+            pass
+        else:
+            doc = self.document
+            start, end = doc.offset(sel_start), doc.offset(sel_end)
+            if crosses_lines(pattern):
+                first, chunk = 0, doc.get()
+            else:
+                first, last = doc.line_range(doc.position(start)[0], doc.position(end)[0])
+                chunk = doc.get(first, last)
+            m = pattern.match(chunk, start - first)
+            if m is not None and m.end() != end - first:
+                m = None
+        if m is not None:
+            if regex:
+                replace_text = m.expand(replace_text)
+            with self.undo.group():
+                self.text.delete(sel_start, sel_end)
+                self.text.insert(sel_start, replace_text)
             new_end = f"{sel_start}+{len(replace_text)}c"
             self.text.tag_add("sel", sel_start, new_end)
             self.text.mark_set("insert", new_end)
         else:
-            self._do_find_next(find_text, match_case)
+            self._do_find_next(find_text, match_case, regex)
 
-    def _replace_all(self, find_text, replace_text, match_case):
+    def _replace_all(self, find_text, replace_text, match_case, regex=False):
         if not find_text:
             return
-        count = 0
-        start = "1.0"
-        flags = {} if match_case else {"nocase": 1}
-        while True:
-            pos = self.text.search(find_text, start, stopindex="end", **flags)
-            if not pos:
-                break
-            end_pos = f"{pos}+{len(find_text)}c"
-            self.text.delete(pos, end_pos)
-            self.text.insert(pos, replace_text)
-            start = f"{pos}+{len(replace_text)}c"
-            count += 1
-        messagebox.showinfo("Notepad", f"Replaced {count} occurrence(s).")
+        if self._compile_find(find_text, match_case, regex) is None:
+            return
+        # Replacements are computed in one pass over a single copy of the
+        # buffer, then applied as one delete/insert covering the first to
+        # the last match, so they undo as a single step.
+        started = time.perf_counter()
+        content = self.document.get()
+        start, end, replacement, count = replace_all_in_text(content, find_text, replace_text,
+                                                             match_case, regex)
+        TRACER.record("replace all: scan", "edit", started, chars=len(content))
+        del content
+        if count:
+            first = self.document.index(start)
+            last = self.document.index(end)
+            insert = self.text.index("insert")
+            xview = self.text.xview()[0]
+            yview = self.text.yview()[0]
+            with TRACER.span("replace all: apply", "tcl", chars=len(replacement)):
+                with self.undo.group():
+                    self.text.delete(first, last)
+                    self.text.insert(first, replacement)
+            self.text.mark_set("insert", insert)
+            self.text.xview_moveto(xview)
+            self.text.yview_moveto(yview)
+        messagebox.showinfo("Notepad", f"Replaced {count} occurrence(s).", parent=self)
 
     def goto_dialog(self):
-        if self.word_wrap_var.get():
-            messagebox.showinfo("Notepad", "Go To is not available with Word Wrap turned on.")
+        if self.large_view is not None:
+            self._goto_large_view()
+            return
+        if self._loader is not None:
+            self._goto_while_loading(self._loader)
             return
 
         line_count = int(float(self.text.index("end-1c").split(".")[0]))
@@ -377,10 +1207,49 @@ class Notepad(tk.Tk):
             self.text.see(index)
             self._update_status_bar()
 
+    def _goto_while_loading(self, loader):
+        # With a cached line index any line can be picked up front; the jump
+        # happens as soon as that line has been inserted
+        line_count = loader.line_count()
+        if line_count is None:
+            line_count = int(self.text.index("end-1c").split(".")[0])
+        line_no = simpledialog.askinteger("Go To Line", f"Line number (1 - {line_count:,}):",
+                                          minvalue=1, maxvalue=line_count, parent=self)
+        if line_no is not None and loader is self._loader:
+            self._pending_goto = line_no
+            self._apply_pending_goto()
+
+    def _apply_pending_goto(self, final=False):
+        # The last line in the widget may still be partial until `final`
+        loaded = int(self.text.index("end-1c").split(".")[0])
+        if not final and self._pending_goto >= loaded:
+            return
+        index = f"{min(self._pending_goto, loaded)}.0"
+        self._pending_goto = None
+        self.text.mark_set("insert", index)
+        self.text.see(index)
+        self._schedule_ui("status")
+
+    def _goto_large_view(self):
+        view = self.large_view
+        if not view.index.complete:
+            messagebox.showinfo("Notepad", f"The line index is still being built "
+                                           f"({view.index_progress():.0%}). Please try again shortly.", parent=self)
+            return
+        line_count = view.index.line_count
+        line_no = simpledialog.askinteger("Go To Line", f"Line number (1 - {line_count}):",
+                                          minvalue=1, maxvalue=line_count, parent=self)
+        if line_no is not None:
+            view.goto_line(line_no)
+            self._update_status_bar()
+
     # ----------------------------------------------------------------------
     # Format & View
     # ----------------------------------------------------------------------
     def toggle_word_wrap(self):
+        if self.word_wrap_var.get() and self.large_view is not None:
+            self.word_wrap_var.set(False)
+            messagebox.showinfo("Notepad", "Word Wrap is not available in large file mode.", parent=self)
         if self.word_wrap_var.get():
             # Enable word wrap: no horizontal scrollbar
             self.text.config(wrap="word")
@@ -388,27 +1257,177 @@ class Notepad(tk.Tk):
         else:
             self.text.config(wrap="none")
             self.h_scroll.pack(side=tk.BOTTOM, fill=tk.X)
-        self._update_view_menu_state()
+        self.wrap_index.set_enabled(self.word_wrap_var.get())
+        self._schedule_ui("status")
 
     def font_dialog(self):
         FontDialog(self)
 
+    def _resolve_font_family(self, *candidates):
+        # Asks Tk what each name resolves to instead of listing every
+        # installed family, which is slow on systems with many fonts
+        for family in candidates:
+            actual = self.tk.call("font", "actual", (family, 11), "-family")
+            if str(actual).lower() == family.lower():
+                return family
+        return candidates[-1]
+
+    def font_families(self):
+        """Sorted installed font families, enumerated once on first use."""
+        if EditorWindow._font_families is None:
+            EditorWindow._font_families = sorted(set(font.families(self)))
+        return EditorWindow._font_families
+
+    def _prefetch_font_families(self):
+        # Listed in a Tcl interpreter of the worker's own, so the UI thread
+        # only waits if the Font dialog is opened before the list is ready
+        if self._font_families is None and EditorWindow._font_lister is None:
+            lister = EditorWindow._font_lister = _FontLister()
+            lister.start()
+            self.after(LOAD_POLL_MS, self._poll_font_lister, lister)
+
+    def _poll_font_lister(self, lister):
+        if lister.is_alive():
+            self.after(LOAD_POLL_MS, self._poll_font_lister, lister)
+            return
+        if EditorWindow._font_families is None and lister.families is not None:
+            EditorWindow._font_families = lister.families
+
+    def performance_window(self):
+        if not TRACER.enabled:
+            messagebox.showinfo("Performance", "Start Notepad with --trace (or set AINOTEPAD_TRACE=1) "
+                                               "to collect timings.", parent=self)
+            return
+        PerformanceWindow(self)
+
+    def toggle_follow(self):
+        self.set_follow(self.follow_var.get())
+
+    def set_follow(self, on):
+        # View > Follow: text written to the end of the file is appended to
+        # the buffer as it arrives
+        if not on:
+            if self.follower is not None:
+                self.follower.close()
+                self.follower = None
+            self.follow_var.set(False)
+            return
+        if self.follower is not None:
+            return
+        if not self.filename or self._loader is not None or self.large_view is not None or self.compression:
+            if self.large_view is not None:
+                reason = "large files"
+            elif self.compression:
+                reason = "compressed files"
+            else:
+                reason = "documents that are not loaded from a file"
+            messagebox.showinfo("Notepad", f"Follow is not available for {reason}.", parent=self)
+            self.follow_var.set(False)
+            return
+        if self.modified:
+            messagebox.showinfo("Notepad", "Save or discard your changes before turning on Follow.",
+                                parent=self)
+            self.follow_var.set(False)
+            return
+        try:
+            self.follower = FileFollower(self, self.filename, self._file_offset, self.encoding)
+        except OSError as e:
+            messagebox.showerror("Notepad", f"Cannot follow this file:\n{e}", parent=self)
+            self.follow_var.set(False)
+            return
+        self.follow_var.set(True)
+
+    def _follow_append(self, text):
+        at_bottom = self.text.yview()[1] >= 1.0
+        # Not an edit: kept out of the undo history and the modified state
+        with self.undo.suspended():
+            self.text.insert("end-1c", text)
+        self.modified = False
+        if at_bottom:
+            self.text.yview_moveto(1.0)
+        self.journal.rebase()
+
+    def _follow_reset(self):
+        # The file was truncated or replaced; it is read again from the start
+        self._raw_text("delete", "1.0", "end")
+        self._notify_text_reset()
+        self.modified = False
+
+    # ----------------------------------------------------------------------
+    # Reload on external change
+    # ----------------------------------------------------------------------
+    def _check_disk(self):
+        # Runs on focus-in: a stat, and only if that changed, a read on a worker
+        if (not self.filename or self._disk_stat is None or self._disk_check is not None
+                or self._loader is not None or self._saver is not None
+                or self.large_view is not None or self.follower is not None):
+            return
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return
+        if (st.st_size, st.st_mtime_ns) == self._disk_stat:
+            return
+        check = _DiskCheck(self.filename, self._disk_digest, self.document.snapshot())
+        check.generation = self._edit_generation
+        self._disk_check = check
+        check.start()
+        self.after(LOAD_POLL_MS, self._poll_disk_check, check)
+
+    def _poll_disk_check(self, check):
+        if check.is_alive():
+            self.after(LOAD_POLL_MS, self._poll_disk_check, check)
+            return
+        if check is not self._disk_check:
+            return  # its tab was put away meanwhile
+        self._disk_check = None
+        if check.error is not None or check.path != self.filename or self._loader is not None:
+            return
+        if check.hunks is None:
+            self._disk_stat = check.stat     # touched, same contents
+            return
+        if check.generation != self._edit_generation:
+            return  # edited while reading; look again on the next focus-in
+        self._disk_stat = check.stat         # no second prompt while this one is up
+        if self.modified:
+            name = os.path.basename(self.filename)
+            if not messagebox.askyesno("Notepad", f"{name} has been changed by another program.\n\n"
+                                                  f"Reload it? Your changes can be restored with Undo.",
+                                       parent=self):
+                self._disk_digest = check.digest
+                return
+        self._reload_from(check)
+
+    def _reload_from(self, check):
+        # Only the changed lines are replaced, as one undo step; marks, and
+        # so the cursor and the top of the view, move with the text
+        self.text.mark_set("reload_top", "@0,0")
+        self.text.mark_gravity("reload_top", "left")
+        xview = self.text.xview()[0]
+        with self.undo.group():
+            for first, last, text in check.hunks:
+                self.text.delete(f"{first + 1}.0", f"{last + 1}.0")
+                if text:
+                    self.text.insert(f"{first + 1}.0", text)
+        self.text.yview("reload_top")
+        self.text.xview_moveto(xview)
+        self.text.mark_unset("reload_top")
+        self.encoding = check.encoding
+        self.text.edit_modified(False)
+        self.modified = False
+        self._disk_stat = check.stat
+        self._disk_digest = check.digest
+        self._file_offset = check.stat[0]
+        self.journal.rebase()
+        self._update_title()
+        self._schedule_ui("status")
+
     def toggle_status_bar(self):
         if self.status_bar_var.get():
             self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
         else:
             self.status_bar.pack_forget()
-        self._update_view_menu_state()
-
-    def _update_view_menu_state(self):
-        # In classic Notepad, when Word Wrap is on, Status Bar is disabled
-        if self.word_wrap_var.get():
-            self.view_menu.entryconfig("Status Bar", state="disabled")
-            # Also Go To is disabled when Word Wrap is on
-            self.edit_menu.entryconfig("Go To...", state="disabled")
-        else:
-            self.view_menu.entryconfig("Status Bar", state="normal")
-            self.edit_menu.entryconfig("Go To...", state="normal")
+        self._update_status_bar()
 
     # ----------------------------------------------------------------------
     # Help
@@ -417,50 +1436,3477 @@ class Notepad(tk.Tk):
         messagebox.showinfo("Notepad Help",
                             "This is a Notepad-like editor written in Python with Tkinter.\n\n"
                             "It supports basic editing, find/replace, word wrap, font selection,\n"
-                            "status bar, and basic printing (on Windows).")
+                            "status bar, Page Setup, Print Preview and printing to PDF or\n"
+                            "PostScript files.", parent=self)
 
     def about_dialog(self):
         messagebox.showinfo("About Notepad",
                             "Notepad Clone\n\n"
                             "Written in Python using Tkinter.\n"
-                            "Designed to resemble Windows XP/7 Notepad.")
+                            "Designed to resemble Windows XP/7 Notepad.", parent=self)
 
     # ----------------------------------------------------------------------
-    # Internal helpers
+    # Tabs
     # ----------------------------------------------------------------------
-    def _on_text_modified(self, event=None):
-        if self.text.edit_modified():
-            self.modified = True
-            self._update_title()
-            self._update_status_bar()
-            self.text.edit_modified(False)
-
-    def _update_title(self):
-        name = self.filename if self.filename else "Untitled"
-        base = os.path.basename(name)
-        if self.modified:
-            self.title(f"*{base} - Notepad")
-        else:
-            self.title(f"{base} - Notepad")
+    def _add_tab_button(self, tab):
+        tab.number = next(self._tab_numbers)
+        tab.button = tk.Radiobutton(self.tab_bar, indicatoron=False, variable=self._tab_var,
+                                    value=tab.number, padx=8, command=lambda: self.select_tab(tab))
+        tab.button.bind("<Button-2>", lambda e: self.close_tab(tab))
+        tab.button.pack(side=tk.LEFT)
+        self._update_tab_label(tab)
 
-    def _update_status_bar(self, event=None):
-        if not self.status_bar_var.get():
+    def _update_tab_label(self, tab):
+        if tab is self.tab:
+            tab.filename, tab.modified = self.filename, self.modified
+        if tab.button is None:
             return
-        try:
-            index = self.text.index("insert")
-            line, col = index.split(".")
-            # Notepad shows column as 1-based
-            col = str(int(col) + 1)
-            self.status_bar.config(text=f"Ln {line}, Col {col}")
-        except Exception:
-            self.status_bar.config(text="Ln 1, Col 1")
+        label = ("*" if tab.modified else "") + os.path.basename(tab.filename or "Untitled")
+        if tab.button.cget("text") != label:
+            tab.button.config(text=label)
+        if tab is self.tab:
+            self._tab_var.set(tab.number)
 
+    def _pristine(self):
+        # Nothing worth keeping: an untouched Untitled document
+        return (self.filename is None and not self.modified and self.large_view is None
+                and self._saver is None and self.text.compare("end-1c", "==", "1.0"))
 
-# ----------------------------------------------------------------------
-# Find dialog
-# ----------------------------------------------------------------------
+    def _tab_for(self, path):
+        for tab in self.tabs:
+            filename = self.filename if tab is self.tab else tab.filename
+            with contextlib.suppress(OSError):
+                if filename and os.path.samefile(path, filename):
+                    return tab
+        return None
+
+    def new_tab(self):
+        """Opens an empty tab and shows it."""
+        pattern = self.highlighter.pattern
+        if not self._leave_tab():
+            return False
+        self.tab = _Tab()
+        self.tabs.append(self.tab)
+        self._init_document_state()
+        self._create_text()
+        self._create_helpers()
+        self._add_tab_button(self.tab)
+        self._enter_tab(pattern)
+        return True
+
+    def select_tab(self, tab):
+        if tab is not self.tab:
+            pattern = self.highlighter.pattern
+            if not self._leave_tab():
+                self._tab_var.set(self.tab.number)
+                return False
+            self._show_tab(tab, pattern)
+        return True
+
+    def select_next_tab(self, step=1):
+        if len(self.tabs) > 1:
+            self.select_tab(self.tabs[(self.tabs.index(self.tab) + step) % len(self.tabs)])
+
+    def close_tab(self, tab=None):
+        """Closes a tab after offering to save it; closing the last one closes the window."""
+        if len(self.tabs) == 1:
+            self.on_exit()
+            return
+        if tab is not None and not self.select_tab(tab):
+            return
+        if not self._maybe_save_changes():
+            return
+        self._wait_for_save()
+        self._cancel_insert()
+        self._cancel_load(keep_partial=False)
+        self._close_large_view()
+        self.set_follow(False)
+        self._close_previews()
+        self.journal.close()
+        self.highlighter.suspend()
+        self.wrap_index.suspend()
+        self.paginator.suspend()
+        tab = self.tab
+        index = self.tabs.index(tab)
+        self.tabs.remove(tab)
+        self._resident.remove(tab)
+        tab.button.destroy()
+        self._destroy_text(self.text)
+        self._show_tab(self.tabs[min(index, len(self.tabs) - 1)], self.highlighter.pattern)
+
+    def _leave_tab(self):
+        # Moves the shown document's state into its tab; refused while it is
+        # still loading or pasting
+        if self._loader is not None or self._inserter is not None:
+            self.bell()
+            return False
+        self._wait_for_save()
+        self.set_follow(False)
+        self._close_previews()
+        self._disk_check = None         # its result would come back to another document
+        self.highlighter.suspend()
+        self.wrap_index.suspend()
+        self.journal.suspend()
+        self.paginator.suspend()
+        tab = self.tab
+        tab.cursor = self.text.index("insert")
+        tab.yview = self.text.yview()[0]
+        self._update_tab_label(tab)
+        self.text.pack_forget()
+        tab.state = {name: getattr(self, name) for name in self.TAB_STATE}
+        return True
+
+    def _show_tab(self, tab, pattern):
+        self.tab = tab
+        for name, value in tab.state.items():
+            setattr(self, name, value)
+        tab.state = None
+        if self.text is None:
+            self._restore_tab(tab)
+        else:
+            self.text.pack(fill=tk.BOTH, expand=True)
+        self._enter_tab(pattern)
+
+    def _enter_tab(self, pattern):
+        # The window's settings (Word Wrap, Highlight All) carry over to the tab
+        tab = self.tab
+        view = self.large_view
+        self.v_scroll.config(command=view.on_scrollbar if view is not None else self.text.yview)
+        self.h_scroll.config(command=self.text.xview)
+        if view is not None:
+            self.word_wrap_var.set(False)
+        self.toggle_word_wrap()
+        self.wrap_index.invalidate()    # the font may have changed meanwhile
+        self.highlighter.set_pattern(pattern if view is None else None)
+        self.highlighter.resume()
+        if view is None:
+            self.text.mark_set("insert", tab.cursor)
+            self.text.yview_moveto(tab.yview)
+        self.text.focus_set()
+        if tab in self._resident:
+            self._resident.remove(tab)
+        self._resident.insert(0, tab)
+        for old in self._resident[TAB_RESIDENT:]:
+            # A large file view only holds a window of its file anyway
+            if old.state["large_view"] is None:
+                self._evict_tab(old)
+        self._update_title()
+        self._update_status_bar()
+
+    def _evict_tab(self, tab):
+        # Frees the Text widget and the document of a tab that is not shown
+        state = tab.state
+        data = (chunk.encode("utf-8", "surrogatepass") for chunk in state["document"].chunks())
+        if state["filename"] and not tab.modified:
+            # Same text as the file, so it can wait on disk
+            try:
+                tab.spill = tempfile.TemporaryFile(prefix="ainotepad-tab-")
+                tab.spill.writelines(data)
+            except OSError:
+                if tab.spill is not None:
+                    tab.spill.close()
+                tab.spill = None
+                data = (chunk.encode("utf-8", "surrogatepass") for chunk in state["document"].chunks())
+        if tab.spill is None:
+            compressor = zlib.compressobj(1)
+            tab.packed = b"".join([compressor.compress(chunk) for chunk in data] + [compressor.flush()])
+        state["undo"].pack()
+        if state["_clean_state"] is not None:
+            # The clean snapshot would keep the text alive; undo can still
+            # come back to the clean version
+            state["_clean_state"] = (state["_clean_state"][0], None)
+        self._destroy_text(state["text"])
+        state.update(text=None, _text_cmd=None, document=None, highlighter=None, wrap_index=None,
+                     _edit_listeners=None, _sel_cache=None)
+        self._resident.remove(tab)
+
+    def _restore_tab(self, tab):
+        if tab.spill is not None:
+            tab.spill.seek(0)
+            data = tab.spill.read()
+            tab.spill.close()
+        else:
+            data = zlib.decompress(tab.packed)
+        tab.spill = tab.packed = None
+        text = data.decode("utf-8", "surrogatepass")
+        self._create_text()
+        self._raw_text("insert", "1.0", text)
+        self.document = Document(text)
+        self._create_helpers()
+        if not tab.modified:
+            self.modified = False
+
+    def _discard_tab(self, tab):
+        # A tab that is not shown, as its window closes
+        state = tab.state
+        state["journal"].close()
+        if state["large_view"] is not None:
+            state["large_view"].close()
+        if state["text"] is not None:
+            self._destroy_text(state["text"])
+        if tab.spill is not None:
+            tab.spill.close()
+        if tab.button is not None:
+            tab.button.destroy()
+        self.tabs.remove(tab)
+        if tab in self._resident:
+            self._resident.remove(tab)
+
+    def _destroy_text(self, widget):
+        widget.destroy()
+        self.tk.call("rename", str(widget), "")     # the proxy proc, see _install_text_proxy
+
+    def _close_previews(self):
+        # A preview shows the document of the tab it was opened from
+        for child in self.winfo_children():
+            if isinstance(child, PrintPreview):
+                child.destroy()
+
+    # ----------------------------------------------------------------------
+    # Internal helpers
+    # ----------------------------------------------------------------------
+    def _install_text_proxy(self):
+        # Route the Text widget's Tcl command through a proc so edits can be
+        # vetoed (read-only views). Other subcommands pass straight through
+        # in Tcl, so errors propagate to Tk's own bindings as usual.
+        widget = str(self.text)
+        self._text_cmd = widget + "_orig"
+        self.tk.call("rename", widget, self._text_cmd)
+        if self._text_hook is None:
+            self._text_hook = self.register(self._text_edit_hook)
+        hook = self._text_hook
+        self.tk.eval(f"""
+            proc {widget} args {{
+                if {{[lindex $args 0] in {{insert delete replace}}}} {{
+                    if {{![{hook} {{*}}$args]}} {{ return }}
+                }}
+                uplevel 1 [list {self._text_cmd} {{*}}$args]
+            }}
+        """)
+
+    def _text_edit_hook(self, *args):
+        if self._read_only:
+            self.bell()
+            return 0
+        if self._edit_listeners:
+            try:
+                changes = self._describe_edit(args)
+            except tk.TclError:
+                return 0  # bad index: Tk would not change anything either
+            for change in changes:
+                for listener in self._edit_listeners:
+                    try:
+                        listener(*change)
+                    except Exception:
+                        self._root().report_callback_exception(*sys.exc_info())
+        return 1
+
+    def _describe_edit(self, args):
+        # Normalize an insert/delete/replace about to run into a list of
+        # ("insert", index, None, chars) and ("delete", start, end, None)
+        # changes, in the order they apply.
+        op = args[0]
+        if op == "insert":
+            index = str(self._raw_text("index", args[1]))
+            if self.tk.getboolean(self._raw_text("compare", index, "==", "end")):
+                index = str(self._raw_text("index", "end-1c"))
+            return [("insert", index, None, "".join(args[2::2]))]
+        if op == "replace":
+            changes = self._describe_delete(args[1:3])
+            start = changes[0][1] if changes else str(self._raw_text("index", args[1]))
+            return changes + [("insert", start, None, "".join(args[3::2]))]
+        return self._describe_delete(args[1:])
+
+    def _describe_delete(self, indices):
+        last = str(self._raw_text("index", "end-1c"))
+        changes = []
+        for k in range(0, len(indices), 2):
+            start = str(self._raw_text("index", indices[k]))
+            end = indices[k + 1] if k + 1 < len(indices) else f"{start}+1c"
+            end = str(self._raw_text("index", end))
+            if self.tk.getboolean(self._raw_text("compare", end, ">", last)):
+                end = last  # the final newline is never deleted
+            if self.tk.getboolean(self._raw_text("compare", start, "<", end)):
+                changes.append(("delete", start, end, None))
+        # Later ranges first, so earlier indexes stay valid
+        changes.sort(key=lambda c: tuple(map(int, c[1].split("."))), reverse=True)
+        return changes
+
+    def _count_edit(self, kind, start, end, chars):
+        self._edit_generation += 1
+        self._schedule_ui("title")
+
+    def _track_counts(self, kind, start, end, chars):
+        # Line and character totals for the status bar, kept up to date per
+        # edit instead of being recounted from the whole buffer
+        if kind == "reset":
+            self._line_count = int(self.text.index("end-1c").split(".")[0])
+            self._char_count = None     # counted when next shown
+        elif kind == "insert":
+            self._line_count += chars.count("\n")
+            if self._char_count is not None:
+                self._char_count += len(chars)
+        else:
+            self._line_count -= int(end.split(".")[0]) - int(start.split(".")[0])
+            if self._char_count is not None:
+                self._char_count -= self._count_chars(start, end)
+        self._schedule_ui("status")
+
+    def _notify_text_reset(self, document=None):
+        # The whole buffer was replaced behind the proxy (e.g. a file load).
+        # `document` holds the new text if the caller built one already.
+        if document is None:
+            document = Document(self._raw_text("get", "1.0", "end-1c") if self.large_view is None else "")
+        self.document = document
+        for listener in self._edit_listeners:
+            listener("reset", None, None, None)
+
+    def _sync_document(self, kind, start, end, chars):
+        doc = self.document
+        if kind == "insert":
+            doc.insert(doc.offset(start), chars)
+        elif kind == "delete":
+            doc.delete(doc.offset(start), doc.offset(end))
+
+    def _raw_text(self, *args):
+        # Widget command that bypasses the read-only guard
+        return self.tk.call((self._text_cmd,) + args)
+
+    @property
+    def modified(self):
+        # Clean if undo/redo is back at the version that was opened or saved,
+        # or the text is the same as it was then (e.g. retyped by hand). The
+        # fingerprints only rule texts out; a match is confirmed by comparing.
+        if self._clean_state is None:
+            return True
+        version, clean = self._clean_state
+        if self.undo.version == version:
+            return False
+        if clean is None or self.document.fingerprint != clean.fingerprint:
+            return True
+        if not self.document.same_text(clean):
+            return True
+        self._clean_state = (self.undo.version, clean)
+        return False
+
+    @modified.setter
+    def modified(self, value):
+        # False marks the current text as the one on disk; True keeps the
+        # window modified until the next save (e.g. recovered text)
+        self._clean_state = None if value else (self.undo.version, self.document.snapshot())
+
+    def _on_text_modified(self, event=None):
+        # Tk's flag is left set until the next open/save; per-edit title
+        # updates come from _count_edit
+        if self._read_only:
+            self.text.edit_modified(False)
+            return
+        self._schedule_ui("title")
+
+    def _schedule_ui(self, *parts):
+        # Merge bursts of title/status refreshes into at most one per frame
+        self._ui_dirty.update(parts)
+        if self._ui_job is None:
+            wait = UI_FRAME_MS - (time.perf_counter() - self._ui_last) * 1000.0
+            if wait > 0:
+                self._ui_job = self.after(int(wait) + 1, self._flush_ui)
+            else:
+                self._ui_job = self.after_idle(self._flush_ui)
+
+    def _flush_ui(self):
+        self._ui_job = None
+        self._ui_last = time.perf_counter()
+        parts, self._ui_dirty = self._ui_dirty, set()
+        if "title" in parts:
+            self._update_title()
+        if "status" in parts:
+            self._update_status_bar()
+
+    def _update_title(self):
+        name = self.filename if self.filename else "Untitled"
+        base = os.path.basename(name)
+        if self._saver is not None:
+            title = f"Saving... {base} - Notepad"
+        elif self.modified:
+            title = f"*{base} - Notepad"
+        else:
+            title = f"{base} - Notepad"
+        if title != self._title:
+            self._title = title
+            self.title(title)
+        if self.tab.button is not None:
+            self._update_tab_label(self.tab)
+
+    def _set_status_message(self, message):
+        # A message (e.g. load progress) takes the place of "Ln, Col" until cleared
+        self._status_message = message
+        if message is None:
+            self._update_status_bar()
+        else:
+            self.status_bar.config(text=message)
+
+    def _update_status_bar(self, event=None):
+        if not self.status_bar_var.get():
+            return
+        if self._status_message is not None:
+            self.status_bar.config(text=self._status_message)
+            return
+        if self.large_view is not None:
+            line, col = self.large_view.cursor()
+            lines = self.large_view.total_lines()
+            parts = [f"Ln {line + 1}, Col {col + 1}",
+                     f"{lines:,} lines" if self.large_view.index.complete else f"~{lines:,} lines",
+                     self.large_view.encoding]
+            if not self.large_view.index.complete:
+                parts.append(f"Indexing lines... {self.large_view.index_progress():.0%}")
+            self.status_bar.config(text="    ".join(parts))
+            return
+        try:
+            index = self.text.index("insert")
+            line, col = index.split(".")
+            # Notepad shows column as 1-based
+            col = str(int(col) + 1)
+            parts = [f"Ln {line}, Col {col}"]
+        except Exception:
+            parts = ["Ln 1, Col 1"]
+        if self.wrap_index.enabled:
+            # Display rows; lines not measured yet count as one row
+            approx = "" if self.wrap_index.complete else "~"
+            parts.append(f"Row {approx}{self.wrap_index.row('insert') + 1:,} "
+                         f"of {approx}{self.wrap_index.total():,}")
+        selected = self._selection_length()
+        if selected:
+            parts.append(f"{selected:,} selected")
+        if self._char_count is None:
+            self._char_count = self._count_chars("1.0", "end-1c")
+        parts.append(f"{self._line_count:,} lines, {self._char_count:,} characters")
+        parts.append(self.encoding if self.compression is None else f"{self.encoding} ({self.compression[0]})")
+        parts.append(f"Undo {_format_size(self.undo.memory)}")
+        if self.match_status_var.get():
+            parts.append(self.match_status_var.get())
+        self.status_bar.config(text="    ".join(parts))
+
+    def _count_chars(self, start, end):
+        # Text.count() returns None rather than 0 for an empty range
+        return (self.text.count(start, end, "chars") or (0,))[0]
+
+    def _selection_length(self):
+        ranges = self.text.tag_ranges("sel")
+        if not ranges:
+            return 0
+        key = (str(ranges[0]), str(ranges[1]), self._edit_generation)
+        if self._sel_cache is None or self._sel_cache[0] != key:
+            self._sel_cache = (key, self._count_chars(ranges[0], ranges[1]))
+        return self._sel_cache[1]
+
+
+class Notepad(EditorWindow, tk.Tk):
+    """The main window. The process exits when it and every other editor window are closed."""
+
+    def __init__(self):
+        super().__init__()
+        self.windows = []               # EditorToplevels opened from this process
+        self.closed = False
+        self.instance_server = None
+        self.after_idle(self._offer_recovery)
+        self.after_idle(self._prefetch_font_families)
+        TRACER.start_heartbeat(self)
+
+    def open_windows(self, paths):
+        # A None path opens an empty window. The main window is reused while
+        # it is still open and holds nothing. In tabbed mode everything opens
+        # in tabs of the main window, or of the newest one once it is closed.
+        for path in paths:
+            if self.tabbed:
+                window = self.windows[-1] if self.closed else self
+                if not path and not window._pristine():
+                    window.new_tab()
+            else:
+                window = self if not self.closed and self._pristine() else EditorToplevel(self)
+            window.deiconify()
+            window.lift()
+            window.focus_force()
+            if path:
+                window.open_file(path)
+
+    def _close_window(self):
+        if not self.windows:
+            self._quit()
+            return
+        # Closing the root would take the other windows with it
+        self.closed = True
+        self.withdraw()
+        self._raw_text("delete", "1.0", "end")
+        self._notify_text_reset()
+        self.undo.clear()
+        self.filename = None
+
+    def _window_closed(self, window):
+        self.windows.remove(window)
+        if self.closed and not self.windows:
+            self._quit()
+
+    def _quit(self):
+        if self.instance_server is not None:
+            self.instance_server.close()
+        if TRACER.export_path:
+            with contextlib.suppress(OSError):
+                TRACER.export(TRACER.export_path)
+        self.destroy()
+
+
+class EditorToplevel(EditorWindow, tk.Toplevel):
+    def __init__(self, root: Notepad):
+        super().__init__(root)
+        self.current_font_family = root.current_font_family
+        self.current_font_size = root.current_font_size
+        self.current_font_weight = root.current_font_weight
+        self.current_font_slant = root.current_font_slant
+        self.text_font.config(family=self.current_font_family, size=self.current_font_size,
+                              weight=self.current_font_weight, slant=self.current_font_slant)
+        root.windows.append(self)
+
+    def _close_window(self):
+        self.destroy()
+        self.master._window_closed(self)
+
+
+class _PendingInsert:
+    """A large paste in progress; `group` is its undo step."""
+
+    def __init__(self, text, group):
+        self.text = text
+        self.group = group
+        self.pos = 0
+
+
+class _Tab:
+    """One document of a tabbed window.
+
+    The shown tab's state lives on the window; the others keep it in `state`
+    (see EditorWindow.TAB_STATE). Only TAB_RESIDENT tabs keep a Text widget:
+    the text of the rest waits in a temporary file if it matches its file,
+    otherwise zlib-compressed in `packed`, and their undo history is packed.
+    """
+
+    def __init__(self):
+        self.number = 0
+        self.button = None
+        self.state = None
+        self.filename = None
+        self.modified = False
+        self.cursor = "1.0"
+        self.yview = 0.0
+        self.spill = None
+        self.packed = None
+
+
+# ----------------------------------------------------------------------
+# Text engine
+# ----------------------------------------------------------------------
+def replace_all_in_text(text, find_text, replace_text, match_case, regex=False):
+    """Compute Replace All over `text` in a single pass.
+
+    Returns (start, end, replacement, count): text[start:end] is the span
+    from the first to the last match and `replacement` is what it becomes.
+    With `regex`, replace_text is a template that may refer to groups.
+    """
+    if regex:
+        parts = []
+        start = end = count = 0
+        for m in compile_search(find_text, match_case, True).finditer(text):
+            if not count:
+                start = end = m.start()
+            parts.append(text[end:m.start()])
+            parts.append(m.expand(replace_text))
+            end = m.end()
+            count += 1
+        return start, end, "".join(parts), count
+
+    if match_case:
+        start = text.find(find_text)
+        if start < 0:
+            return 0, 0, "", 0
+        end = text.rfind(find_text) + len(find_text)
+        span = text[start:end]
+        return start, end, span.replace(find_text, replace_text), span.count(find_text)
+
+    pattern = compile_search(find_text, False, False)
+    matches = pattern.finditer(text)
+    first = next(matches, None)
+    if first is None:
+        return 0, 0, "", 0
+    end = first.end()
+    for m in matches:
+        end = m.end()
+    # Escape backslashes so the replacement is taken literally
+    replacement, count = pattern.subn(replace_text.replace("\\", "\\\\"),
+                                      text[first.start():end])
+    return first.start(), end, replacement, count
+
+
+def _end_index(index, text):
+    # Index just past `text` inserted at "line.col" index
+    line, col = map(int, index.split("."))
+    newlines = text.count("\n")
+    if not newlines:
+        return f"{line}.{col + len(text)}"
+    return f"{line + newlines}.{len(text) - text.rfind(chr(10)) - 1}"
+
+
+def _format_size(n):
+    for unit in ("bytes", "KB", "MB"):
+        if n < 1024 or unit == "MB":
+            return f"{n} {unit}" if unit == "bytes" else f"{n:.1f} {unit}"
+        n /= 1024.0
+
+
+@functools.lru_cache(maxsize=64)
+def compile_search(find_text, match_case, regex):
+    """Compiled pattern for the Find/Replace options.
+
+    Cached, so F3, highlighting and Replace All reuse the same object.
+    Raises re.error for an invalid regular expression.
+    """
+    flags = re.MULTILINE | (0 if match_case else re.IGNORECASE)
+    return re.compile(find_text if regex else re.escape(find_text), flags)
+
+
+# Pattern text that may match a line break, or tell the text's ends from line ends
+_CROSSES_LINES = re.compile(r"\n|\\[nsWDAZ]|\\x0[aA]|\\0?12|\\u000[aA]|\\N\{|\[\^|\(\?[aiLmux-]*s")
+
+
+def crosses_lines(pattern):
+    """Whether a match of `pattern` may span lines (conservatively)."""
+    return bool(pattern.flags & re.DOTALL) or _CROSSES_LINES.search(pattern.pattern) is not None
+
+
+def search_nonempty(pattern, text, pos=0):
+    """First match of `pattern` in `text` from `pos` that is not empty, or None."""
+    m = pattern.search(text, pos)
+    while m is not None and m.start() == m.end():
+        if m.start() >= len(text):
+            return None
+        m = pattern.search(text, m.start() + 1)
+    return m
+
+
+# ----------------------------------------------------------------------
+# Document model
+# ----------------------------------------------------------------------
+_ASTRAL = re.compile("[\U00010000-\U0010ffff]")
+
+
+def _is_prime(n):
+    # Miller-Rabin; these bases decide every n below 3.3e24
+    if n < 2:
+        return False
+    bases = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+    for p in bases:
+        if n % p == 0:
+            return n == p
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+    for a in bases:
+        x = pow(a, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _random_prime(bits):
+    while True:
+        n = secrets.randbits(bits) | (1 << (bits - 1)) | 1
+        if _is_prime(n):
+            return n
+
+
+# Fingerprints are polynomial hashes in base 2**32 (one term per character)
+# modulo a prime picked at random per process, so no fixed pair of texts
+# collides; they are only a hint, see EditorWindow.modified
+_HASH_MOD = _random_prime(64)
+
+
+def _digest(text, start, end):
+    # (hash, 2**(32*length)) of text[start:end]
+    data = text[start:end].encode("utf-32-le", "surrogatepass")
+    return int.from_bytes(data, "little") % _HASH_MOD, pow(2, 32 * (end - start), _HASH_MOD)
+
+
+class _Piece:
+    """Treap node for one piece: text[start:end] plus totals for its subtree.
+
+    Nodes are never changed once built; edits copy the path they touch, so
+    a tree that was handed out (Document.snapshot) stays valid.
+    """
+
+    __slots__ = ("text", "start", "end", "newlines", "digest", "priority", "left", "right",
+                 "length", "lines", "hash", "weight")
+
+    def __init__(self, text, start, end, newlines, digest, priority, left, right):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.newlines = newlines
+        self.digest = digest
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.length = end - start
+        self.lines = newlines
+        h, w = digest
+        if right is not None:
+            self.length += right.length
+            self.lines += right.lines
+            h = (h + w * right.hash) % _HASH_MOD
+            w = w * right.weight % _HASH_MOD
+        if left is not None:
+            self.length += left.length
+            self.lines += left.lines
+            h = (left.hash + left.weight * h) % _HASH_MOD
+            w = left.weight * w % _HASH_MOD
+        self.hash = h
+        self.weight = w
+
+    def with_children(self, left, right):
+        return _Piece(self.text, self.start, self.end, self.newlines, self.digest, self.priority,
+                      left, right)
+
+
+def _leaf(text, start, end, newlines=None, digest=None):
+    if newlines is None:
+        newlines = text.count("\n", start, end)
+    if digest is None:
+        digest = _digest(text, start, end)
+    return _Piece(text, start, end, newlines, digest, random.random(), None, None)
+
+
+def _pieces_of(text):
+    # Long strings are referenced in slices so that no piece is too long to scan
+    root = None
+    for start in range(0, len(text), Document.PIECE_MAX):
+        root = _merge(root, _leaf(text, start, min(start + Document.PIECE_MAX, len(text))))
+    return root
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        return a.with_children(a.left, _merge(a.right, b))
+    return b.with_children(_merge(a, b.left), b.right)
+
+
+def _split(node, offset):
+    # (first `offset` characters, the rest)
+    if node is None:
+        return None, None
+    before = node.left.length if node.left is not None else 0
+    if offset <= before:
+        left, right = _split(node.left, offset)
+        return left, node.with_children(right, node.right)
+    size = node.end - node.start
+    if offset >= before + size:
+        left, right = _split(node.right, offset - before - size)
+        return node.with_children(node.left, left), right
+    cut = node.start + offset - before
+    head = _leaf(node.text, node.start, cut)
+    # The tail's hash follows from the head's: H(tail) = (H(piece) - H(head)) / w(head)
+    h, w = node.digest
+    inverse = pow(head.weight, -1, _HASH_MOD)
+    digest = ((h - head.hash) * inverse % _HASH_MOD, w * inverse % _HASH_MOD)
+    tail = _leaf(node.text, cut, node.end, node.newlines - head.newlines, digest)
+    return _merge(node.left, head), _merge(tail, node.right)
+
+
+class Document:
+    """The editor's text as a piece table, independent of Tk.
+
+    Pieces refer to the strings the text arrived in (file chunks as loaded,
+    then one string per insert) and sit in a treap that keeps character and
+    newline totals, so offsets and line numbers convert in O(log n). The
+    tree is persistent: snapshot() is O(1) and may be read from another
+    thread while editing goes on. Lines are 1-based and columns count
+    characters; index()/offset() convert to and from Tk "line.col" indexes,
+    whose columns count UTF-16 units.
+
+    The Text widget keeps a copy of its own, as Tk cannot display Python
+    strings in place; memory() is what this one adds (see the benchmarks).
+    """
+
+    COALESCE = 256              # inserted pieces shorter than this are merged as you type
+    PIECE_MAX = 64 * 1024       # longer strings are split over several pieces
+
+    def __init__(self, text=""):
+        self._root = _pieces_of(text)
+
+    @property
+    def length(self):
+        return self._root.length if self._root is not None else 0
+
+    @property
+    def line_count(self):
+        return (self._root.lines if self._root is not None else 0) + 1
+
+    @property
+    def fingerprint(self):
+        """(length, hash) of the text, kept up to date by every edit."""
+        return (self._root.length, self._root.hash) if self._root is not None else (0, 0)
+
+    def snapshot(self):
+        copy = Document()
+        copy._root = self._root
+        return copy
+
+    def same_text(self, other):
+        """Whether `other` holds the same text, compared a chunk at a time."""
+        if self._root is other._root:
+            return True
+        if self.length != other.length:
+            return False
+        step = LOAD_CHUNK_SIZE
+        return all(self.get(a, a + step) == other.get(a, a + step) for a in range(0, self.length, step))
+
+    def memory(self):
+        """Approximate bytes held by the pieces and the strings they refer to."""
+        total, strings, stack = 0, {}, [self._root]
+        while stack:
+            node = stack.pop()
+            if node is not None:
+                total += sys.getsizeof(node)
+                strings[id(node.text)] = node.text
+                stack += (node.left, node.right)
+        return total + sum(map(sys.getsizeof, strings.values()))
+
+    # -- editing -------------------------------------------------------------
+    def append(self, text):
+        """Add text at the end as a piece of its own (e.g. a chunk being loaded)."""
+        self._root = _merge(self._root, _pieces_of(text))
+
+    def insert(self, offset, text):
+        if not text:
+            return
+        offset = min(max(offset, 0), self.length)
+        left, right = _split(self._root, offset)
+        last = left
+        while last is not None and last.right is not None:
+            last = last.right
+        if last is not None and last.end - last.start < self.COALESCE and len(text) < self.COALESCE:
+            # Typing: extend the previous small piece rather than add another
+            left, _ = _split(left, offset - (last.end - last.start))
+            text = last.text[last.start:last.end] + text
+        self._root = _merge(_merge(left, _pieces_of(text)), right)
+
+    def delete(self, start, end):
+        start, end = max(start, 0), min(end, self.length)
+        if start >= end:
+            return
+        left, rest = _split(self._root, start)
+        _, right = _split(rest, end - start)
+        self._root = _merge(left, right)
+
+    # -- reading -------------------------------------------------------------
+    def pieces(self, start=0, end=None):
+        """Yields the text between two offsets as it is stored, piece by piece."""
+        end = self.length if end is None else min(end, self.length)
+        # Descend to the piece holding `start`; the stack keeps the nodes
+        # whose pieces come after it, nearest on top
+        stack = []
+        node, base = self._root, 0
+        while node is not None and start < end:
+            before = node.left.length if node.left is not None else 0
+            if start < base + before:
+                stack.append((node, base))
+                node = node.left
+            elif start < base + before + node.end - node.start:
+                stack.append((node, base))
+                break
+            else:
+                base += before + node.end - node.start
+                node = node.right
+        while stack and start < end:
+            node, base = stack.pop()
+            piece_start = base + (node.left.length if node.left is not None else 0)
+            a = node.start + start - piece_start
+            b = node.start + min(end - piece_start, node.end - node.start)
+            yield node.text if (a, b) == (0, len(node.text)) else node.text[a:b]
+            start = piece_start + node.end - node.start
+            node = node.right
+            while node is not None:
+                stack.append((node, start))
+                node = node.left
+
+    def chunks(self, start=0, end=None, size=LOAD_CHUNK_SIZE):
+        """Like pieces(), but small pieces are joined into strings of about `size`."""
+        batch, held = [], 0
+        for piece in self.pieces(start, end):
+            batch.append(piece)
+            held += len(piece)
+            if held >= size:
+                yield "".join(batch)
+                batch, held = [], 0
+        if batch:
+            yield "".join(batch)
+
+    def get(self, start=0, end=None):
+        return "".join(self.pieces(start, end))
+
+    def line_start(self, line):
+        """Offset of the start of `line`; the document length past the last line."""
+        n = line - 1
+        if n <= 0:
+            return 0
+        node, base = self._root, 0
+        while node is not None:
+            before = node.left.lines if node.left is not None else 0
+            if n <= before:
+                node = node.left
+                continue
+            n -= before
+            base += node.left.length if node.left is not None else 0
+            if n <= node.newlines:
+                pos = node.start - 1
+                for _ in range(n):
+                    pos = node.text.find("\n", pos + 1)
+                return base + pos + 1 - node.start
+            n -= node.newlines
+            base += node.end - node.start
+            node = node.right
+        return self.length
+
+    def line_range(self, first, last):
+        """Offsets from the start of `first` to the end of `last` (before its newline)."""
+        end = self.line_start(last + 1) - 1 if last < self.line_count else self.length
+        return self.line_start(first), end
+
+    def position(self, offset):
+        """(line, column) of an offset."""
+        offset = min(max(offset, 0), self.length)
+        node, base, line = self._root, 0, 1
+        while node is not None:
+            before = node.left.length if node.left is not None else 0
+            if offset < base + before:
+                node = node.left
+                continue
+            if node.left is not None:
+                line += node.left.lines
+            base += before
+            if offset < base + node.end - node.start:
+                line += node.text.count("\n", node.start, node.start + offset - base)
+                break
+            line += node.newlines
+            base += node.end - node.start
+            node = node.right
+        return line, offset - self.line_start(line)
+
+    def offset(self, index):
+        """Offset of a Tk "line.col" index as Text.index() returns it."""
+        line, col = map(int, str(index).split("."))
+        start = self.line_start(line)
+        head = self.get(start, start + col).partition("\n")[0]
+        if _ASTRAL.search(head) is None:
+            return start + len(head)
+        units = 0
+        for i, ch in enumerate(head):
+            if units >= col:
+                return start + i
+            units += 2 if ch > "\uffff" else 1
+        return start + len(head)
+
+    def index(self, offset):
+        """Tk "line.col" index of an offset."""
+        line, col = self.position(offset)
+        start = self.line_start(line)
+        col += len(_ASTRAL.findall(self.get(start, start + col)))
+        return f"{line}.{col}"
+
+
+# ----------------------------------------------------------------------
+# Encodings
+# ----------------------------------------------------------------------
+def detect_encoding(sample):
+    """Name (a key of ENCODINGS) of the encoding of a file starting with `sample`."""
+    for name in ("UTF-8 with BOM", "UTF-16 LE", "UTF-16 BE"):
+        if sample.startswith(ENCODINGS[name][1]):
+            return name
+    # UTF-16 without a BOM: mostly-ASCII text leaves every other byte zero
+    even, odd = sample[0:4096:2], sample[1:4096:2]
+    if len(odd) >= 8:
+        if odd.count(0) > len(odd) * 0.4 and even.count(0) < len(even) * 0.1:
+            return "UTF-16 LE"
+        if even.count(0) > len(even) * 0.4 and odd.count(0) < len(odd) * 0.1:
+            return "UTF-16 BE"
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "UTF-8"
+    except UnicodeDecodeError:
+        return "ANSI"
+
+
+def make_decoder(encoding):
+    """Incremental decoder for an ENCODINGS name (the BOM must already be skipped)."""
+    if encoding == "UTF-8":
+        return _Utf8OrAnsiDecoder()
+    return codecs.getincrementaldecoder(ENCODINGS[encoding][0])(errors="replace")
+
+
+def decode_bytes(data, encoding=None):
+    """Decodes a whole file the way _FileLoader does; returns (text, encoding)."""
+    if encoding is None:
+        encoding = detect_encoding(data[:max(LOAD_CHUNK_SIZE, SNIFF_SIZE)])
+    bom = ENCODINGS[encoding][1]
+    if bom and data.startswith(bom):
+        data = data[len(bom):]
+    raw = make_decoder(encoding)
+    text = io.IncrementalNewlineDecoder(raw, translate=True).decode(data, final=True)
+    return text, getattr(raw, "encoding", encoding)
+
+
+class _Utf8OrAnsiDecoder(codecs.IncrementalDecoder):
+    """UTF-8 decoder for files whose sniffed prefix was valid UTF-8.
+
+    If invalid UTF-8 turns up while everything decoded so far was ASCII the
+    file is really ANSI, and decoding switches to cp1252 without starting
+    over; otherwise the bad bytes are replaced. `encoding` tells which.
+    """
+
+    def __init__(self, errors="strict"):
+        super().__init__(errors)
+        self.encoding = "UTF-8"
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._ascii = True
+
+    def decode(self, data, final=False):
+        if self._decoder.errors != "strict":
+            return self._decoder.decode(data, final)
+        state = self._decoder.getstate()
+        try:
+            text = self._decoder.decode(data, final)
+        except UnicodeDecodeError:
+            if self._ascii:
+                self.encoding = "ANSI"
+                self._decoder = codecs.getincrementaldecoder("cp1252")(errors="replace")
+                return self._decoder.decode(state[0] + data, final)
+            self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            self._decoder.setstate(state)
+            return self._decoder.decode(data, final)
+        if self._ascii and not text.isascii():
+            self._ascii = False
+        return text
+
+    def reset(self):
+        self._decoder.reset()
+
+
+# ----------------------------------------------------------------------
+# Compressed files
+# ----------------------------------------------------------------------
+_DECOMPRESS_ERRORS = (EOFError, zlib.error) + ((lzma.LZMAError,) if lzma is not None else ())
+
+
+def sniff_compression(head):
+    """Name of the format a file starting with `head` is compressed in, or None."""
+    for name, (magic, _, module, _) in COMPRESSIONS.items():
+        if module is not None and head.startswith(magic):
+            return name
+    return None
+
+
+def compression_for_path(path):
+    """Name of the format a file name's extension asks for, or None."""
+    ext = os.path.splitext(path)[1].lower()
+    for name, (_, extension, module, _) in COMPRESSIONS.items():
+        if module is not None and ext == extension:
+            return name
+    return None
+
+
+def compression_level(name, head):
+    # As far as the header tells: gzip only flags "best" and "fastest", and
+    # xz does not record its preset at all
+    if name == "gzip":
+        return {2: 9, 4: 1}.get(head[8] if len(head) > 8 else None, 6)
+    if name == "bzip2" and head[3:4].isdigit():
+        return int(head[3:4])
+    return COMPRESSIONS[name][3]
+
+
+def open_decompressed(f):
+    """Wraps the binary file `f` to read it decompressed if it is compressed.
+
+    Returns (reader, compression); compression is (format, level) or None.
+    """
+    head = f.read(16)
+    f.seek(0)
+    name = sniff_compression(head)
+    if name is None:
+        return f, None
+    return COMPRESSIONS[name][2].open(f, "rb"), (name, compression_level(name, head))
+
+
+def open_compressed(f, compression):
+    """Wraps the binary file `f` to write it compressed as (format, level)."""
+    name, level = compression
+    module = COMPRESSIONS[name][2]
+    if module is lzma:
+        return lzma.open(f, "wb", preset=level)
+    return module.open(f, "wb", compresslevel=level)
+
+
+# ----------------------------------------------------------------------
+# Background file loader
+# ----------------------------------------------------------------------
+class _FileLoader(threading.Thread):
+    """Reads a file in fixed-size chunks and decodes it on a worker thread.
+
+    Decoded text is handed to the UI thread through a bounded queue, so at
+    most a few chunks are held in memory beyond what the Text widget keeps.
+    """
+
+    EOF = object()
+
+    def __init__(self, path, chunk_size=LOAD_CHUNK_SIZE, translate=True):
+        super().__init__(daemon=True)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.translate = translate  # False keeps \r\n and \r line endings as they are
+        self.chunks = queue.Queue(maxsize=8)
+        self.size = 0
+        self.bytes_read = 0
+        self.encoding = None
+        self.compression = None     # (format, level) if the file is compressed
+        self.newlines = None        # line endings seen so far, as io.IncrementalNewlineDecoder reports them
+        self.stat = None            # (size, mtime_ns) when opened
+        self.digest = None          # hash of the bytes read, once complete
+        self.chars = 0
+        self.decode_seconds = 0.0
+        self.line_index = None      # LineIndex of the raw bytes, for big files
+        self.error = None
+        self.on_done = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def progress(self):
+        return self.bytes_read / self.size if self.size else 1.0
+
+    def line_count(self):
+        """Lines in the file if known before it has been read, else None."""
+        index = self.line_index
+        return index.line_count if index is not None and index.complete else None
+
+    def run(self):
+        # Any failure ends the load with an error; the UI waits for EOF
+        try:
+            self.size = os.path.getsize(self.path)
+            self._read()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._put(self.EOF)
+
+    def _read(self):
+        # One pass: the encoding is picked from the first chunk and the file
+        # is decoded incrementally from there on. Compressed files are
+        # decompressed a chunk at a time on the way; progress and the stat
+        # refer to the compressed file, the digest to the decompressed bytes.
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.stat = (st.st_size, st.st_mtime_ns)
+            reader, self.compression = open_decompressed(f)
+            digest = hashlib.blake2b(digest_size=16)
+            data = reader.read(max(self.chunk_size, SNIFF_SIZE))
+            digest.update(data)
+            self.encoding = detect_encoding(data)
+            index = None
+            # UTF-16 does not mark lines with b"\n", so its bytes are not indexed;
+            # nor are compressed files, whose offsets could not be seeked to
+            if (st.st_size >= LINE_INDEX_CACHE_MIN and not self.encoding.startswith("UTF-16")
+                    and self.compression is None):
+                self.line_index = LineIndex.load_cached(self.path, self.stat)
+                if self.line_index is None:
+                    index = self.line_index = LineIndex()
+            if index is not None:
+                index.feed(data)
+            bom = ENCODINGS[self.encoding][1]
+            if bom and data.startswith(bom):
+                data = data[len(bom):]
+            raw = make_decoder(self.encoding)
+            decoder = io.IncrementalNewlineDecoder(raw, translate=self.translate)
+            while not self._cancelled.is_set():
+                start = time.perf_counter()
+                text = decoder.decode(data, final=not data)
+                self.decode_seconds += time.perf_counter() - start
+                self.bytes_read = f.tell()
+                self.newlines = decoder.newlines
+                self.encoding = getattr(raw, "encoding", self.encoding)
+                if text:
+                    self.chars += len(text)
+                    self._put(text)
+                if not data:
+                    break
+                data = reader.read(self.chunk_size)
+                digest.update(data)
+                if index is not None:
+                    index.feed(data)
+        if not self._cancelled.is_set():
+            self.digest = digest.digest()
+            if index is not None:
+                index.complete = True
+                index.store(self.path, self.stat)
+        self.encoding = getattr(raw, "encoding", self.encoding)
+
+    def _put(self, item):
+        # Block while the UI is behind, but never past a cancel
+        while not self._cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+class _DiskCheck(threading.Thread):
+    """Reads a file that looks changed on disk and diffs it against `old`.
+
+    `old` is a Document snapshot, read here only if the file did change.
+    `hunks` stays None when the file's bytes hash as they did before.
+    """
+
+    def __init__(self, path, digest, old):
+        super().__init__(daemon=True)
+        self.path = path
+        self.old_digest = digest
+        self.old = old
+        self.stat = None
+        self.digest = None
+        self.hunks = None
+        self.encoding = None
+        self.error = None
+
+    def run(self):
+        try:
+            with open(self.path, "rb") as f:
+                st = os.fstat(f.fileno())
+                data = open_decompressed(f)[0].read()
+        except (OSError,) + _DECOMPRESS_ERRORS as e:
+            self.error = e
+            return
+        self.stat = (st.st_size, st.st_mtime_ns)
+        self.digest = hashlib.blake2b(data, digest_size=16).digest()
+        if self.digest != self.old_digest:
+            text, self.encoding = decode_bytes(data)
+            del data
+            self.hunks = line_diff(self.old.get(), text)
+        self.old = None
+
+
+class _FontLister(threading.Thread):
+    """Sorted installed font families, listed by a Tk interpreter of its own.
+
+    `families` stays None if that interpreter cannot be created; the UI
+    thread then lists them itself when they are needed.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.families = None
+        self.error = None
+
+    def run(self):
+        interp = None
+        try:
+            interp = tk.Tcl()
+            interp.loadtk()
+            interp.call("wm", "withdraw", ".")
+            names = interp.splitlist(interp.call("font", "families"))
+            interp.call("destroy", ".")
+        except (tk.TclError, RuntimeError) as e:
+            self.error = e.with_traceback(None)
+            return
+        finally:
+            del interp  # Tcl wants an interpreter deleted by the thread that made it
+        self.families = sorted(set(names))
+
+
+def line_diff(old, new):
+    """Line-level changes turning `old` into `new`.
+
+    Returns (first, last, text) hunks, bottom-up: replace old lines
+    first..last-1 (0-based) with `text`. Common leading and trailing lines
+    are trimmed before difflib sees the rest.
+    """
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    head = 0
+    limit = min(len(a), len(b))
+    while head < limit and a[head] == b[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and a[-1 - tail] == b[-1 - tail]:
+        tail += 1
+    a_mid = a[head:len(a) - tail]
+    b_mid = b[head:len(b) - tail]
+    if not a_mid and not b_mid:
+        return []
+    if max(len(a_mid), len(b_mid)) > RELOAD_DIFF_MAX_LINES:
+        return [(head, head + len(a_mid), "".join(b_mid))]
+    hunks = []
+    matcher = difflib.SequenceMatcher(None, a_mid, b_mid, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            hunks.append((head + i1, head + i2, "".join(b_mid[j1:j2])))
+    hunks.reverse()
+    return hunks
+
+
+# ----------------------------------------------------------------------
+# Background file saver
+# ----------------------------------------------------------------------
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class _FileSaver(threading.Thread):
+    """Streams text chunks to a temp file, then atomically replaces the target.
+
+    The temp file lives in the target's directory so os.replace never
+    crosses filesystems; until the rename the original is left untouched.
+    Feed it str chunks through `chunks` and finish with None, or pass an
+    iterable of chunks as `source`.
+    """
+
+    def __init__(self, path, encoding=DEFAULT_ENCODING, fsync=SAVE_FSYNC, eol=os.linesep, compression=None,
+                 source=None, verbatim=False):
+        super().__init__(daemon=True)
+        self.path = path
+        self.encoding = encoding
+        self.compression = compression      # (format, level) to compress with, or None
+        self.fsync = fsync
+        self.eol = eol
+        self.chunks = queue.Queue(maxsize=8)
+        self.error = None
+        self.aborted = False        # set before the final None to leave the target untouched
+        self.digest = None          # hash of the bytes written
+        self.bytes_written = 0
+        self.done = False
+        self.source = source        # iterable of str chunks to write instead of `chunks`
+        self._input_done = source is not None
+        self.verbatim = verbatim    # keep the final newlines as given (batch mode)
+
+    def run(self):
+        target = os.path.realpath(self.path)
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=".~" + os.path.basename(target), suffix=".tmp",
+                                       dir=os.path.dirname(target))
+            with os.fdopen(fd, "wb") as f:
+                if self.compression is None:
+                    self._write(f)
+                else:
+                    with open_compressed(f, self.compression) as out:
+                        self._write(out)
+                if self.aborted:
+                    return
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            if os.path.exists(target):
+                shutil.copymode(target, tmp)
+            else:
+                os.chmod(tmp, 0o666 & ~_UMASK)
+            os.replace(tmp, target)
+            tmp = None
+            if self.fsync and hasattr(os, "O_DIRECTORY"):
+                dir_fd = os.open(os.path.dirname(target), os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+        except Exception as e:
+            self.error = e
+            while not self._input_done:
+                self._input_done = self.chunks.get() is None
+        finally:
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+            self.done = True
+
+    def _write(self, f):
+        # Trailing newlines are held back so the file ends with exactly one
+        codec, bom = ENCODINGS[self.encoding]
+        encoder = codecs.getincrementalencoder(codec)()
+        digest = hashlib.blake2b(digest_size=16)
+
+        def write(data):
+            digest.update(data)
+            f.write(data)
+            self.bytes_written += len(data)
+
+        write(bom)
+        pending = 0
+        for chunk in self.source if self.source is not None else iter(self.chunks.get, None):
+            if self.verbatim:
+                write(encoder.encode(self._eol(chunk)))
+                continue
+            body = chunk.rstrip("\n")
+            if body:
+                write(encoder.encode(self._eol("\n" * pending + body)))
+                pending = len(chunk) - len(body)
+            else:
+                pending += len(chunk)
+        self._input_done = True
+        write(encoder.encode("" if self.verbatim else self.eol, final=True))
+        self.digest = digest.digest()
+
+    def _eol(self, text):
+        # Same line endings as a text-mode write, by default
+        return text if self.eol == "\n" else text.replace("\n", self.eol)
+
+
+# ----------------------------------------------------------------------
+# Printing
+# ----------------------------------------------------------------------
+# margins are (left, right, top, bottom) in inches; header and footer use
+# Notepad's codes, see format_header()
+PageSettings = collections.namedtuple(
+    "PageSettings", "paper landscape margins header footer",
+    defaults=("Letter", False, (0.75, 0.75, 1.0, 1.0), "&f", "Page &p"))
+
+_HEADER_CODES = {
+    "f": lambda filename, page, when: os.path.basename(filename or "Untitled"),
+    "p": lambda filename, page, when: str(page),
+    "d": lambda filename, page, when: when.strftime("%x"),
+    "t": lambda filename, page, when: when.strftime("%X"),
+    "&": lambda filename, page, when: "&",
+}
+
+
+def format_header(template, filename, page, when):
+    """Expands a header/footer template into {"l"|"c"|"r": text}.
+
+    &f is the file name, &p the page number, &d and &t the date and time
+    and && an ampersand; &l, &c and &r align what follows (centred by
+    default). Unknown codes are dropped.
+    """
+    parts = {"l": "", "c": "", "r": ""}
+    align = "c"
+    i = 0
+    while i < len(template):
+        if template[i] == "&" and i + 1 < len(template):
+            code = template[i + 1].lower()
+            if code in parts:
+                align = code
+            elif code in _HEADER_CODES:
+                parts[align] += _HEADER_CODES[code](filename, page, when)
+            i += 2
+        else:
+            parts[align] += template[i]
+            i += 1
+    return parts
+
+
+class PageLayout:
+    """Page geometry and font metrics for printing, in points from the top left.
+
+    Built on the UI thread, the only one allowed to measure the Tk font;
+    layout threads use the character widths recorded here. Characters
+    that were not measured count as one or two digits wide.
+    """
+
+    TAB_COLUMNS = 8
+
+    def __init__(self, settings, text_font, scaling):
+        # scaling: Tk's pixels per point
+        width, height = PAPER_SIZES[settings.paper]
+        if settings.landscape:
+            width, height = height, width
+        left, right, top, bottom = (m * 72 for m in settings.margins)
+        actual = text_font.actual()
+        metrics = text_font.metrics()
+        self.settings = settings
+        self.key = None
+        self.page_width = width
+        self.page_height = height
+        self.font_size = actual["size"] if actual["size"] > 0 else -actual["size"] / scaling
+        self.fixed = bool(metrics["fixed"])
+        self.bold = actual["weight"] == "bold"
+        self.italic = actual["slant"] == "italic"
+        self.line_height = metrics["linespace"] / scaling
+        self.ascent = metrics["ascent"] / scaling
+        self.widths = {ch: text_font.measure(ch) / scaling
+                       for ch in map(chr, itertools.chain(range(32, 127), range(160, 256)))}
+        self.char_width = self.widths["0"]
+        self.wide_width = text_font.measure("\u6c34") / scaling
+        self.left = left
+        self.width = max(width - left - right, self.char_width)
+        self.columns = max(1, int(self.width // self.char_width))
+        self.header_top = top
+        self.footer_top = height - bottom - self.line_height
+        self.body_top = top + (2 * self.line_height if settings.header else 0)
+        body_bottom = height - bottom - (2 * self.line_height if settings.footer else 0)
+        self.rows = max(1, int((body_bottom - self.body_top) // self.line_height))
+
+    @property
+    def base_font(self):
+        # The standard PDF/PostScript font nearest to the editor's
+        style = ("Bold" if self.bold else "") + ("Oblique" if self.italic else "")
+        name = "Courier" if self.fixed else "Helvetica"
+        return f"{name}-{style}" if style else name
+
+    def _width(self, ch):
+        width = self.widths.get(ch)
+        if width is None:
+            width = self.wide_width if unicodedata.east_asian_width(ch) in "WF" else self.char_width
+            self.widths[ch] = width
+        return width
+
+    def text_width(self, text):
+        return sum(map(self._width, text))
+
+    def wrap(self, line):
+        """Offsets in `line` where its printed rows end, wrapping after spaces."""
+        if self.fixed and line.isascii() and "\t" not in line:
+            # Every character is as wide as the others
+            columns, ends, a = self.columns, [], 0
+            while len(line) - a > columns:
+                space = line.rfind(" ", a, a + columns)
+                a = space + 1 if space >= a else a + columns
+                ends.append(a)
+            ends.append(len(line))
+            return ends
+        ends, a, x, space, i = [], 0, 0.0, -1, 0
+        while i < len(line):
+            ch = line[i]
+            w = self.tab_width - x % self.tab_width if ch == "\t" else self._width(ch)
+            if x + w > self.width and i > a:
+                # Start the next row after the last space, or here if there was none
+                a = i = space + 1 if space >= a else i
+                ends.append(a)
+                x, space = 0.0, -1
+                continue
+            if ch == " ":
+                space = i
+            x += w
+            i += 1
+        ends.append(len(line))
+        return ends
+
+    @property
+    def tab_width(self):
+        return self.char_width * self.TAB_COLUMNS
+
+
+def _text_lines(document, start=0):
+    # The document's lines from `start` on, without their newlines
+    pending = []
+    for chunk in document.chunks(start):
+        lines = chunk.split("\n")
+        if len(lines) > 1:
+            pending.append(lines[0])
+            yield "".join(pending)
+            yield from lines[1:-1]
+            pending = []
+        pending.append(lines[-1])
+    yield "".join(pending)
+
+
+def paginate(document, layout, start=0):
+    """Yields (offset, rows) for each printed page from `start` on.
+
+    `start` must be where a page begins. `rows` are the page's lines as
+    wrapped, up to layout.rows of them; the empty line after a final
+    newline is not printed.
+    """
+    end = document.length
+    rows, page_start, offset = [], start, start
+    for line in _text_lines(document, start):
+        if not line and offset == end and offset > start:
+            break
+        a = 0
+        for b in layout.wrap(line):
+            if len(rows) == layout.rows:
+                yield page_start, rows
+                rows, page_start = [], offset + a
+            rows.append(line[a:b])
+            a = b
+        offset += len(line) + 1
+    yield page_start, rows
+
+
+def page_items(layout, number, rows, filename, when):
+    """(x, y, text) for each run of text on a page; y is the top of its line."""
+    items = []
+    for template, top in ((layout.settings.header, layout.header_top),
+                          (layout.settings.footer, layout.footer_top)):
+        if not template:
+            continue
+        for align, text in format_header(template, filename, number, when).items():
+            if text:
+                slack = max(layout.width - layout.text_width(text), 0)
+                items.append((layout.left + slack * {"l": 0, "c": 0.5, "r": 1}[align], top, text))
+    for i, row in enumerate(rows):
+        if row.strip():
+            items.append((layout.left, layout.body_top + i * layout.line_height,
+                          row.expandtabs(PageLayout.TAB_COLUMNS)))
+    return items
+
+
+class _PageBreaker(threading.Thread):
+    """Lays out a document snapshot, recording the offset each page begins at."""
+
+    def __init__(self, document, layout, origin):
+        super().__init__(daemon=True)
+        self.document = document
+        self.layout = layout
+        self.origin = origin
+        self.starts = []
+        self.cancelled = False
+        self.done = False
+
+    def run(self):
+        try:
+            for offset, _ in paginate(self.document, self.layout, self.origin):
+                if self.cancelled:
+                    return
+                self.starts.append(offset)
+        finally:
+            self.done = True
+
+
+class Paginator:
+    """A window's page breaks for its current PageLayout, cached between uses.
+
+    `starts` holds the offset each page begins at. Missing pages are laid
+    out on a worker thread while someone is watching (`listeners`, e.g. a
+    Print Preview). An edit drops the pages from the one before it on, as
+    a word wrapped from the edited page may now fit on that one; only
+    those pages are laid out again.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.layout = None
+        self.starts = []
+        self.complete = False
+        self.generation = 0         # bumped whenever pages are dropped
+        self.listeners = []         # called on the UI thread when pages come or go
+        self._resume = 0            # offset of the first page not in `starts`
+        self._worker = None
+        self._job = None
+
+    @property
+    def page_count(self):
+        return len(self.starts)
+
+    def set_layout(self, layout):
+        self.layout = layout
+        self.invalidate(0)
+
+    def on_edit(self, kind, start, end, chars):
+        if not self.starts and self._worker is None:
+            return
+        self.invalidate(0 if kind == "reset" else self.app.document.offset(start))
+
+    def invalidate(self, offset):
+        if self._worker is not None:
+            self._worker.cancelled = True
+            self._worker = None
+        keep = max(bisect_right(self.starts, offset) - 2, 0)
+        if keep < len(self.starts):
+            self._resume = self.starts[keep]
+            del self.starts[keep:]
+        self.complete = False
+        self.generation += 1
+        self._notify()
+        if self.listeners and self._job is None:
+            # Wait for a pause in typing before laying out again
+            self._job = self.app.after(PRINT_RELAYOUT_MS, self.run)
+
+    def suspend(self):
+        # While its tab is not shown; the pages found so far are kept
+        if self._job is not None:
+            self.app.after_cancel(self._job)
+            self._job = None
+        if self._worker is not None:
+            self.invalidate(self.starts[-1] if self.starts else 0)
+
+    def run(self):
+        """Starts laying out the pages not known yet."""
+        if self._job is not None:
+            self.app.after_cancel(self._job)
+            self._job = None
+        if self.complete or self._worker is not None or self.layout is None:
+            return
+        if not self.starts:
+            self._resume = 0
+        self._worker = _PageBreaker(self.app.document.snapshot(), self.layout, self._resume)
+        self._worker.start()
+        self.app.after(LOAD_POLL_MS, self._poll, self._worker, len(self.starts))
+
+    def _poll(self, worker, base):
+        if worker is not self._worker:
+            return
+        done = worker.done
+        new = worker.starts[len(self.starts) - base:]
+        self.starts.extend(new)
+        if done:
+            self._worker = None
+            self.complete = True
+        else:
+            self.app.after(LOAD_POLL_MS, self._poll, worker, base)
+        if new or done:
+            self._notify()
+
+    def _notify(self):
+        for listener in list(self.listeners):
+            listener()
+
+    def adopt(self, starts, generation):
+        """Takes the page starts of a whole layout made elsewhere, e.g. by a
+        print job, unless pages were dropped since `generation`."""
+        if generation != self.generation or self.complete:
+            return
+        if self._worker is not None:
+            self._worker.cancelled = True
+            self._worker = None
+        self.starts[:] = starts
+        self.complete = True
+        self._notify()
+
+    def page(self, number):
+        """The rows of page `number` (from 0), or None if it is not laid out yet."""
+        if number >= len(self.starts):
+            return None
+        return next(paginate(self.app.document, self.layout, self.starts[number]))[1]
+
+
+def _pdf_string(text, codec):
+    # A string literal for PDF or PostScript; unencodable characters print as "?"
+    data = text.encode(codec, "replace")
+    for char in (b"\\", b"(", b")", b"\r"):
+        data = data.replace(char, b"\\" + (b"r" if char == b"\r" else char))
+    return b"(" + data + b")"
+
+
+class _PdfWriter:
+    """A minimal PDF: one compressed content stream per page, one standard font.
+
+    Pages are written as they come; the page tree that lists them follows
+    at the end, with the catalog and the cross-reference table.
+    """
+
+    def __init__(self, f, layout):
+        self.f = f
+        self.layout = layout
+        self.pos = 0
+        self.offsets = {}
+        self.kids = []
+        self.next_id = 4            # 1 catalog, 2 page tree, 3 font
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.f.write(data)
+        self.pos += len(data)
+
+    def _object(self, number, body):
+        self.offsets[number] = self.pos
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+    def page(self, number, items):
+        layout = self.layout
+        ops = [b"BT /F1 %.2f Tf" % layout.font_size]
+        for x, y, text in items:
+            ops.append(b"1 0 0 1 %.2f %.2f Tm %s Tj"
+                       % (x, layout.page_height - y - layout.ascent, _pdf_string(text, "cp1252")))
+        ops.append(b"ET")
+        data = zlib.compress(b"\n".join(ops))
+        content, page = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self._object(content, b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream"
+                     % (len(data), data))
+        self._object(page, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] "
+                           b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+                     % (layout.page_width, layout.page_height, content))
+        self.kids.append(page)
+
+    def close(self):
+        self._object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>"
+                     % self.layout.base_font.encode("ascii"))
+        self._object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>"
+                     % (b" ".join(b"%d 0 R" % kid for kid in self.kids), len(self.kids)))
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref = self.pos
+        entries = [b"0000000000 65535 f "] + [b"%010d 00000 n " % self.offsets[n] for n in range(1, self.next_id)]
+        self._write(b"xref\n0 %d\n%s\ntrailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (self.next_id, b"\n".join(entries), self.next_id, xref))
+
+
+class _PostScriptWriter:
+    """DSC-conforming PostScript with one standard font re-encoded for Latin-1."""
+
+    def __init__(self, f, layout):
+        self.f = f
+        self.layout = layout
+        self.pages = 0
+        width, height = layout.page_width, layout.page_height
+        f.write(b"%!PS-Adobe-3.0\n")
+        f.write(b"%%%%BoundingBox: 0 0 %d %d\n%%%%Pages: (atend)\n%%%%EndComments\n"
+                % (round(width), round(height)))
+        f.write(b"%%%%BeginProlog\n/%s findfont dup length dict begin\n"
+                b"  {1 index /FID ne {def} {pop pop} ifelse} forall\n"
+                b"  /Encoding ISOLatin1Encoding def\ncurrentdict end /NotepadFont exch definefont pop\n"
+                b"/S {moveto show} bind def\n%%%%EndProlog\n" % layout.base_font.encode("ascii"))
+        f.write(b"%%%%BeginSetup\n<< /PageSize [%.2f %.2f] >> setpagedevice\n%%%%EndSetup\n" % (width, height))
+
+    def page(self, number, items):
+        layout = self.layout
+        self.pages += 1
+        lines = [b"%%%%Page: %d %d" % (number, self.pages),
+                 b"/NotepadFont findfont %.2f scalefont setfont" % layout.font_size]
+        for x, y, text in items:
+            lines.append(b"%s %.2f %.2f S"
+                         % (_pdf_string(text, "latin-1"), x, layout.page_height - y - layout.ascent))
+        lines.append(b"showpage\n")
+        self.f.write(b"\n".join(lines))
+
+    def close(self):
+        self.f.write(b"%%%%Trailer\n%%%%Pages: %d\n%%%%EOF\n" % self.pages)
+
+
+class _PrintJob(threading.Thread):
+    """Prints a document snapshot to a PDF or PostScript file, page by page as laid out.
+
+    `starts` are page starts already known for this snapshot and layout
+    (the Paginator's); pages past them are laid out here and their starts
+    added, so the window can hand them back to the Paginator.
+    """
+
+    def __init__(self, path, document, layout, filename, starts=()):
+        super().__init__(daemon=True)
+        self.path = path
+        self.document = document
+        self.layout = layout
+        self.filename = filename    # for the &f header code
+        self.starts = list(starts)
+        self.when = datetime.now()
+        self.postscript = path.lower().endswith((".ps", ".eps"))
+        self.pages = 0
+        self.error = None
+        self.cancelled = False
+        self.done = False
+
+    def run(self):
+        try:
+            with open(self.path, "wb") as f:
+                out = (_PostScriptWriter if self.postscript else _PdfWriter)(f, self.layout)
+                for number, (offset, rows) in enumerate(self._pages(), 1):
+                    if self.cancelled:
+                        break
+                    if number > len(self.starts):
+                        self.starts.append(offset)
+                    out.page(number, page_items(self.layout, number, rows, self.filename, self.when))
+                    self.pages = number
+                out.close()
+        except Exception as e:
+            self.error = e
+        finally:
+            if self.error is not None or self.cancelled:
+                with contextlib.suppress(OSError):
+                    os.remove(self.path)
+            self.done = True
+
+    def _pages(self):
+        # (offset, rows) of each page: the known ones laid out one at a time,
+        # then on from the last of them to the end
+        for offset in self.starts[:-1]:
+            yield next(paginate(self.document, self.layout, offset))
+        yield from paginate(self.document, self.layout, self.starts[-1] if self.starts else 0)
+
+
+# ----------------------------------------------------------------------
+# Performance tracing
+# ----------------------------------------------------------------------
+class Tracer:
+    """Opt-in timings of UI callbacks, file operations and main-loop lateness.
+
+    Each name gets a histogram (log2 buckets in ms) plus totals, and every
+    timing is also kept as a Chrome trace event ("X" phase, microseconds)
+    for chrome://tracing or Perfetto. Disabled, wrap() returns its argument
+    and record() returns at once.
+    """
+
+    BUCKETS_MS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+    def __init__(self, enabled=False, export_path=None):
+        self.enabled = enabled
+        self.export_path = export_path
+        self.origin = time.perf_counter()
+        self.events = collections.deque(maxlen=TRACE_MAX_EVENTS)
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def enable(self, export_path=None):
+        self.enabled = True
+        self.export_path = export_path or self.export_path
+
+    def reset(self):
+        with self._lock:
+            self.events.clear()
+            self.stats.clear()
+
+    def wrap(self, name, func):
+        """func, timed under `name` on each call when tracing is on."""
+        if not self.enabled:
+            return func
+
+        @functools.wraps(func)
+        def traced(*args, **kw):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kw)
+            finally:
+                self.record(name, "ui", start)
+        return traced
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, **args)
+
+    def record(self, name, category, start, duration=None, event=True, bytes=0, chars=0):
+        """Count one timing; `duration` defaults to the time since `start`."""
+        if not self.enabled:
+            return
+        if duration is None:
+            duration = time.perf_counter() - start
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {"category": category, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                           "bytes": 0, "chars": 0, "buckets": [0] * (len(self.BUCKETS_MS) + 1)}
+            ms = duration * 1000.0
+            stat["count"] += 1
+            stat["total_ms"] += ms
+            stat["max_ms"] = max(stat["max_ms"], ms)
+            stat["bytes"] += bytes
+            stat["chars"] += chars
+            stat["buckets"][bisect_right(self.BUCKETS_MS, ms)] += 1
+            if event:
+                args = {k: v for k, v in (("bytes", bytes), ("chars", chars)) if v}
+                self.events.append({"name": name, "cat": category, "ph": "X",
+                                    "ts": round((start - self.origin) * 1e6), "dur": round(duration * 1e6),
+                                    "pid": os.getpid(), "tid": threading.get_ident(), "args": args})
+
+    def start_heartbeat(self, widget):
+        # An after() callback that should run every TRACE_HEARTBEAT_MS; how
+        # late it runs is how long the event loop was busy
+        if self.enabled:
+            due = time.perf_counter() + TRACE_HEARTBEAT_MS / 1000.0
+            widget.after(TRACE_HEARTBEAT_MS, self._beat, widget, due)
+
+    def _beat(self, widget, due):
+        late = max(time.perf_counter() - due, 0.0)
+        self.record("main loop lateness", "loop", due, late, event=late * 1000.0 >= TRACE_STALL_MS)
+        self.start_heartbeat(widget)
+
+    def summary(self):
+        """Per-name totals and percentiles; percentiles are bucket upper bounds."""
+        with self._lock:
+            stats = {name: dict(stat, buckets=list(stat["buckets"])) for name, stat in self.stats.items()}
+        for stat in stats.values():
+            stat["mean_ms"] = stat["total_ms"] / stat["count"]
+            for q in (50, 95, 99):
+                stat[f"p{q}_ms"] = self._percentile(stat, q / 100.0)
+        return stats
+
+    def _percentile(self, stat, q):
+        seen = 0
+        for bound, n in zip(self.BUCKETS_MS, stat["buckets"]):
+            seen += n
+            if seen >= q * stat["count"]:
+                return bound
+        return stat["max_ms"]
+
+    def export(self, path):
+        """Write the events and histograms as a Chrome trace JSON file."""
+        summary = self.summary()
+        with self._lock:
+            events = list(self.events)
+        data = {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"buckets_ms": list(self.BUCKETS_MS), "histograms": summary}}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+
+TRACER = Tracer(enabled=TRACE_SETTING not in ("", "0"),
+                export_path=TRACE_SETTING if TRACE_SETTING not in ("", "0", "1") else None)
+
+
+class _Menu(tk.Menu):
+    """tk.Menu whose item commands are timed by TRACER."""
+
+    def add(self, itemType, cnf={}, **kw):
+        cnf = dict(cnf, **kw)
+        if cnf.get("command") is not None:
+            cnf["command"] = TRACER.wrap(f"menu {cnf.get('label', itemType)}", cnf["command"])
+        super().add(itemType, cnf)
+
+
+# ----------------------------------------------------------------------
+# Crash recovery journal
+# ----------------------------------------------------------------------
+def _app_data_dir():
+    path = os.environ.get("AINOTEPAD_HOME") or os.path.join(os.path.expanduser("~"), ".ainotepad")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if sys.platform.startswith("win"):
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # access denied: someone else's process
+        try:
+            code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RecoveryJournal:
+    """Append-only log of the edits made to a document since its last base.
+
+    The base is either the file on disk (when the buffer matched it) or a
+    snapshot of the buffer. Records are written by a worker thread; once the
+    log outgrows the base a fresh snapshot replaces both, so replaying a
+    journal costs about as much as reading the snapshot. Files, per session
+    directory: base-N.json, snapshot-N.txt (optional) and edits-N.log.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = JOURNAL_ENABLED
+        self.directory = None
+        self.seq = 0
+        self.records = queue.Queue()
+        self._thread = None
+        self._log_size = 0
+        self._compact_at = JOURNAL_COMPACT_MIN
+        self._compact_job = None
+
+    def on_edit(self, kind, start, end, chars):
+        if not self.enabled or self.app.large_view is not None or kind == "reset":
+            return
+        if self._thread is None:
+            # Listeners run before the edit, so this captures the old text
+            self._start()
+            if self._thread is None:
+                return
+        if kind == "insert":
+            self.records.put(["i", start, chars])
+            self._log_size += len(chars) + 16
+        else:
+            self.records.put(["d", start, end])
+            self._log_size += 24
+        if self._log_size >= self._compact_at and self._compact_job is None:
+            self._compact_job = self.app.after_idle(self._compact)
+
+    def rebase(self):
+        """Start a new log from the current buffer (after open, save, New...)."""
+        if self._thread is None:
+            return
+        app = self.app
+        meta = {"filename": app.filename, "encoding": app.encoding, "compression": app.compression,
+                "modified": app.modified, "time": time.time()}
+        text = None
+        if app.filename and not app.modified and app.large_view is None:
+            try:
+                st = os.stat(app.filename)
+            except OSError:
+                pass
+            else:
+                meta["file"] = {"path": os.path.abspath(app.filename), "size": st.st_size,
+                                "mtime_ns": st.st_mtime_ns, "trailing": self._trailing_newlines()}
+        if "file" not in meta:
+            text = app.document.get()
+        self.seq += 1
+        self.records.put(("base", self.seq, meta, text))
+        self._log_size = 0
+        self._compact_at = max(JOURNAL_COMPACT_MIN,
+                               len(text) if text is not None else meta["file"]["size"])
+
+    def close(self, discard=True):
+        if self._thread is None:
+            return
+        self.records.put(None)
+        self._thread.join(5)
+        self._thread = None
+        if discard:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _start(self):
+        try:
+            root = os.path.join(_app_data_dir(), "recovery")
+            os.makedirs(root, exist_ok=True)
+            self.directory = tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=root)
+        except OSError:
+            self.enabled = False
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.rebase()
+
+    def suspend(self):
+        # Compacts now rather than once the tab is no longer shown
+        if self._compact_job is not None:
+            self.app.after_cancel(self._compact_job)
+            self._compact()
+
+    def _compact(self):
+        self._compact_job = None
+        if self._log_size >= self._compact_at:
+            self.rebase()
+
+    def _trailing_newlines(self):
+        # The saver writes exactly one final newline; the buffer may hold more or none
+        tail = self.app._raw_text("get", "end-1025c", "end-1c")
+        count = len(tail) - len(tail.rstrip("\n"))
+        if count == 1024:
+            text = self.app.document.get()
+            count = len(text) - len(text.rstrip("\n"))
+        return count
+
+    def _run(self):
+        log = None
+        while True:
+            item = self.records.get()
+            if item is None:
+                break
+            try:
+                if isinstance(item, tuple):
+                    if log is not None:
+                        log.close()
+                        log = None
+                    log = self._write_base(*item[1:])
+                elif log is not None:
+                    log.write(json.dumps(item) + "\n")
+                if log is not None and self.records.empty():
+                    log.flush()
+            except OSError:
+                # Without a complete log the journal is useless until the next base
+                if log is not None:
+                    log.close()
+                    log = None
+        if log is not None:
+            log.close()
+
+    def _write_base(self, seq, meta, text):
+        if text is not None:
+            self._write_atomic(f"snapshot-{seq}.txt", text)
+        self._write_atomic(f"base-{seq}.json", json.dumps(meta))
+        log = open(os.path.join(self.directory, f"edits-{seq}.log"), "w",
+                   encoding="utf-8", errors="surrogatepass", newline="")
+        for name in os.listdir(self.directory):
+            stem = name.partition(".")[0]
+            if stem.rpartition("-")[2] != str(seq):
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(self.directory, name))
+        return log
+
+    def _write_atomic(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "w", encoding="utf-8", errors="surrogatepass", newline="") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+
+
+def find_orphan_journals():
+    """Journal directories whose session is no longer running, newest first."""
+    root = os.path.join(_app_data_dir(), "recovery")
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    found = []
+    for name in names:
+        pid = name.partition("-")[0]
+        path = os.path.join(root, name)
+        if pid.isdigit() and os.path.isdir(path) and not _pid_alive(int(pid)):
+            found.append((os.path.getmtime(path), path))
+    return [path for _, path in sorted(found, reverse=True)]
+
+
+def read_journal(directory):
+    """Returns (meta, snapshot text or None, edit records) of the latest base."""
+    seqs = [int(name[5:-5]) for name in os.listdir(directory)
+            if name.startswith("base-") and name.endswith(".json") and name[5:-5].isdigit()]
+    if not seqs:
+        return None, None, []
+    seq = max(seqs)
+    with open(os.path.join(directory, f"base-{seq}.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    text = None
+    if "file" not in meta:
+        with open(os.path.join(directory, f"snapshot-{seq}.txt"), encoding="utf-8",
+                  errors="surrogatepass", newline="") as f:
+            text = f.read()
+    records = []
+    with contextlib.suppress(FileNotFoundError):
+        with open(os.path.join(directory, f"edits-{seq}.log"), encoding="utf-8",
+                  errors="surrogatepass", newline="") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break   # torn final record
+    return meta, text, records
+
+
+def read_journal_base(meta):
+    """Text of the file a journal was based on, as it was loaded into the editor."""
+    info = meta["file"]
+    st = os.stat(info["path"])
+    if st.st_size != info["size"] or st.st_mtime_ns != info["mtime_ns"]:
+        raise ValueError(f"{info['path']} has changed since the changes were made.")
+    encoding = meta.get("encoding") if meta.get("encoding") in ENCODINGS else DEFAULT_ENCODING
+    with open(info["path"], "rb") as f:
+        reader, _ = open_decompressed(f)
+        text, _ = decode_bytes(reader.read(), encoding)
+    return text.rstrip("\n") + "\n" * info["trailing"]
+
+
+# ----------------------------------------------------------------------
+# Undo history
+# ----------------------------------------------------------------------
+class _UndoGroup:
+    """One undo step: (kind, index, text) deltas, kind "i" or "d"."""
+
+    __slots__ = ("deltas", "packed", "size", "sealed", "typing", "dropped", "version")
+
+    def __init__(self, typing=False):
+        self.deltas = []
+        self.packed = None      # zlib-compressed deltas once `deltas` is None
+        self.size = 0
+        self.sealed = False     # no more deltas will be added
+        self.typing = typing    # grows as single characters are typed/deleted
+        self.dropped = False
+        self.version = None     # UndoHistory.version of the text after this step
+
+    def get(self):
+        deltas = self.deltas
+        if deltas is None:
+            deltas = json.loads(zlib.decompress(self.packed).decode("utf-8", "surrogatepass"))
+        return deltas
+
+
+_undo_compress_queue = queue.Queue()
+_undo_compressor = None
+
+
+def _compress_undo_groups():
+    while True:
+        _pack_undo_group(*_undo_compress_queue.get())
+
+
+def _pack_undo_group(history, group):
+    deltas = group.deltas
+    if deltas is None or group.dropped:
+        return
+    data = json.dumps(deltas, ensure_ascii=False).encode("utf-8", "surrogatepass")
+    packed = zlib.compress(data, 1)
+    with history._lock:
+        if group.dropped or group.deltas is None:
+            return
+        size = len(packed) + 200
+        history.memory += size - group.size
+        group.size = size
+        group.packed = packed
+        group.deltas = None
+
+
+class UndoHistory:
+    """Undo/redo stacks fed by the Text proxy, bounded by a memory budget.
+
+    Edits are kept as compact deltas, and runs of typing or deleting are
+    coalesced into one delta. Steps of at least UNDO_COMPRESS_MIN are
+    zlib-compressed on a worker thread once newer steps exist, and the
+    oldest steps are dropped while `memory` is over `budget`.
+
+    Every edit gives the text a new `version`; undo and redo go back to the
+    version the text had after the step they return to, so comparing it
+    with the version that was saved tells whether the text is back there.
+    """
+
+    def __init__(self, app, budget=UNDO_MEMORY_BUDGET):
+        self.app = app
+        self.budget = budget
+        self.undo_stack = collections.deque()
+        self.redo_stack = []
+        self.memory = 0         # approximate bytes held by both stacks
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._applying = False
+        self._versions = itertools.count(1)
+        self.version = 0
+        self.base_version = 0   # the version with the undo stack empty
+
+    def clear(self):
+        with self._lock:
+            for group in self.undo_stack:
+                group.dropped = True
+            for group in self.redo_stack:
+                group.dropped = True
+            self.undo_stack.clear()
+            self.redo_stack.clear()
+            self.memory = 0
+        self.base_version = self.version
+
+    @contextlib.contextmanager
+    def group(self):
+        """Record all edits made inside the block as a single undo step."""
+        self.begin_group()
+        try:
+            yield
+        finally:
+            self.end_group()
+
+    def begin_group(self):
+        # For steps spanning several callbacks; prefer group()
+        if not self._depth:
+            self._open()
+        self._depth += 1
+
+    def end_group(self):
+        self._depth -= 1
+        if not self._depth:
+            top = self.undo_stack[-1]
+            if top.deltas == []:
+                self.undo_stack.pop()
+            else:
+                self._seal(top)
+
+    @contextlib.contextmanager
+    def suspended(self):
+        """Edits made inside the block are not recorded."""
+        applying, self._applying = self._applying, True
+        try:
+            yield
+        finally:
+            self._applying = applying
+
+    def on_edit(self, kind, start, end, chars):
+        self.version = next(self._versions)
+        if kind == "reset":
+            self.clear()
+            return
+        if self._applying:
+            return
+        if kind == "delete":
+            chars = self.app._raw_text("get", start, end)
+        delta = ("i" if kind == "insert" else "d", start, chars)
+        if self.redo_stack:
+            with self._lock:
+                for group in self.redo_stack:
+                    group.dropped = True
+                    self.memory -= group.size
+                self.redo_stack.clear()
+
+        top = self.undo_stack[-1] if self.undo_stack else None
+        if top is not None and not top.sealed:
+            if self._merge(top, delta):
+                top.version = self.version
+                self._evict()
+                return
+            if not self._depth:
+                top = None
+        if top is None or top.sealed:
+            top = self._open(typing=len(chars) == 1 and not self._depth)
+        top.deltas.append(delta)
+        top.version = self.version
+        self._grow(top, sys.getsizeof(chars) + 100)
+        self._evict()
+
+    def _merge(self, group, delta):
+        # Extend the last delta of a typing group with one more character
+        if not group.typing or len(delta[2]) != 1 or group.deltas is None:
+            return False
+        kind, index, text = group.deltas[-1]
+        if kind != delta[0]:
+            return False
+        if kind == "i" and delta[1] == _end_index(index, text):
+            group.deltas[-1] = (kind, index, text + delta[2])
+        elif kind == "d" and delta[1] == index:                 # Delete key
+            group.deltas[-1] = (kind, index, text + delta[2])
+        elif kind == "d" and _end_index(*delta[1:]) == index:   # BackSpace
+            group.deltas[-1] = (kind, delta[1], delta[2] + text)
+        else:
+            return False
+        self._grow(group, 1)
+        return True
+
+    def _open(self, typing=False):
+        if self.undo_stack:
+            self._seal(self.undo_stack[-1])
+        group = _UndoGroup(typing)
+        self.undo_stack.append(group)
+        return group
+
+    def _seal(self, group):
+        global _undo_compressor
+        if group.sealed:
+            return
+        group.sealed = True
+        if group.size >= UNDO_COMPRESS_MIN:
+            if _undo_compressor is None:
+                _undo_compressor = threading.Thread(target=_compress_undo_groups, daemon=True)
+                _undo_compressor.start()
+            _undo_compress_queue.put((self, group))
+
+    def seal(self):
+        """Ends the current step; the next edit starts a new one."""
+        if self.undo_stack and not self._depth:
+            self._seal(self.undo_stack[-1])
+
+    def pack(self):
+        """Compresses every step now, e.g. for a tab that is put away."""
+        self.seal()
+        for group in list(self.undo_stack) + self.redo_stack:
+            _pack_undo_group(self, group)
+
+    def _grow(self, group, size):
+        with self._lock:
+            group.size += size
+            self.memory += size
+
+    def _evict(self):
+        with self._lock:
+            while self.memory > self.budget and len(self.undo_stack) > 1:
+                group = self.undo_stack.popleft()
+                group.dropped = True
+                self.memory -= group.size
+                self.base_version = group.version
+
+    def undo(self):
+        if not self.undo_stack or self._depth:
+            return False
+        group = self.undo_stack.pop()
+        self._seal(group)
+        self._apply([("d" if kind == "i" else "i", index, text)
+                     for kind, index, text in reversed(group.get())])
+        self.redo_stack.append(group)
+        self.version = self.undo_stack[-1].version if self.undo_stack else self.base_version
+        return True
+
+    def redo(self):
+        if not self.redo_stack or self._depth:
+            return False
+        group = self.redo_stack.pop()
+        self._apply(group.get())
+        self.undo_stack.append(group)
+        self.version = group.version
+        return True
+
+    def _apply(self, deltas):
+        text = self.app.text
+        self._applying = True
+        try:
+            for kind, index, chars in deltas:
+                end = _end_index(index, chars)
+                if kind == "i":
+                    text.insert(index, chars)
+                    text.mark_set("insert", end)
+                else:
+                    text.delete(index, end)
+                    text.mark_set("insert", index)
+        finally:
+            self._applying = False
+        text.tag_remove("sel", "1.0", "end")
+        text.see("insert")
+
+
+# ----------------------------------------------------------------------
+# Follow mode
+# ----------------------------------------------------------------------
+# inotify event bits (linux/inotify.h)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
+
+class FileFollower:
+    """Appends what gets written to the end of a file to the editor.
+
+    Only the bytes past `offset` are read, through an incremental decoder.
+    The file's directory is watched with inotify where available, so that
+    rotation is noticed too; elsewhere the file is polled. A smaller file
+    or a different inode means truncation/rotation: the buffer is cleared
+    and the file followed from its start.
+    """
+
+    def __init__(self, app, path, offset, encoding):
+        self.app = app
+        self.path = path
+        self.encoding = encoding
+        self._job = None
+        self._inotify = None
+        self.resync(offset)
+        self._watch()
+        self._schedule(0 if self._inotify is not None else FOLLOW_POLL_MS)
+
+    def resync(self, offset):
+        """The buffer now matches the first `offset` bytes of the file."""
+        st = os.stat(self.path)
+        self.ident = (st.st_dev, st.st_ino)
+        self.offset = offset
+        self.decoder = io.IncrementalNewlineDecoder(make_decoder(self.encoding), translate=True)
+        self._fix_final_newline()
+
+    def close(self):
+        if self._job is not None:
+            self.app.after_cancel(self._job)
+            self._job = None
+        if self._inotify is not None:
+            with contextlib.suppress(tk.TclError):
+                self.app.tk.deletefilehandler(self._inotify)
+            os.close(self._inotify)
+            self._inotify = None
+
+    def _fix_final_newline(self):
+        # Saving writes a final newline the buffer may not have
+        codec, bom = ENCODINGS[self.encoding]
+        nl = "\n".encode(codec)
+        if self.offset < len(bom) + len(nl) or self.app._raw_text("get", "end-2c") == "\n":
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.offset - len(nl))
+            if f.read(len(nl)) == nl:
+                self.app._follow_append("\n")
+
+    def _watch(self):
+        if not sys.platform.startswith("linux"):
+            return
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return
+            mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            directory = os.path.dirname(os.path.abspath(self.path))
+            if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+                os.close(fd)
+                return
+            self.app.tk.createfilehandler(fd, tk.READABLE, self._on_inotify)
+        except (OSError, AttributeError, RuntimeError, tk.TclError):
+            return  # polled instead
+        self._inotify = fd
+
+    def _on_inotify(self, fd, mask):
+        # The events only say "look again"; the file itself is stat'ed
+        with contextlib.suppress(OSError):
+            while os.read(fd, 65536):
+                pass
+        self._schedule(0)
+
+    def _schedule(self, delay):
+        if self._job is None:
+            self._job = self.app.after(delay, self._check)
+
+    def _check(self):
+        self._job = None
+        app = self.app
+        if app.modified or app.filename != self.path or app.large_view is not None:
+            app.set_follow(False)
+            return
+        more = False
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            st = None   # between rotation steps; wait for the new file
+        if st is not None:
+            if (st.st_dev, st.st_ino) != self.ident or st.st_size < self.offset:
+                self.ident = (st.st_dev, st.st_ino)
+                self.offset = 0
+                self.decoder.reset()
+                app._follow_reset()
+            if st.st_size > self.offset:
+                more = self._read(st.st_size)
+        if more:
+            self._schedule(1)
+        elif self._inotify is None:
+            self._schedule(FOLLOW_POLL_MS)
+
+    def _read(self, size):
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                data = f.read(min(size - self.offset, FOLLOW_READ_MAX))
+        except OSError:
+            return False
+        start = self.offset
+        self.offset += len(data)
+        bom = ENCODINGS[self.encoding][1]
+        if start == 0 and bom and data.startswith(bom):
+            data = data[len(bom):]
+        text = self.decoder.decode(data)
+        if text:
+            self.app._follow_append(text)
+        return self.offset < size
+
+
+# ----------------------------------------------------------------------
+# Highlight all matches
+# ----------------------------------------------------------------------
+class SearchHighlighter:
+    """Tags every match of a pattern, visible lines first, the rest at idle time.
+
+    A match count and a "needs scan" flag are kept per line and shifted in
+    step with the edits reported by the Text proxy, so an edit re-scans
+    only the lines it touched.
+    """
+
+    TAG = "found"
+
+    def __init__(self, app):
+        self.app = app
+        self.text = app.text
+        self.pattern = None
+        self.counts = array("I")   # matches starting on each line
+        self.dirty = bytearray()   # 1 for lines that need a (re)scan
+        self.total = 0
+        self.current = None        # ordinal of the match picked by Find Next
+        self._job = None
+        self.text.tag_configure(self.TAG, background="yellow")
+        self.text.tag_raise("sel")
+
+    def set_pattern(self, pattern):
+        if pattern is self.pattern:
+            return
+        self.pattern = pattern
+        self.reset()
+
+    def reset(self):
+        self.text.tag_remove(self.TAG, "1.0", "end")
+        lines = int(self.text.index("end-1c").split(".")[0]) if self.pattern else 0
+        self.counts = array("I", [0]) * lines
+        self.dirty = bytearray(b"\x01") * lines
+        self.total = 0
+        self.current = None
+        self._schedule()
+        self._publish()
+
+    def on_edit(self, kind, start, end, chars):
+        if kind == "reset":
+            self.reset()
+            return
+        if self.pattern is None:
+            return
+        line = int(start.split(".")[0]) - 1
+        if kind == "insert":
+            added = chars.count("\n")
+            if added:
+                self.counts[line + 1:line + 1] = array("I", [0]) * added
+                self.dirty[line + 1:line + 1] = bytearray(added)
+            self.dirty[line:line + added + 1] = b"\x01" * (added + 1)
+        else:
+            last = int(end.split(".")[0]) - 1
+            if last > line:
+                self.total -= sum(self.counts[line + 1:last + 1])
+                del self.counts[line + 1:last + 1]
+                del self.dirty[line + 1:last + 1]
+            self.dirty[line] = 1
+        self.current = None
+        self._schedule()
+
+    def suspend(self):
+        # While its tab is not shown
+        if self._job is not None:
+            self.text.after_cancel(self._job)
+            self._job = None
+
+    def resume(self):
+        self._schedule()
+        self._publish()
+
+    def select_match(self, index):
+        """Record that the match starting at `index` is the current one."""
+        if self.dirty.find(1) >= 0:
+            return  # count not known yet
+        if crosses_lines(self.pattern):
+            offset = len(self.text.get("1.0", index))
+            before = sum(1 for m in self.pattern.finditer(self.text.get("1.0", "end-1c"))
+                         if m.start() < offset and m.start() != m.end())
+            self.current = before + 1
+            self._publish()
+            return
+        line, col = map(int, index.split("."))
+        before = sum(self.counts[:line - 1])
+        chunk = self.text.get(f"{line}.0", f"{line}.end")
+        before += sum(1 for m in self.pattern.finditer(chunk)
+                      if m.start() < col and m.start() != m.end())
+        self.current = before + 1
+        self._publish()
+
+    def _schedule(self):
+        if self._job is None and self.pattern is not None and self.dirty.find(1) >= 0:
+            self._job = self.text.after_idle(self._run)
+
+    def _run(self):
+        self._job = None
+        if self.pattern is None:
+            return
+        if len(self.dirty) != int(self.text.index("end-1c").split(".")[0]):
+            self.reset()  # out of step with the widget; start over
+            return
+        if crosses_lines(self.pattern):
+            # A match may run on past any batch of lines and an edit may
+            # join or split one anywhere, so the whole text is scanned at once
+            self._scan(0, len(self.dirty))
+            self._publish()
+            return
+        top = int(self.text.index("@0,0").split(".")[0]) - 1
+        bottom = int(self.text.index(f"@0,{self.text.winfo_height()}").split(".")[0])
+        deadline = time.perf_counter() + HIGHLIGHT_SLICE_MS / 1000.0
+        while time.perf_counter() < deadline:
+            first = self.dirty.find(1, top, bottom)
+            if first < 0:
+                first = self.dirty.find(1)
+                if first < 0:
+                    break
+            stop = self.dirty.find(0, first, first + HIGHLIGHT_BATCH_LINES)
+            if stop < 0:
+                stop = min(len(self.dirty), first + HIGHLIGHT_BATCH_LINES)
+            self._scan(first, stop)
+        self._schedule()
+        self._publish()
+
+    def _scan(self, first, stop):
+        # Re-tag lines first..stop-1 (0-based); unless the pattern crosses
+        # lines (see _run), a match cannot span past them
+        end = f"{stop}.end"
+        chunk = self.text.get(f"{first + 1}.0", end)
+        self.text.tag_remove(self.TAG, f"{first + 1}.0", end)
+        counts = array("I", [0]) * (stop - first)
+        ranges = []
+        line, line_start, pos = first + 1, 0, 0
+        for m in self.pattern.finditer(chunk):
+            if m.start() == m.end():
+                continue
+            for offset in m.span():
+                newlines = chunk.count("\n", pos, offset)
+                if newlines:
+                    line += newlines
+                    line_start = chunk.rfind("\n", pos, offset) + 1
+                pos = offset
+                ranges.append(f"{line}.{offset - line_start}")
+            counts[int(ranges[-2].split(".")[0]) - 1 - first] += 1
+        if ranges:
+            self.text.tag_add(self.TAG, *ranges)
+        self.total += sum(counts) - sum(self.counts[first:stop])
+        self.counts[first:stop] = counts
+        self.dirty[first:stop] = bytearray(stop - first)
+
+    def _publish(self):
+        if self.pattern is None:
+            status = ""
+        elif self.dirty.find(1) >= 0:
+            status = f"{self.total} matches so far..."
+        elif self.current is not None:
+            status = f"Match {self.current} of {self.total}"
+        else:
+            status = f"{self.total} matches"
+        if status != self.app.match_status_var.get():
+            self.app.match_status_var.set(status)
+            self.app._schedule_ui("status")
+
+
+# ----------------------------------------------------------------------
+# Word wrap layout
+# ----------------------------------------------------------------------
+class WrapIndex:
+    """Display lines per logical line while word wrap is on, visible lines first.
+
+    As in SearchHighlighter, a count and a "needs measuring" flag are kept
+    per line and shifted with each edit. Unmeasured lines count as one
+    display line, so rows are estimates until the index is complete.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.text = app.text
+        self.enabled = False
+        self.counts = array("I")   # display lines of each logical line
+        self.dirty = bytearray()   # 1 for lines that need (re)measuring
+        self._blocks = [0]         # display lines before each block of WRAP_BLOCK_LINES
+        self._valid = 1            # leading entries of _blocks that are up to date
+        self._width = None
+        self._job = None
+        self.text.bind("<Configure>", self._on_configure, add="+")
+
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        if not enabled and self._job is not None:
+            self.text.after_cancel(self._job)
+            self._job = None
+        self.reset()
+
+    def reset(self):
+        lines = int(self.text.index("end-1c").split(".")[0]) if self.enabled else 0
+        self.counts = array("I", [1]) * lines
+        self.dirty = bytearray(b"\x01") * lines
+        self._blocks = [0]
+        self._valid = 1
+        self._schedule()
+
+    def suspend(self):
+        if self._job is not None:
+            self.text.after_cancel(self._job)
+            self._job = None
+
+    def invalidate(self):
+        """Re-measure every line, e.g. after the font or the width changed."""
+        if self.enabled:
+            self.dirty = bytearray(b"\x01") * len(self.dirty)
+            self._schedule()
+
+    @property
+    def complete(self):
+        return self.dirty.find(1) < 0
+
+    def on_edit(self, kind, start, end, chars):
+        if not self.enabled:
+            return
+        if kind == "reset":
+            self.reset()
+            return
+        line = int(start.split(".")[0]) - 1
+        if kind == "insert":
+            added = chars.count("\n")
+            if added:
+                self.counts[line + 1:line + 1] = array("I", [1]) * added
+                self.dirty[line + 1:line + 1] = bytearray(added)
+            self.dirty[line:line + added + 1] = b"\x01" * (added + 1)
+        else:
+            last = int(end.split(".")[0]) - 1
+            if last > line:
+                del self.counts[line + 1:last + 1]
+                del self.dirty[line + 1:last + 1]
+            self.dirty[line] = 1
+        self._valid = min(self._valid, line // WRAP_BLOCK_LINES + 1)
+        self._schedule()
+
+    def display_line(self, line):
+        """Display lines above the start of logical `line` (1-based)."""
+        block, offset = divmod(line - 1, WRAP_BLOCK_LINES)
+        blocks = self._blocks
+        del blocks[self._valid:]
+        while len(blocks) <= block:
+            first = (len(blocks) - 1) * WRAP_BLOCK_LINES
+            blocks.append(blocks[-1] + sum(self.counts[first:first + WRAP_BLOCK_LINES]))
+        self._valid = len(blocks)
+        first = block * WRAP_BLOCK_LINES
+        return blocks[block] + sum(self.counts[first:first + offset])
+
+    def row(self, index):
+        """0-based display row of a text index."""
+        line = int(self.text.index(index).split(".")[0])
+        return self.display_line(line) + self._count(f"{line}.0", index)
+
+    def total(self):
+        return self.display_line(len(self.counts) + 1)
+
+    def _count(self, start, end):
+        return int(self.app._raw_text("count", "-update", "-displaylines", start, end))
+
+    def _on_configure(self, event):
+        if event.width != self._width:
+            self._width = event.width
+            self.invalidate()
+
+    def _schedule(self):
+        if self._job is None and self.enabled and self.dirty.find(1) >= 0:
+            self._job = self.text.after_idle(self._run)
+
+    def _run(self):
+        self._job = None
+        if not self.enabled:
+            return
+        if len(self.dirty) != int(self.text.index("end-1c").split(".")[0]):
+            self.reset()  # out of step with the widget; start over
+            return
+        top = int(self.text.index("@0,0").split(".")[0]) - 1
+        bottom = int(self.text.index(f"@0,{self.text.winfo_height()}").split(".")[0])
+        deadline = time.perf_counter() + HIGHLIGHT_SLICE_MS / 1000.0
+        while time.perf_counter() < deadline:
+            first = self.dirty.find(1, top, bottom)
+            if first < 0:
+                first = self.dirty.find(1)
+                if first < 0:
+                    break
+            stop = self.dirty.find(0, first, first + WRAP_BATCH_LINES)
+            if stop < 0:
+                stop = min(len(self.dirty), first + WRAP_BATCH_LINES)
+            self._measure(first, stop)
+        self._schedule()
+        self.app._schedule_ui("status")
+
+    def _measure(self, first, stop):
+        # Lines first..stop-1 (0-based). Every line takes at least one display
+        # line, so a range whose count equals its length has no wrapped lines
+        # and only ranges that do wrap are split further.
+        ranges = [(first, stop)]
+        while ranges:
+            a, b = ranges.pop()
+            n = self._count(f"{a + 1}.0", f"{b + 1}.0")
+            if n == b - a:
+                self.counts[a:b] = array("I", [1]) * (b - a)
+            elif b - a == 1:
+                self.counts[a] = n
+            else:
+                mid = (a + b) // 2
+                ranges += [(mid, b), (a, mid)]
+        self.dirty[first:stop] = bytearray(stop - first)
+        self._valid = min(self._valid, first // WRAP_BLOCK_LINES + 1)
+
+
+# ----------------------------------------------------------------------
+# Large file mode
+# ----------------------------------------------------------------------
+def _find_newlines(chunk, start, n):
+    """Return (offset, remaining) just past the n-th newline in chunk[start:].
+
+    Newlines are counted a block at a time at C speed, narrowing down to a
+    small block that is then bisected. `remaining` is non-zero when the
+    chunk ends before n newlines were found.
+    """
+    end = len(chunk)
+    stop = start
+    for block in (1 << 16, 1 << 10):
+        while True:
+            stop = min(start + block, end)
+            count = chunk.count(b"\n", start, stop)
+            if count >= n:
+                break
+            n -= count
+            start = stop
+            if stop == end:
+                return end, n
+    lo, hi = start, stop
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if chunk.count(b"\n", start, mid) >= n:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo, 0
+
+
+def _skip_lines(buf, pos, n, end, window=1 << 20):
+    """Like _find_newlines, but reads buf (e.g. an mmap) a window at a time."""
+    while True:
+        chunk = buf[pos:min(pos + window, end)]
+        if not chunk:
+            return pos, n
+        offset, n = _find_newlines(chunk, 0, n)
+        if not n:
+            return pos + offset, 0
+        pos += len(chunk)
+
+
+def _count_newlines(buf, start, end, block=1 << 20):
+    count = 0
+    for pos in range(start, end, block):
+        count += buf[pos:min(pos + block, end)].count(b"\n")
+    return count
+
+
+class LineIndex:
+    """Sparse line-offset index: the byte offset of every `step`-th line.
+
+    `build` may run on a worker thread while the UI thread reads the
+    samples gathered so far.
+    """
+
+    def __init__(self, step=LINE_INDEX_STEP):
+        self.step = step
+        self.offsets = array("Q", [0])   # offsets[k] = start of line k * step
+        self.line_count = 1              # lines known so far (newlines + 1)
+        self.bytes_indexed = 0
+        self.complete = False
+        self._need = step                # newlines until the next sampled line
+
+    @classmethod
+    def load_cached(cls, path, stat):
+        """The index stored for `path` as of `stat` (size, mtime_ns), or None."""
+        try:
+            with open(_line_index_cache_path(path), "rb") as f:
+                meta = json.loads(f.readline())
+                if meta["path"] != os.path.abspath(path) or [meta["size"], meta["mtime_ns"]] != list(stat):
+                    return None
+                index = cls(meta["step"])
+                index.offsets = array("Q")
+                index.offsets.frombytes(f.read())
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(index.offsets) != meta["samples"]:
+            return None
+        index.line_count = meta["line_count"]
+        index.bytes_indexed = meta["size"]
+        index.complete = True
+        return index
+
+    def store(self, path, stat):
+        """Keep a complete index for load_cached(); failures are ignored."""
+        cache = _line_index_cache_path(path)
+        meta = {"path": os.path.abspath(path), "size": stat[0], "mtime_ns": stat[1], "step": self.step,
+                "line_count": self.line_count, "samples": len(self.offsets)}
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cache), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(json.dumps(meta).encode("utf-8") + b"\n")
+                self.offsets.tofile(f)
+            os.replace(tmp, cache)
+        except OSError:
+            return
+        _prune_line_index_cache(os.path.dirname(cache))
+
+    def feed(self, chunk):
+        """Index the next chunk of the file."""
+        pos = self.bytes_indexed
+        start, need = 0, self._need
+        while True:
+            start, need = _find_newlines(chunk, start, need)
+            if need:
+                break
+            self.offsets.append(pos + start)
+            need = self.step
+        self._need = need
+        self.line_count = len(self.offsets) * self.step - need + 1
+        self.bytes_indexed = pos + len(chunk)
+
+    def build(self, buf, size, cancelled, chunk_size=1 << 22):
+        pos = 0
+        try:
+            while pos < size and not cancelled.is_set():
+                chunk = buf[pos:pos + chunk_size]
+                self.feed(chunk)
+                pos += len(chunk)
+        except ValueError:
+            return  # the map was closed under us
+        self.complete = not cancelled.is_set()
+
+    def line_offset(self, buf, line, size):
+        """Byte offset of the start of 0-based `line`."""
+        k = min(line // self.step, len(self.offsets) - 1)
+        pos, _ = _skip_lines(buf, self.offsets[k], line - k * self.step, size)
+        return pos
+
+    def line_of_offset(self, buf, offset):
+        """0-based line containing byte `offset`."""
+        k = bisect_right(self.offsets, offset) - 1
+        return k * self.step + _count_newlines(buf, self.offsets[k], offset)
+
+
+def _line_index_cache_path(path):
+    directory = os.path.join(_app_data_dir(), "lineindex")
+    os.makedirs(directory, exist_ok=True)
+    key = os.path.abspath(path).encode("utf-8", "surrogateescape")
+    return os.path.join(directory, hashlib.blake2b(key, digest_size=16).hexdigest() + ".idx")
+
+
+def _prune_line_index_cache(directory):
+    try:
+        entries = [e for e in os.scandir(directory) if e.name.endswith(".idx")]
+        entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        for entry in entries[LINE_INDEX_CACHE_FILES:]:
+            os.remove(entry.path)
+    except OSError:
+        pass
+
+
+class LargeFileView:
+    """Read-only viewer for files too large to load into the Text widget.
+
+    The file is memory-mapped and only the visible lines plus a margin are
+    kept in the widget, swapped as the view scrolls. Line numbers are
+    resolved through a LineIndex built on a worker thread.
+    """
+
+    def __init__(self, app, path):
+        self.app = app
+        self.text = app.text
+        self.path = path
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.size = st.st_size
+            self.stat = (st.st_size, st.st_mtime_ns)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.encoding = detect_encoding(self.mm[:SNIFF_SIZE])
+        self.codec, bom = ENCODINGS[self.encoding]
+        self.data_start = len(bom) if self.mm[:len(bom)] == bom else 0
+        # A file reopened unchanged gets its line index from the cache
+        self.index = LineIndex.load_cached(path, self.stat) or LineIndex()
+        self.first = 0          # file line (0-based) shown on widget line 1
+        self.count = 0          # file lines held by the widget
+        self.at_eof = False
+        self._parked = None     # cursor kept while its line is outside the window
+        self._pending = None
+        self._cancelled = threading.Event()
+        if not self.index.complete:
+            threading.Thread(target=self._build_index, daemon=True).start()
+        self._bindings = [
+            ("<Control-Home>", self.text.bind("<Control-Home>", lambda e: self._jump(1))),
+            ("<Control-End>", self.text.bind("<Control-End>", lambda e: self._jump(None))),
+            ("<Button-1>", self.text.bind("<Button-1>", lambda e: self.text.focus_set(), add="+")),
+        ]
+        self.app.after(250, self._poll_index)
+
+    def close(self):
+        self._cancelled.set()
+        if self._pending is not None:
+            self.text.after_cancel(self._pending)
+        for sequence, funcid in self._bindings:
+            self.text.unbind(sequence, funcid)
+        self.mm.close()
+
+    def _build_index(self):
+        self.index.build(self.mm, self.size, self._cancelled)
+        if self.index.complete:
+            self.index.store(self.path, self.stat)
+
+    def index_progress(self):
+        return self.index.bytes_indexed / self.size if self.size else 1.0
+
+    def total_lines(self):
+        if self.index.complete or not self.index.bytes_indexed:
+            return self.index.line_count
+        return max(self.index.line_count,
+                   int(self.index.line_count * self.size / self.index.bytes_indexed))
+
+    def _poll_index(self):
+        if self._cancelled.is_set():
+            return
+        if self.app.large_view is self:     # else its tab is not shown
+            self._update_scrollbar()
+            self.app._schedule_ui("status")
+        if not self.index.complete:
+            self.app.after(250, self._poll_index)
+
+    # -- window management ---------------------------------------------------
+    def _visible_lines(self):
+        linespace = self.app.text_font.metrics("linespace") or 1
+        return max(1, self.text.winfo_height() // linespace)
+
+    def _decode(self, start, end):
+        start = max(start, self.data_start)
+        return self.mm[start:end].decode(self.codec, "replace").replace("\r\n", "\n")
+
+    def show(self, top, cursor=None):
+        """Fill the widget with the lines around `top` and scroll `top` into the first row."""
+        if cursor is None:
+            cursor = self.cursor()
+        if not self.index.complete:
+            top = min(top, self.index.line_count - 1)
+        visible = self._visible_lines()
+        first = max(0, top - VIEWPORT_MARGIN)
+        start = self.index.line_offset(self.mm, first, self.size)
+        end, _ = _skip_lines(self.mm, start, top - first + visible + VIEWPORT_MARGIN, self.size)
+        self.at_eof = end >= self.size
+        content = self._decode(start, end)
+        if not self.at_eof:
+            content = content[:-1]  # drop the newline ending the last full line
+        self.app._raw_text("delete", "1.0", "end")
+        self.app._raw_text("insert", "1.0", content)
+        self.first = first
+        self.count = content.count("\n") + 1
+        self.text.yview(f"{top - first + 1}.0")
+        self._place_cursor(*cursor)
+        self._update_scrollbar()
+
+    def _recenter(self):
+        self._pending = None
+        if self.app.large_view is self:
+            self.show(self._top_line())
+
+    def _top_line(self):
+        return self.first + int(self.text.index("@0,0").split(".")[0]) - 1
+
+    def _update_scrollbar(self):
+        total = max(1, self.total_lines())
+        top = self._top_line()
+        self.app.v_scroll.set(top / total, min(1.0, (top + self._visible_lines()) / total))
+
+    def on_text_scroll(self, first, last):
+        self._update_scrollbar()
+        top = self._top_line() - self.first
+        near_top = self.first > 0 and top < VIEWPORT_MARGIN // 2
+        near_bottom = (not self.at_eof and
+                       self.count - top - self._visible_lines() < VIEWPORT_MARGIN // 2)
+        if (near_top or near_bottom) and self._pending is None:
+            self._pending = self.text.after_idle(self._recenter)
+
+    def on_scrollbar(self, *args):
+        if args[0] == "moveto":
+            self.show(int(float(args[1]) * self.total_lines()))
+        else:
+            self.text.yview(*args)
+
+    # -- cursor --------------------------------------------------------------
+    def cursor(self):
+        """Current (line, col) in file coordinates, both 0-based."""
+        index = self.text.index("insert")
+        if self._parked is not None and self._parked[2] == index:
+            return self._parked[:2]
+        line, col = map(int, index.split("."))
+        return self.first + line - 1, col
+
+    def _place_cursor(self, line, col):
+        if self.first <= line < self.first + self.count:
+            self.text.mark_set("insert", f"{line - self.first + 1}.{col}")
+            self._parked = None
+        else:
+            self.text.mark_set("insert", "1.0" if line < self.first else "end-1c")
+            self._parked = (line, col, self.text.index("insert"))
+
+    def _jump(self, line_no):
+        if line_no is None:
+            line_no = self.index.line_count if self.index.complete else self.total_lines()
+        self.goto_line(line_no)
+        self.app._update_status_bar()
+        return "break"
+
+    def goto_line(self, line_no, col=0):
+        line = line_no - 1
+        self.show(max(0, line - self._visible_lines() // 2), cursor=(line, col))
+        self.text.see("insert")
+
+    # -- search --------------------------------------------------------------
+    def _offset_of(self, line, col):
+        start = self.index.line_offset(self.mm, line, self.size)
+        end = self.mm.find(b"\n", start)
+        text = self._decode(start, self.size if end < 0 else end)
+        return max(start, self.data_start) + len(text[:col].encode(self.codec, "replace"))
+
+    def find_next(self, text, match_case, regex=False):
+        # Searched as bytes straight from the map; without Match case only
+        # ASCII letters fold, since the pattern is a bytes pattern.
+        needle = text.encode(self.codec, "replace")
+        flags = re.MULTILINE | (0 if match_case else re.IGNORECASE)
+        pattern = re.compile(needle if regex else re.escape(needle), flags)
+        start = self._offset_of(*self.cursor())
+        m = pattern.search(self.mm, start) or pattern.search(self.mm, 0, start + len(needle))
+        if m is None:
+            return False
+        line = self.index.line_of_offset(self.mm, m.start())
+        line_start = self.mm.rfind(b"\n", 0, m.start()) + 1
+        col = len(self._decode(line_start, m.start()))
+        end_col = col + len(m.group().decode(self.codec, "replace"))
+        self.goto_line(line + 1, end_col)
+        row = line - self.first + 1
+        self.text.tag_remove("sel", "1.0", "end")
+        self.text.tag_add("sel", f"{row}.{col}", f"{row}.{end_col}")
+        self.text.see(f"{row}.{col}")
+        return True
+
+
+# ----------------------------------------------------------------------
+# Find in Files
+# ----------------------------------------------------------------------
+def _search_files(paths, find_text, match_case, regex):
+    """Pool worker: [(path, hits, error)] for the files that matched or failed.
+
+    hits is a list of (line, col, end_col, line_text), one per matching line.
+    """
+    results = []
+    for path in paths:
+        try:
+            hits = _search_file(path, find_text, match_case, regex)
+        except (OSError, ValueError) as e:
+            results.append((path, [], str(e)))
+            continue
+        if hits:
+            results.append((path, hits, None))
+    return results
+
+
+def _search_file(path, find_text, match_case, regex):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            encoding = detect_encoding(mm[:SNIFF_SIZE])
+            codec, bom = ENCODINGS[encoding]
+            if not encoding.startswith("UTF-16") and b"\0" in mm[:FIND_BINARY_SNIFF]:
+                return []
+            if not regex and find_text.isascii() and not encoding.startswith("UTF-16"):
+                # Plain ASCII text is searched straight from the map
+                flags = re.MULTILINE | (0 if match_case else re.IGNORECASE)
+                pattern = re.compile(re.escape(find_text.encode("ascii")), flags)
+                decode = functools.partial(bytes.decode, encoding=codec, errors="replace")
+                return _scan_matches(mm, pattern, b"\n", len(bom), decode)
+            text = mm[len(bom):].decode(codec, "replace")
+    return _scan_matches(text, compile_search(find_text, match_case, regex), "\n", 0, str)
+
+
+def _scan_matches(buf, pattern, nl, start, decode, limit=FIND_FILE_MAX_HITS):
+    hits = []
+    line = 1
+    pos = start
+    for m in pattern.finditer(buf, start):
+        if m.start() < pos:
+            continue    # same line as the previous hit
+        line += buf[pos:m.start()].count(nl)
+        line_start = max(buf.rfind(nl, 0, m.start()) + 1, start)
+        line_end = buf.find(nl, m.start())
+        if line_end < 0:
+            line_end = len(buf)
+        col = len(decode(buf[line_start:m.start()]))
+        end_col = col + len(decode(buf[m.start():min(m.end(), line_end)]))
+        text = decode(buf[line_start:min(line_end, line_start + 1024)]).rstrip("\r")
+        hits.append((line, col, end_col, text))
+        if limit and len(hits) >= limit:
+            break
+        # Continue after this line
+        line += 1
+        pos = line_end + 1
+    return hits
+
+
+_search_pool = None
+
+
+def _get_search_pool():
+    # Spawned rather than forked: the parent holds Tk and several threads
+    global _search_pool
+    if _search_pool is None:
+        _search_pool = concurrent.futures.ProcessPoolExecutor(
+            mp_context=multiprocessing.get_context("spawn"))
+    return _search_pool
+
+
+class _FileSearch(threading.Thread):
+    """Walks a directory tree and searches its files on the process pool.
+
+    Results are queued as they complete: lists of (path, hits, error), then
+    DONE. Only a few batches are in flight at a time so cancel() takes
+    effect quickly.
+    """
+
+    DONE = object()
+
+    def __init__(self, folder, patterns, find_text, match_case, regex):
+        super().__init__(daemon=True)
+        self.folder = folder
+        self.patterns = patterns
+        self.args = (find_text, match_case, regex)
+        self.results = queue.Queue()
+        self.files_searched = 0
+        self.error = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        pool = _get_search_pool()
+        limit = (os.cpu_count() or 2) * 2
+        pending = {}
+        try:
+            for batch in self._batches():
+                while len(pending) >= limit and not self._cancelled.is_set():
+                    self._collect(pending, concurrent.futures.FIRST_COMPLETED)
+                if self._cancelled.is_set():
+                    break
+                pending[pool.submit(_search_files, batch, *self.args)] = len(batch)
+            while pending and not self._cancelled.is_set():
+                self._collect(pending, concurrent.futures.FIRST_COMPLETED)
+        except Exception as e:
+            self.error = e
+        finally:
+            for future in pending:
+                future.cancel()
+            self.results.put(self.DONE)
+
+    def _collect(self, pending, return_when):
+        done, _ = concurrent.futures.wait(pending, timeout=0.2, return_when=return_when)
+        for future in done:
+            self.files_searched += pending.pop(future)
+            result = future.result()
+            if result:
+                self.results.put(result)
+
+    def _batches(self):
+        batch, size = [], 0
+        for path, file_size in self._walk(self.folder):
+            batch.append(path)
+            size += file_size
+            if len(batch) >= FIND_FILES_BATCH or size >= FIND_FILES_BATCH_BYTES:
+                yield batch
+                batch, size = [], 0
+        if batch:
+            yield batch
+
+    def _walk(self, folder):
+        stack = [folder]
+        while stack and not self._cancelled.is_set():
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in sorted(entries, key=lambda e: e.name.lower(), reverse=True):
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in FIND_SKIP_DIRS:
+                            stack.append(entry.path)
+                    elif entry.is_file() and self._wanted(entry.name):
+                        yield entry.path, entry.stat().st_size
+                except OSError:
+                    pass
+
+    def _wanted(self, name):
+        return any(fnmatch.fnmatch(name, p) for p in self.patterns)
+
+
+# ----------------------------------------------------------------------
+# Find dialog
+# ----------------------------------------------------------------------
 class FindDialog(tk.Toplevel):
-    def __init__(self, parent: Notepad):
+    def __init__(self, parent: EditorWindow):
         super().__init__(parent)
         self.parent = parent
         self.title("Find")
@@ -470,16 +4916,27 @@ class FindDialog(tk.Toplevel):
 
         self.find_var = tk.StringVar(value=parent.find_text)
         self.match_case_var = tk.BooleanVar(value=parent.find_match_case)
+        self.regex_var = tk.BooleanVar(value=parent.find_regex)
+        self.highlight_var = tk.BooleanVar(value=parent.highlight_all)
 
         tk.Label(self, text="Find what:").grid(row=0, column=0, padx=8, pady=8, sticky="w")
         self.entry = tk.Entry(self, textvariable=self.find_var, width=30)
         self.entry.grid(row=0, column=1, padx=8, pady=8)
 
         self.match_case_cb = tk.Checkbutton(self, text="Match case", variable=self.match_case_var)
-        self.match_case_cb.grid(row=1, column=0, columnspan=2, padx=8, pady=(0, 8), sticky="w")
+        self.match_case_cb.grid(row=1, column=0, columnspan=2, padx=8, pady=(0, 2), sticky="w")
+        self.regex_cb = tk.Checkbutton(self, text="Regular expression", variable=self.regex_var)
+        self.regex_cb.grid(row=2, column=0, columnspan=2, padx=8, pady=2, sticky="w")
+        self.highlight_cb = tk.Checkbutton(self, text="Highlight all matches", variable=self.highlight_var,
+                                           command=self.on_highlight_toggled)
+        self.highlight_cb.grid(row=3, column=0, columnspan=2, padx=8, pady=(2, 4), sticky="w")
+        if parent.large_view is not None:
+            self.highlight_cb.config(state="disabled")
+        tk.Label(self, textvariable=parent.match_status_var, anchor="w").grid(
+            row=4, column=0, columnspan=2, padx=8, pady=(0, 8), sticky="w")
 
         btn_frame = tk.Frame(self)
-        btn_frame.grid(row=0, column=2, rowspan=2, padx=8, pady=8, sticky="ns")
+        btn_frame.grid(row=0, column=2, rowspan=5, padx=8, pady=8, sticky="ns")
 
         find_next_btn = tk.Button(btn_frame, text="Find Next", width=12, command=self.on_find_next)
         find_next_btn.pack(fill=tk.X, pady=(0, 4))
@@ -493,16 +4950,23 @@ class FindDialog(tk.Toplevel):
     def on_find_next(self):
         text = self.find_var.get()
         match_case = self.match_case_var.get()
+        regex = self.regex_var.get()
         self.parent.find_text = text
         self.parent.find_match_case = match_case
-        self.parent._do_find_next(text, match_case)
+        self.parent.find_regex = regex
+        self.parent.highlight_all = self.highlight_var.get()
+        self.parent._do_find_next(text, match_case, regex)
+
+    def on_highlight_toggled(self):
+        self.parent.set_highlight_all(self.highlight_var.get(), self.find_var.get(),
+                                      self.match_case_var.get(), self.regex_var.get())
 
 
 # ----------------------------------------------------------------------
 # Replace dialog
 # ----------------------------------------------------------------------
 class ReplaceDialog(tk.Toplevel):
-    def __init__(self, parent: Notepad):
+    def __init__(self, parent: EditorWindow):
         super().__init__(parent)
         self.parent = parent
         self.title("Replace")
@@ -513,6 +4977,7 @@ class ReplaceDialog(tk.Toplevel):
         self.find_var = tk.StringVar(value=parent.find_text)
         self.replace_var = tk.StringVar()
         self.match_case_var = tk.BooleanVar(value=parent.find_match_case)
+        self.regex_var = tk.BooleanVar(value=parent.find_regex)
 
         tk.Label(self, text="Find what:").grid(row=0, column=0, padx=8, pady=(8, 4), sticky="w")
         self.find_entry = tk.Entry(self, textvariable=self.find_var, width=30)
@@ -523,10 +4988,12 @@ class ReplaceDialog(tk.Toplevel):
         self.replace_entry.grid(row=1, column=1, padx=8, pady=4)
 
         self.match_case_cb = tk.Checkbutton(self, text="Match case", variable=self.match_case_var)
-        self.match_case_cb.grid(row=2, column=0, columnspan=2, padx=8, pady=(0, 8), sticky="w")
+        self.match_case_cb.grid(row=2, column=0, columnspan=2, padx=8, pady=(0, 2), sticky="w")
+        self.regex_cb = tk.Checkbutton(self, text="Regular expression", variable=self.regex_var)
+        self.regex_cb.grid(row=3, column=0, columnspan=2, padx=8, pady=(2, 8), sticky="w")
 
         btn_frame = tk.Frame(self)
-        btn_frame.grid(row=0, column=2, rowspan=3, padx=8, pady=8, sticky="ns")
+        btn_frame.grid(row=0, column=2, rowspan=4, padx=8, pady=8, sticky="ns")
 
         tk.Button(btn_frame, text="Find Next", width=12, command=self.on_find_next).pack(fill=tk.X, pady=(0, 4))
         tk.Button(btn_frame, text="Replace", width=12, command=self.on_replace).pack(fill=tk.X, pady=4)
@@ -538,32 +5005,480 @@ class ReplaceDialog(tk.Toplevel):
     def on_find_next(self):
         text = self.find_var.get()
         match_case = self.match_case_var.get()
+        regex = self.regex_var.get()
         self.parent.find_text = text
         self.parent.find_match_case = match_case
-        self.parent._do_find_next(text, match_case)
+        self.parent.find_regex = regex
+        self.parent._do_find_next(text, match_case, regex)
 
     def on_replace(self):
         find_text = self.find_var.get()
         replace_text = self.replace_var.get()
         match_case = self.match_case_var.get()
+        regex = self.regex_var.get()
         self.parent.find_text = find_text
         self.parent.find_match_case = match_case
-        self.parent._replace_once(find_text, replace_text, match_case)
+        self.parent.find_regex = regex
+        self.parent._replace_once(find_text, replace_text, match_case, regex)
 
     def on_replace_all(self):
         find_text = self.find_var.get()
         replace_text = self.replace_var.get()
         match_case = self.match_case_var.get()
+        regex = self.regex_var.get()
         self.parent.find_text = find_text
         self.parent.find_match_case = match_case
-        self.parent._replace_all(find_text, replace_text, match_case)
+        self.parent.find_regex = regex
+        self.parent._replace_all(find_text, replace_text, match_case, regex)
+
+
+# ----------------------------------------------------------------------
+# Find in Files dialog
+# ----------------------------------------------------------------------
+class FindInFilesDialog(tk.Toplevel):
+    def __init__(self, parent: EditorWindow):
+        super().__init__(parent)
+        self.parent = parent
+        self.title("Find in Files")
+        self.transient(parent)
+        self.search = None
+        self.hits = []          # (path, line, col, end_col), parallel to the listbox
+        self.files_matched = 0
+        self.unreadable = 0
+
+        folder = os.path.dirname(parent.filename) if parent.filename else os.getcwd()
+        self.find_var = tk.StringVar(value=parent.find_text)
+        self.folder_var = tk.StringVar(value=folder)
+        self.types_var = tk.StringVar(value="*")
+        self.match_case_var = tk.BooleanVar(value=parent.find_match_case)
+        self.regex_var = tk.BooleanVar(value=parent.find_regex)
+        self.status_var = tk.StringVar()
+
+        tk.Label(self, text="Find what:").grid(row=0, column=0, padx=8, pady=(8, 4), sticky="w")
+        self.entry = tk.Entry(self, textvariable=self.find_var, width=40)
+        self.entry.grid(row=0, column=1, columnspan=2, padx=8, pady=(8, 4), sticky="we")
+
+        tk.Label(self, text="In folder:").grid(row=1, column=0, padx=8, pady=4, sticky="w")
+        tk.Entry(self, textvariable=self.folder_var, width=32).grid(row=1, column=1, padx=(8, 0),
+                                                                    pady=4, sticky="we")
+        tk.Button(self, text="...", command=self.on_browse).grid(row=1, column=2, padx=8, pady=4)
+
+        tk.Label(self, text="File types:").grid(row=2, column=0, padx=8, pady=4, sticky="w")
+        tk.Entry(self, textvariable=self.types_var, width=40).grid(row=2, column=1, columnspan=2,
+                                                                   padx=8, pady=4, sticky="we")
+
+        tk.Checkbutton(self, text="Match case", variable=self.match_case_var).grid(
+            row=3, column=0, columnspan=3, padx=8, pady=(0, 2), sticky="w")
+        tk.Checkbutton(self, text="Regular expression", variable=self.regex_var).grid(
+            row=4, column=0, columnspan=3, padx=8, pady=(2, 4), sticky="w")
+
+        btn_frame = tk.Frame(self)
+        btn_frame.grid(row=0, column=3, rowspan=5, padx=8, pady=8, sticky="ns")
+        tk.Button(btn_frame, text="Find All", width=12, command=self.on_find_all).pack(fill=tk.X, pady=(0, 4))
+        tk.Button(btn_frame, text="Stop", width=12, command=self.stop).pack(fill=tk.X, pady=(0, 4))
+        tk.Button(btn_frame, text="Close", width=12, command=self.on_close).pack(fill=tk.X)
+
+        tk.Label(self, textvariable=self.status_var, anchor="w").grid(
+            row=5, column=0, columnspan=4, padx=8, sticky="we")
+        list_frame = tk.Frame(self)
+        list_frame.grid(row=6, column=0, columnspan=4, padx=8, pady=(4, 8), sticky="nsew")
+        scroll = tk.Scrollbar(list_frame, orient=tk.VERTICAL)
+        scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox = tk.Listbox(list_frame, width=90, height=16, activestyle="none",
+                                  yscrollcommand=scroll.set, font=parent.text_font)
+        self.listbox.pack(fill=tk.BOTH, expand=True)
+        scroll.config(command=self.listbox.yview)
+        self.columnconfigure(1, weight=1)
+        self.rowconfigure(6, weight=1)
+
+        self.listbox.bind("<Double-Button-1>", self.on_open_hit)
+        self.listbox.bind("<Return>", self.on_open_hit)
+        self.entry.bind("<Return>", lambda e: self.on_find_all())
+        self.bind("<Escape>", lambda e: self.stop() if self.search else self.on_close())
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.entry.focus_set()
+
+    def on_browse(self):
+        folder = filedialog.askdirectory(parent=self, initialdir=self.folder_var.get())
+        if folder:
+            self.folder_var.set(folder)
+
+    def on_find_all(self):
+        text = self.find_var.get()
+        folder = self.folder_var.get()
+        if not text:
+            return
+        if not os.path.isdir(folder):
+            messagebox.showerror("Find in Files", f"'{folder}' is not a folder.", parent=self)
+            return
+        match_case = self.match_case_var.get()
+        regex = self.regex_var.get()
+        if self.parent._compile_find(text, match_case, regex) is None:
+            return
+        self.parent.find_text = text
+        self.parent.find_match_case = match_case
+        self.parent.find_regex = regex
+
+        self.stop()
+        self.listbox.delete(0, tk.END)
+        self.hits = []
+        self.files_matched = 0
+        self.unreadable = 0
+        patterns = [p.strip() for p in re.split(r"[;,]", self.types_var.get()) if p.strip()] or ["*"]
+        self.search = _FileSearch(folder, patterns, text, match_case, regex)
+        self.search.start()
+        self.after(LOAD_POLL_MS, self._poll, self.search)
+
+    def _poll(self, search):
+        if search is not self.search:
+            return  # stopped or superseded
+        folder = self.folder_var.get()
+        deadline = time.perf_counter() + LOAD_SLICE_MS / 1000.0
+        rows = []
+        while time.perf_counter() < deadline:
+            try:
+                results = search.results.get_nowait()
+            except queue.Empty:
+                break
+            if results is _FileSearch.DONE:
+                self._add_rows(rows)
+                self.search = None
+                self._set_status(search, done=True)
+                return
+            for path, hits, error in results:
+                if error is not None:
+                    self.unreadable += 1
+                    continue
+                self.files_matched += 1
+                name = os.path.relpath(path, folder)
+                for line, col, end_col, text in hits:
+                    self.hits.append((path, line, col, end_col))
+                    rows.append(f"{name}({line}): {text.strip()}")
+            if len(self.hits) >= FIND_FILES_MAX_HITS:
+                search.cancel()
+        self._add_rows(rows)
+        self._set_status(search)
+        self.after(LOAD_POLL_MS, self._poll, search)
+
+    def _add_rows(self, rows):
+        if rows:
+            self.listbox.insert(tk.END, *rows)
+
+    def _set_status(self, search, done=False):
+        status = (f"{len(self.hits):,} matching lines in {self.files_matched:,} files "
+                  f"({search.files_searched:,} files searched)")
+        if self.unreadable:
+            status += f", {self.unreadable:,} could not be read"
+        if not done:
+            status = "Searching... " + status
+        elif search.error is not None:
+            status += f". Search failed: {search.error}"
+        elif len(self.hits) >= FIND_FILES_MAX_HITS:
+            status += f". Stopped after {FIND_FILES_MAX_HITS:,} matches"
+        elif search._cancelled.is_set():
+            status += ". Stopped"
+        self.status_var.set(status)
+
+    def stop(self):
+        if self.search is not None:
+            self.search.cancel()   # the poll loop reports when it has wound down
+
+    def on_open_hit(self, event=None):
+        selection = self.listbox.curselection()
+        if selection:
+            path, line, col, end_col = self.hits[selection[0]]
+            self.parent.open_location(path, line, col, end_col)
+
+    def on_close(self):
+        if self.search is not None:
+            self.search.cancel()
+            self.search = None
+        self.destroy()
+
+
+# ----------------------------------------------------------------------
+# Performance window (View > Performance, with --trace)
+# ----------------------------------------------------------------------
+class PerformanceWindow(tk.Toplevel):
+    REFRESH_MS = 1000
+
+    def __init__(self, parent: EditorWindow):
+        super().__init__(parent)
+        self.parent = parent
+        self.title("Performance")
+        self.transient(parent)
+
+        text_frame = tk.Frame(self)
+        text_frame.pack(fill=tk.BOTH, expand=True, padx=8, pady=(8, 4))
+        scroll = tk.Scrollbar(text_frame, orient=tk.VERTICAL)
+        scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.table = tk.Text(text_frame, width=110, height=24, wrap="none", font=("Courier New", 9),
+                             yscrollcommand=scroll.set)
+        self.table.pack(fill=tk.BOTH, expand=True)
+        scroll.config(command=self.table.yview)
+
+        btn_frame = tk.Frame(self)
+        btn_frame.pack(pady=(0, 8))
+        tk.Button(btn_frame, text="Export...", width=10, command=self.on_export).pack(side=tk.LEFT, padx=4)
+        tk.Button(btn_frame, text="Reset", width=10, command=self.on_reset).pack(side=tk.LEFT, padx=4)
+        tk.Button(btn_frame, text="Close", width=10, command=self.destroy).pack(side=tk.LEFT, padx=4)
+
+        self.bind("<Escape>", lambda e: self.destroy())
+        self._job = None
+        self.refresh()
+
+    def destroy(self):
+        if self._job is not None:
+            self.after_cancel(self._job)
+        super().destroy()
+
+    def refresh(self):
+        header = "<" + " <".join(str(b) for b in Tracer.BUCKETS_MS) + " more (ms)"
+        lines = [f"{'name':<32} {'count':>7} {'mean ms':>9} {'p95 ms':>8} {'max ms':>9} {'processed':>12}  {header}"]
+        for name, stat in sorted(TRACER.summary().items(), key=lambda item: -item[1]["total_ms"]):
+            processed = _format_size(stat["bytes"]) if stat["bytes"] else (
+                f"{stat['chars']:,} ch" if stat["chars"] else "")
+            lines.append(f"{name[:32]:<32} {stat['count']:>7} {stat['mean_ms']:>9.2f} {stat['p95_ms']:>8.0f} "
+                         f"{stat['max_ms']:>9.1f} {processed:>12}  {' '.join(map(str, stat['buckets']))}")
+        top = self.table.yview()[0]
+        self.table.config(state="normal")
+        self.table.delete("1.0", "end")
+        self.table.insert("1.0", "\n".join(lines))
+        self.table.config(state="disabled")
+        self.table.yview_moveto(top)
+        self._job = self.after(self.REFRESH_MS, self.refresh)
+
+    def on_export(self):
+        path = filedialog.asksaveasfilename(parent=self, initialfile="ainotepad-trace.json",
+                                            defaultextension=".json",
+                                            filetypes=[("Chrome trace", "*.json"), ("All Files", "*.*")])
+        if not path:
+            return
+        try:
+            TRACER.export(path)
+        except OSError as e:
+            messagebox.showerror("Performance", f"Could not write the trace:\n{e}", parent=self)
+
+    def on_reset(self):
+        TRACER.reset()
+        self.after_cancel(self._job)
+        self.refresh()
+
+
+# ----------------------------------------------------------------------
+# Page Setup and Print Preview
+# ----------------------------------------------------------------------
+class PageSetupDialog(tk.Toplevel):
+    def __init__(self, parent: EditorWindow, settings):
+        super().__init__(parent)
+        self.parent = parent
+        self.title("Page Setup")
+        self.resizable(False, False)
+        self.transient(parent)
+        self.grab_set()
+        self.result = None
+
+        self.paper_var = tk.StringVar(value=settings.paper)
+        self.landscape_var = tk.BooleanVar(value=settings.landscape)
+        self.margin_vars = [tk.StringVar(value=f"{m:g}") for m in settings.margins]
+        self.header_var = tk.StringVar(value=settings.header)
+        self.footer_var = tk.StringVar(value=settings.footer)
+
+        tk.Label(self, text="Paper:").grid(row=0, column=0, padx=8, pady=(8, 4), sticky="w")
+        menu = tk.OptionMenu(self, self.paper_var, *PAPER_SIZES)
+        menu.config(width=10)
+        menu.grid(row=0, column=1, columnspan=3, padx=8, pady=(8, 4), sticky="w")
+        tk.Label(self, text="Orientation:").grid(row=1, column=0, padx=8, pady=4, sticky="w")
+        tk.Radiobutton(self, text="Portrait", variable=self.landscape_var, value=False).grid(
+            row=1, column=1, sticky="w")
+        tk.Radiobutton(self, text="Landscape", variable=self.landscape_var, value=True).grid(
+            row=1, column=2, columnspan=2, sticky="w")
+
+        tk.Label(self, text="Margins (inches):").grid(row=2, column=0, columnspan=4, padx=8, pady=(8, 0),
+                                                      sticky="w")
+        for i, label in enumerate(("Left:", "Right:", "Top:", "Bottom:")):
+            tk.Label(self, text=label).grid(row=3 + i // 2, column=(i % 2) * 2, padx=8, pady=2, sticky="e")
+            tk.Entry(self, textvariable=self.margin_vars[i], width=8).grid(
+                row=3 + i // 2, column=(i % 2) * 2 + 1, padx=(0, 8), pady=2, sticky="w")
+
+        tk.Label(self, text="Header:").grid(row=5, column=0, padx=8, pady=(8, 2), sticky="w")
+        tk.Entry(self, textvariable=self.header_var, width=32).grid(row=5, column=1, columnspan=3, padx=8,
+                                                                    pady=(8, 2), sticky="we")
+        tk.Label(self, text="Footer:").grid(row=6, column=0, padx=8, pady=2, sticky="w")
+        tk.Entry(self, textvariable=self.footer_var, width=32).grid(row=6, column=1, columnspan=3, padx=8,
+                                                                    pady=2, sticky="we")
+
+        btn_frame = tk.Frame(self)
+        btn_frame.grid(row=7, column=0, columnspan=4, pady=8)
+        tk.Button(btn_frame, text="OK", width=10, command=self.on_ok).pack(side=tk.LEFT, padx=4)
+        tk.Button(btn_frame, text="Cancel", width=10, command=self.destroy).pack(side=tk.LEFT, padx=4)
+
+        self.bind("<Return>", lambda e: self.on_ok())
+        self.bind("<Escape>", lambda e: self.destroy())
+
+    @classmethod
+    def ask(cls, parent, settings):
+        dialog = cls(parent, settings)
+        parent.wait_window(dialog)
+        return dialog.result
+
+    def on_ok(self):
+        try:
+            margins = tuple(float(var.get()) for var in self.margin_vars)
+        except ValueError:
+            messagebox.showerror("Page Setup", "Margins must be numbers.", parent=self)
+            return
+        width, height = PAPER_SIZES[self.paper_var.get()]
+        if self.landscape_var.get():
+            width, height = height, width
+        if min(margins) < 0 or (margins[0] + margins[1]) * 72 >= width or (margins[2] + margins[3]) * 72 >= height:
+            messagebox.showerror("Page Setup", "The margins leave no room on the page.", parent=self)
+            return
+        self.result = PageSettings(self.paper_var.get(), self.landscape_var.get(), margins,
+                                   self.header_var.get(), self.footer_var.get())
+        self.destroy()
+
+
+class PrintPreview(tk.Toplevel):
+    """Shows the pages one at a time as the window's Paginator lays them out."""
+
+    def __init__(self, parent: EditorWindow):
+        super().__init__(parent)
+        self.parent = parent
+        self.paginator = parent.paginator
+        self.title("Print Preview")
+        self.transient(parent)
+        self.geometry("560x760")
+        self.page = 0
+        self.when = datetime.now()
+        self._drawn = None
+        self._job = None
+        self._font = font.Font(self)
+
+        btn_frame = tk.Frame(self)
+        btn_frame.pack(side=tk.TOP, fill=tk.X, padx=8, pady=4)
+        tk.Button(btn_frame, text="< Previous", width=10, command=lambda: self.show(self.page - 1)).pack(
+            side=tk.LEFT, padx=4)
+        tk.Button(btn_frame, text="Next >", width=10, command=lambda: self.show(self.page + 1)).pack(
+            side=tk.LEFT, padx=4)
+        self.page_label = tk.Label(btn_frame, anchor="w")
+        self.page_label.pack(side=tk.LEFT, padx=8)
+        tk.Button(btn_frame, text="Close", width=10, command=self.destroy).pack(side=tk.RIGHT, padx=4)
+        tk.Button(btn_frame, text="Print...", width=10, command=self.on_print).pack(side=tk.RIGHT, padx=4)
+        self.canvas = tk.Canvas(self, background="gray60", highlightthickness=0)
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+
+        self.canvas.bind("<Configure>", lambda e: self._schedule_draw())
+        self.bind("<Prior>", lambda e: self.show(self.page - 1))
+        self.bind("<Next>", lambda e: self.show(self.page + 1))
+        self.bind("<Home>", lambda e: self.show(0))
+        self.bind("<End>", lambda e: self.show(self.paginator.page_count - 1))
+        self.bind("<Escape>", lambda e: self.destroy())
+
+        self.paginator.listeners.append(self.on_pages)
+        self.paginator.run()
+        self.on_pages()
+
+    def destroy(self):
+        if self.on_pages in self.paginator.listeners:
+            self.paginator.listeners.remove(self.on_pages)
+        if self._job is not None:
+            self.after_cancel(self._job)
+        super().destroy()
+
+    def show(self, page):
+        count = self.paginator.page_count
+        self.page = max(0, min(page, count - 1 if self.paginator.complete else count))
+        self.on_pages()
+
+    def on_pages(self):
+        count = self.paginator.page_count
+        if self.paginator.complete and self.page >= count:
+            self.page = max(count - 1, 0)
+        total = f"{count}" if self.paginator.complete else f"{count}+"
+        self.page_label.config(text=f"Page {self.page + 1} of {total}")
+        if self._drawn != (self.page, self.paginator.generation, self.page < count):
+            self._schedule_draw()
+
+    def _schedule_draw(self):
+        if self._job is None:
+            self._job = self.after_idle(self.draw)
+
+    def draw(self):
+        self._job = None
+        layout, canvas = self.paginator.layout, self.canvas
+        rows = self.paginator.page(self.page)
+        self._drawn = (self.page, self.paginator.generation, rows is not None)
+        canvas.delete("all")
+        width, height = canvas.winfo_width(), canvas.winfo_height()
+        scale = min((width - 24) / layout.page_width, (height - 24) / layout.page_height)
+        if scale <= 0:
+            return
+        x0 = (width - layout.page_width * scale) / 2
+        y0 = (height - layout.page_height * scale) / 2
+        canvas.create_rectangle(x0 + 3, y0 + 3, x0 + layout.page_width * scale + 3,
+                                y0 + layout.page_height * scale + 3, fill="gray30", outline="")
+        canvas.create_rectangle(x0, y0, x0 + layout.page_width * scale, y0 + layout.page_height * scale,
+                                fill="white", outline="black")
+        if rows is None:
+            canvas.create_text(width / 2, height / 2, text="Laying out pages...")
+            return
+        # Negative sizes are in pixels
+        self._font.config(family=self.parent.text_font.actual("family"),
+                          size=-max(1, round(layout.font_size * scale)),
+                          weight="bold" if layout.bold else "normal",
+                          slant="italic" if layout.italic else "roman")
+        for x, y, text in page_items(layout, self.page + 1, rows, self.parent.filename, self.when):
+            canvas.create_text(x0 + x * scale, y0 + y * scale, text=text, anchor="nw", font=self._font)
+
+    def on_print(self):
+        self.destroy()
+        self.parent.print_file()
+
+
+# ----------------------------------------------------------------------
+# Encoding dialog (shown by Save As)
+# ----------------------------------------------------------------------
+class EncodingDialog(tk.Toplevel):
+    def __init__(self, parent: EditorWindow, encoding):
+        super().__init__(parent)
+        self.parent = parent
+        self.title("Save As")
+        self.resizable(False, False)
+        self.transient(parent)
+        self.grab_set()
+        self.result = None
+
+        self.encoding_var = tk.StringVar(value=encoding)
+        tk.Label(self, text="Encoding:").grid(row=0, column=0, padx=8, pady=8, sticky="w")
+        menu = tk.OptionMenu(self, self.encoding_var, *ENCODINGS)
+        menu.config(width=16)
+        menu.grid(row=0, column=1, padx=8, pady=8, sticky="w")
+
+        btn_frame = tk.Frame(self)
+        btn_frame.grid(row=1, column=0, columnspan=2, pady=(0, 8))
+        tk.Button(btn_frame, text="Save", width=10, command=self.on_ok).pack(side=tk.LEFT, padx=4)
+        tk.Button(btn_frame, text="Cancel", width=10, command=self.destroy).pack(side=tk.LEFT, padx=4)
+
+        self.bind("<Return>", lambda e: self.on_ok())
+        self.bind("<Escape>", lambda e: self.destroy())
+
+    @classmethod
+    def ask(cls, parent, encoding):
+        dialog = cls(parent, encoding)
+        parent.wait_window(dialog)
+        return dialog.result
+
+    def on_ok(self):
+        self.result = self.encoding_var.get()
+        self.destroy()
 
 
 # ----------------------------------------------------------------------
 # Font dialog (simple)
 # ----------------------------------------------------------------------
 class FontDialog(tk.Toplevel):
-    def __init__(self, parent: Notepad):
+    def __init__(self, parent: EditorWindow):
         super().__init__(parent)
         self.parent = parent
         self.title("Font")
@@ -576,7 +5491,7 @@ class FontDialog(tk.Toplevel):
         self.bold_var = tk.BooleanVar(value=(parent.current_font_weight == "bold"))
         self.italic_var = tk.BooleanVar(value=(parent.current_font_slant == "italic"))
 
-        families = sorted(font.families())
+        families = parent.font_families()
 
         # Family listbox
         tk.Label(self, text="Font:").grid(row=0, column=0, padx=8, pady=(8, 4), sticky="w")
@@ -646,9 +5561,410 @@ class FontDialog(tk.Toplevel):
         self.parent.current_font_slant = slant
 
         self.parent.text_font.config(family=family, size=size, weight=weight, slant=slant)
+        self.parent.wrap_index.invalidate()
+        self.parent._update_page_layout()
         self.destroy()
 
 
-if __name__ == "__main__":
+# ----------------------------------------------------------------------
+# Single instance
+# ----------------------------------------------------------------------
+def _instance_file():
+    return os.path.join(_app_data_dir(), "instance.json")
+
+
+class InstanceServer:
+    """Receives file lists from later launches over loopback TCP.
+
+    The port and a random token are published in instance.json in the app
+    data directory (readable by the owner only); requests without the token
+    are ignored. Connections are served on a thread and the files opened from
+    the UI thread, which polls for them.
+    """
+
+    def __init__(self, app: Notepad):
+        self.app = app
+        self.requests = queue.Queue()
+        self.token = secrets.token_hex(16)
+        self.closed = False
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(8)
+        info = {"port": self.sock.getsockname()[1], "token": self.token, "pid": os.getpid()}
+        path = _instance_file()
+        tmp = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(info, f)
+        os.replace(tmp, path)
+        threading.Thread(target=self._serve, daemon=True).start()
+        app.after(INSTANCE_POLL_MS, self._poll)
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return  # closed
+            with conn:
+                try:
+                    conn.settimeout(5)
+                    data = b""
+                    while not data.endswith(b"\n") and len(data) < 1 << 20:
+                        chunk = conn.recv(65536)
+                        if not chunk:
+                            break
+                        data += chunk
+                    request = json.loads(data)
+                    if hmac.compare_digest(str(request.get("token", "")), self.token):
+                        self.requests.put([p for p in request.get("files", []) if isinstance(p, str)])
+                        conn.sendall(b"ok\n")
+                except (OSError, ValueError, AttributeError):
+                    pass
+
+    def _poll(self):
+        if self.closed:
+            return
+        while True:
+            try:
+                files = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            self.app.open_windows(files or [None])
+        self.app.after(INSTANCE_POLL_MS, self._poll)
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        # Leave the file alone if another instance has since taken over
+        with contextlib.suppress(OSError, ValueError):
+            with open(_instance_file()) as f:
+                mine = json.load(f).get("token") == self.token
+            if mine:
+                os.remove(_instance_file())
+
+
+def send_to_running_instance(files):
+    """Hands `files` to the running instance; returns False if there is none."""
+    try:
+        with open(_instance_file()) as f:
+            info = json.load(f)
+        request = {"token": info["token"], "files": [os.path.abspath(p) for p in files]}
+        with socket.create_connection(("127.0.0.1", info["port"]), timeout=2) as conn:
+            conn.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            return conn.makefile("rb").readline().strip() == b"ok"
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+
+# ----------------------------------------------------------------------
+# Command-line batch mode
+# ----------------------------------------------------------------------
+BatchOptions = collections.namedtuple(
+    "BatchOptions", "find replace match_case regex count encoding eol")
+
+EOL_NAMES = {"lf": "\n", "crlf": "\r\n"}
+
+
+def _read_chunks(path, whole=False, translate=True):
+    """Yields a file's text as open_file() would load it, in chunks of whole lines.
+
+    The loader is returned first so that its encoding, line endings and
+    error can be inspected as reading progresses. Without `translate` the
+    line endings are left as they are in the file.
+    """
+    loader = _FileLoader(path, translate=translate)
+    loader.start()
+    yield loader
+    pending = []
+    while True:
+        item = loader.chunks.get()
+        if item is _FileLoader.EOF:
+            break
+        if whole:
+            pending.append(item)
+            continue
+        text = "".join(pending) + item
+        cut = max(text.rfind("\n"), text.rfind("\r")) + 1
+        pending = [text[cut:]]
+        if cut:
+            yield text[:cut]
+    if loader.error is not None:
+        raise loader.error
+    text = "".join(pending)
+    if text:
+        yield text
+
+
+def _batch_file(path, opts):
+    """Runs the batch operations on one file; returns a result dict for the report."""
+    result = {"path": path, "count": 0, "lines": [], "written": False,
+              "encoding": None, "eol": None, "error": None}
+    try:
+        _batch_process(path, opts, result)
+    except (OSError, UnicodeError, ValueError) as e:
+        result["error"] = str(e)
+    return result
+
+
+def _batch_process(path, opts, result):
+    # Matches that may span lines (any regex, or text containing a newline)
+    # need the whole file; everything else streams line-aligned chunks
+    whole = bool(opts.find) and (opts.regex or "\n" in opts.find)
+    convert = opts.encoding is not None or opts.eol is not None
+    pattern = compile_search(opts.find, opts.match_case, opts.regex) if opts.find else None
+
+    if opts.replace is None or not convert:
+        # Read-only pass: find, count, or see whether a replace has anything to do
+        chunks = _read_chunks(path, whole)
+        loader = next(chunks)
+        line = 1
+        for chunk in chunks:
+            if pattern is not None:
+                if opts.replace is None and not opts.count:
+                    for n, col, end_col, text in _scan_matches(chunk, pattern, "\n", 0, str, None):
+                        result["lines"].append((line + n - 1, text))
+                result["count"] += sum(1 for _ in pattern.finditer(chunk))
+            line += chunk.count("\n")
+        result["encoding"] = loader.encoding
+        if opts.replace is None and not convert:
+            return
+        if opts.replace is not None and not result["count"]:
+            return
+
+    _batch_write(path, opts, result, whole)
+
+
+class _EncodingChanged(Exception):
+    """The sniffed UTF-8 turned out to be ANSI part way through the file."""
+
+
+def _replace_keeping_eols(chunk, pattern, replace_text, regex, eol):
+    """Replaces every match in `chunk`, whose lines end in \n, \r\n or \r.
+
+    Matching sees \n line ends, as in the editor; the text between matches
+    keeps its own endings and newlines in a replacement become `eol`.
+    Returns (text, count).
+    """
+    text = chunk.replace("\r\n", "\n").replace("\r", "\n")
+    crlf = [m.start() - k for k, m in enumerate(re.finditer("\r\n", chunk))] if "\r\n" in chunk else []
+    parts, raw_pos, count = [], 0, 0
+    for m in pattern.finditer(text):
+        start = m.start() + bisect_left(crlf, m.start())
+        parts.append(chunk[raw_pos:start])
+        replacement = m.expand(replace_text) if regex else replace_text
+        parts.append(replacement.replace("\n", eol) if eol != "\n" else replacement)
+        raw_pos = m.end() + bisect_left(crlf, m.end())
+        count += 1
+    if not count:
+        return chunk, 0
+    parts.append(chunk[raw_pos:])
+    return "".join(parts), count
+
+
+def _batch_write(path, opts, result, whole, encoding=None):
+    # The file is written exactly as read apart from the requested changes,
+    # final newlines and, unless --normalize-eol is given, each line's ending included
+    keep_eols = opts.eol is None
+    pattern = compile_search(opts.find, opts.match_case, opts.regex) if opts.replace is not None else None
+    chunks = _read_chunks(path, whole, translate=not keep_eols)
+    loader = next(chunks)
+    saver = None
+    eol = EOL_NAMES.get(opts.eol)
+    count = 0
+    try:
+        for chunk in chunks:
+            if eol is None and loader.newlines:
+                # The file keeps its line endings unless asked otherwise
+                eol = "\r\n" if "\r\n" in loader.newlines else "\n"
+            if saver is None:
+                saver = _FileSaver(path, encoding or opts.encoding or loader.encoding,
+                                   compression=loader.compression, verbatim=True)
+                saver.start()
+            if saver.encoding != (encoding or opts.encoding or loader.encoding):
+                raise _EncodingChanged()
+            if keep_eols:
+                saver.eol = "\n"   # the chunks carry their own endings
+                if pattern is not None:
+                    chunk, n = _replace_keeping_eols(chunk, pattern, opts.replace, opts.regex, eol or "\n")
+                    count += n
+            else:
+                saver.eol = eol
+                if pattern is not None:
+                    start, end, replacement, n = replace_all_in_text(chunk, opts.find, opts.replace,
+                                                                     opts.match_case, opts.regex)
+                    if n:
+                        chunk = chunk[:start] + replacement + chunk[end:]
+                        count += n
+            saver.chunks.put(chunk)
+        if saver is not None and saver.encoding != (encoding or opts.encoding or loader.encoding):
+            raise _EncodingChanged()
+    except BaseException as e:
+        # Nothing has replaced the file yet
+        loader.cancel()
+        chunks.close()
+        if saver is not None:
+            saver.aborted = True
+            saver.chunks.put(None)
+            saver.join()
+        if isinstance(e, _EncodingChanged):
+            # Everything before that point was ASCII, but the rest must be
+            # written as ANSI too: start over from the original
+            return _batch_write(path, opts, result, whole, loader.encoding)
+        raise
+    if saver is None:
+        # Empty file: still written, so it gets the requested encoding
+        saver = _FileSaver(path, encoding or opts.encoding or loader.encoding or DEFAULT_ENCODING,
+                           eol=eol or os.linesep, compression=loader.compression, verbatim=True)
+        saver.start()
+    saver.chunks.put(None)
+    saver.join()
+    if saver.error is not None:
+        raise saver.error
+    result.update(count=count, written=True, encoding=saver.encoding, eol=eol if keep_eols else saver.eol)
+
+
+def _expand_paths(patterns):
+    # The Windows shell leaves wildcards to the program
+    paths = []
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        paths.extend(sorted(matches) or [pattern])
+    return paths
+
+
+def run_batch(args):
+    """Runs --find/--replace/--count/--convert-encoding/--normalize-eol; returns the exit status.
+
+    0: something matched or was written, 1: nothing matched, 2: errors.
+    """
+    if args.replace is not None and not args.find:
+        print("ainotepad: --replace needs --find", file=sys.stderr)
+        return 2
+    if args.count and not args.find:
+        print("ainotepad: --count needs --find", file=sys.stderr)
+        return 2
+    if args.find:
+        try:
+            compile_search(args.find, args.match_case, args.regex)
+        except re.error as e:
+            print(f"ainotepad: invalid regular expression: {e}", file=sys.stderr)
+            return 2
+    paths = _expand_paths(args.files)
+    if not paths:
+        print("ainotepad: no files given", file=sys.stderr)
+        return 2
+    opts = BatchOptions(args.find, args.replace, args.match_case, args.regex, args.count,
+                        args.convert_encoding, args.normalize_eol)
+
+    jobs = min(args.jobs or os.cpu_count() or 1, len(paths))
+    if jobs > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        results = pool.map(_batch_file, paths, [opts] * len(paths), chunksize=max(1, len(paths) // (jobs * 8)))
+    else:
+        pool = None
+        results = (_batch_file(path, opts) for path in paths)
+
+    matched = failed = False
+    try:
+        for result in results:
+            path = result["path"]
+            if result["error"] is not None:
+                print(f"ainotepad: {path}: {result['error']}", file=sys.stderr)
+                failed = True
+                continue
+            matched = matched or bool(result["count"] or result["written"])
+            if opts.count:
+                print(f"{path}: {result['count']}")
+            elif opts.replace is None and opts.find:
+                for line, text in result["lines"]:
+                    print(f"{path}:{line}:{text}")
+            if result["written"]:
+                details = []
+                if opts.replace is not None:
+                    details.append(f"{result['count']} replacement(s)")
+                if opts.encoding:
+                    details.append(result["encoding"])
+                if opts.eol:
+                    details.append(opts.eol.upper())
+                print(f"{path}: written ({', '.join(details)})", file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if failed:
+        return 2
+    return 0 if matched or not opts.find else 1
+
+
+# ----------------------------------------------------------------------
+# Startup
+# ----------------------------------------------------------------------
+def _startup_mark(phase):
+    _STARTUP_MARKS.append((phase, time.perf_counter()))
+
+
+def _print_startup_profile():
+    start = prev = _STARTUP_MARKS[0][1]
+    print(f"{'phase':<20} {'ms':>8} {'total':>8}", file=sys.stderr)
+    for phase, t in _STARTUP_MARKS[1:]:
+        print(f"{phase:<20} {(t - prev) * 1000:8.1f} {(t - start) * 1000:8.1f}", file=sys.stderr)
+        prev = t
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="ainotepad")
+    parser.add_argument("files", nargs="*", help="files to open, or to process in batch mode")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long each startup phase took to stderr")
+    parser.add_argument("--single-instance", action="store_true", default=SINGLE_INSTANCE,
+                        help="open the file in an already running Notepad if there is one")
+    parser.add_argument("--trace", action="store_true",
+                        help="time UI callbacks and file operations (View > Performance)")
+    parser.add_argument("--trace-file", metavar="FILE",
+                        help="like --trace, and write a Chrome trace to FILE on exit")
+    parser.add_argument("--tabs", action="store_true", default=TABS,
+                        help="open files in tabs of one window instead of further windows")
+    batch = parser.add_argument_group("batch mode", "process the files without opening a window")
+    batch.add_argument("--find", metavar="TEXT", help="print the lines containing TEXT")
+    batch.add_argument("--replace", metavar="TEXT", help="replace all matches of --find in place")
+    batch.add_argument("--count", action="store_true", help="print the number of matches per file")
+    batch.add_argument("--match-case", action="store_true")
+    batch.add_argument("--regex", action="store_true", help="--find is a regular expression")
+    batch.add_argument("--convert-encoding", choices=list(ENCODINGS), metavar="ENCODING",
+                       help="rewrite the files in ENCODING (" + ", ".join(ENCODINGS) + ")")
+    batch.add_argument("--normalize-eol", choices=list(EOL_NAMES),
+                       help="rewrite the files with these line endings")
+    batch.add_argument("-j", "--jobs", type=int, help="files processed in parallel (default: CPUs)")
+    args = parser.parse_args(argv)
+
+    if (args.find is not None or args.convert_encoding or args.normalize_eol
+            or args.replace is not None or args.count):
+        sys.exit(run_batch(args))
+
+    if args.single_instance and send_to_running_instance(args.files):
+        return
+
+    if args.trace or args.trace_file:
+        TRACER.enable(args.trace_file)
+    EditorWindow.tabbed = args.tabs
+
     app = Notepad()
+    if args.single_instance:
+        try:
+            app.instance_server = InstanceServer(app)
+        except OSError:
+            pass
+    if args.profile_startup:
+        def first_paint(event):
+            app.text.unbind("<Expose>", binding)
+            _startup_mark("first paint")
+            _print_startup_profile()
+        binding = app.text.bind("<Expose>", first_paint, add="+")
+    if args.files:
+        app.after_idle(app.open_windows, _expand_paths(args.files))
     app.mainloop()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -26,7 +26,7 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    upx=False,      # decompressing UPX-packed DLLs on every launch slows cold start
     upx_exclude=[],
     runtime_tmpdir=None,
     console=False,
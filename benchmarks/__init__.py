@@ -0,0 +1,10 @@
+"""Headless benchmarks for ainotepad's core editor operations.
+
+    python -m benchmarks run --output before.json
+    python -m benchmarks run --target path/to/other/ainotepad.py --output after.json
+    python -m benchmarks compare before.json after.json
+
+Every case (operation x document) runs in its own process so that the
+reported peak RSS belongs to that case alone. Without a display an Xvfb
+server is started for the run when one is installed.
+"""
@@ -0,0 +1,193 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .documents import ENCODINGS, document_path, format_size, parse_size
+from .harness import OPERATIONS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = "1K,64K,1M,16M"     # add 128M,500M for the large file paths
+NOISE_FLOOR = 0.005                 # seconds; smaller differences are ignored
+
+
+# ----------------------------------------------------------------------
+# Display
+# ----------------------------------------------------------------------
+def start_xvfb():
+    """Starts Xvfb on a free display; returns (process, ':N') or (None, None)."""
+    xvfb = shutil.which("Xvfb")
+    if xvfb is None:
+        return None, None
+    read_fd, write_fd = os.pipe()
+    proc = subprocess.Popen([xvfb, "-displayfd", str(write_fd), "-screen", "0", "1280x1024x24",
+                             "-nolisten", "tcp"], pass_fds=(write_fd,),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        number = f.readline().strip()
+    if not number:
+        proc.kill()
+        return None, None
+    return proc, f":{number}"
+
+
+# ----------------------------------------------------------------------
+# Run
+# ----------------------------------------------------------------------
+def run_case(args, env, document, operation):
+    cmd = [sys.executable, "-m", "benchmarks.harness", "--target", args.target,
+           "--document", document, "--operation", operation, "--timeout", str(args.timeout)]
+    try:
+        proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True,
+                              timeout=args.timeout + 60)
+    except subprocess.TimeoutExpired:
+        return {"seconds": None, "peak_rss": None, "error": "timed out"}
+    lines = proc.stdout.strip().splitlines()
+    try:
+        return json.loads(lines[-1])
+    except (IndexError, ValueError):
+        error = proc.stderr.strip().splitlines()
+        return {"seconds": None, "peak_rss": None,
+                "error": error[-1] if error else f"exit status {proc.returncode}"}
+
+
+def run(args):
+    args.target = os.path.abspath(args.target)
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), "ainotepad-bench")
+    os.makedirs(data_dir, exist_ok=True)
+    home = tempfile.mkdtemp(prefix="ainotepad-bench-home-")
+
+    env = dict(os.environ, AINOTEPAD_HOME=home, AINOTEPAD_JOURNAL="0")
+    xvfb = None
+    if not env.get("DISPLAY") and sys.platform.startswith("linux"):
+        xvfb, display = start_xvfb()
+        if xvfb is None:
+            sys.exit("No display available and Xvfb is not installed.")
+        env["DISPLAY"] = display
+
+    with open(args.target, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    report = {
+        "meta": {
+            "target": args.target,
+            "sha1": digest,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+        },
+        "results": [],
+    }
+    try:
+        for size in [parse_size(s) for s in args.sizes.split(",")]:
+            for line_length in [int(n) for n in args.line_lengths.split(",")]:
+                for encoding in args.encodings.split(","):
+                    document = document_path(data_dir, size, line_length, encoding)
+                    for operation in args.operations.split(","):
+                        case = f"{operation}/{format_size(size)}/{line_length}/{encoding}"
+                        runs = [run_case(args, env, document, operation) for _ in range(args.repeat)]
+                        timed = [r["seconds"] for r in runs if r["seconds"] is not None]
+                        rss = [r["peak_rss"] for r in runs if r.get("peak_rss") is not None]
+                        doc = [r["document_bytes"] for r in runs if r.get("document_bytes") is not None]
+                        errors = sorted({r["error"] for r in runs if r.get("error")})
+                        result = {
+                            "case": case, "operation": operation, "size": size,
+                            "line_length": line_length, "encoding": encoding,
+                            "seconds": min(timed) if timed else None,
+                            "peak_rss": max(rss) if rss else None,
+                            "document_bytes": max(doc) if doc else None,
+                            "errors": errors,
+                            "messages": runs[-1].get("messages", []),
+                        }
+                        report["results"].append(result)
+                        print(_format_result(result), flush=True)
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+        shutil.rmtree(home, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+
+
+def _format_result(result):
+    seconds = "-" if result["seconds"] is None else f"{result['seconds'] * 1000:10.1f} ms"
+    rss = "-" if result["peak_rss"] is None else f"{result['peak_rss'] / (1 << 20):8.1f} MB"
+    line = f"{result['case']:<40} {seconds:>14} {rss:>12}"
+    if result.get("document_bytes") is not None:
+        line += f"  document {result['document_bytes'] / (1 << 20):.1f} MB"
+    if result["errors"]:
+        line += "  " + "; ".join(result["errors"])
+    return line
+
+
+# ----------------------------------------------------------------------
+# Compare
+# ----------------------------------------------------------------------
+def compare(args):
+    with open(args.base) as f:
+        base = {r["case"]: r for r in json.load(f)["results"]}
+    with open(args.new) as f:
+        new = {r["case"]: r for r in json.load(f)["results"]}
+
+    regressions = 0
+    print(f"{'case':<40} {'base':>12} {'new':>12} {'change':>8} {'rss':>8}")
+    for case in [c for c in base if c in new]:
+        old_s, new_s = base[case]["seconds"], new[case]["seconds"]
+        if old_s is None or new_s is None:
+            print(f"{case:<40} {'-':>12} {'-':>12}")
+            continue
+        change = (new_s - old_s) / old_s if old_s else 0.0
+        rss = ""
+        if base[case].get("peak_rss") and new[case].get("peak_rss"):
+            rss = f"{(new[case]['peak_rss'] - base[case]['peak_rss']) / base[case]['peak_rss']:+.0%}"
+        flag = ""
+        if change > args.threshold and new_s - old_s > NOISE_FLOOR:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{case:<40} {old_s * 1000:10.1f}ms {new_s * 1000:10.1f}ms {change:+8.0%} {rss:>8}{flag}")
+    missing = sorted(set(base) ^ set(new))
+    if missing:
+        print(f"\n{len(missing)} case(s) only in one report: {', '.join(missing)}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("run", help="run the benchmarks")
+    p.add_argument("--target", default=os.path.join(ROOT, "ainotepad.py"),
+                   help="ainotepad.py to measure")
+    p.add_argument("--sizes", default=DEFAULT_SIZES, help="document sizes, e.g. 1K,1M,500M")
+    p.add_argument("--line-lengths", default="80,1000")
+    p.add_argument("--encodings", default="utf-8", help=",".join(ENCODINGS))
+    p.add_argument("--operations", default=",".join(OPERATIONS))
+    p.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest is kept")
+    p.add_argument("--timeout", type=float, default=600.0, help="seconds per run")
+    p.add_argument("--data-dir", help="where generated documents are cached")
+    p.add_argument("--output", help="write results to this JSON file")
+
+    p = commands.add_parser("compare", help="compare two result files")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.10,
+                   help="slowdown reported as a regression (0.10 = 10%%)")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
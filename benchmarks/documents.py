@@ -0,0 +1,82 @@
+"""Synthetic test documents, generated once and cached on disk."""
+import os
+import random
+
+NEEDLE = "NEEDLE-7f3a9c"      # appears once, on the last line
+WORD = "lorem"                # frequent word, used by Replace All
+
+ENCODINGS = {
+    # name -> (codec, byte order mark)
+    "utf-8": ("utf-8", b""),
+    "utf-16": ("utf-16-le", b"\xff\xfe"),
+    "ansi": ("cp1252", b""),
+}
+
+_VOCABULARY = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+               "tempor incididunt ut labore et dolore magna aliqua café naïve façade "
+               "déjà über").split()
+_BLOCK_SIZE = 1 << 20
+
+
+def parse_size(text):
+    """'64K', '16M', '1G' or a plain byte count."""
+    text = text.strip().upper().rstrip("B")
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(n):
+    for unit, size in (("G", 1 << 30), ("M", 1 << 20), ("K", 1 << 10)):
+        if n >= size and n % size == 0:
+            return f"{n // size}{unit}"
+    return str(n)
+
+
+def document_path(directory, size, line_length, encoding):
+    name = f"doc-{format_size(size)}-{line_length}-{encoding}.txt"
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        _generate(path, size, line_length, encoding)
+    return path
+
+
+def _lines(rng, line_length):
+    while True:
+        words = []
+        length = 0
+        while length < line_length:
+            word = rng.choice(_VOCABULARY)
+            words.append(word)
+            length += len(word) + 1
+        yield " ".join(words)[:line_length]
+
+
+def _generate(path, size, line_length, encoding):
+    # A block of random lines is generated once and repeated up to `size`
+    codec, bom = ENCODINGS[encoding]
+    rng = random.Random(f"{line_length}-{encoding}")
+    lines = _lines(rng, line_length)
+    block = []
+    block_bytes = 0
+    while block_bytes < min(size, _BLOCK_SIZE):
+        line = next(lines) + "\n"
+        block.append(line)
+        block_bytes += len(line.encode(codec))
+    block = "".join(block).encode(codec)
+    tail = (NEEDLE + "\n").encode(codec)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(bom)
+        remaining = max(size - len(bom) - len(tail), 0)
+        while remaining >= len(block):
+            f.write(block)
+            remaining -= len(block)
+        if remaining:
+            # Cut at a line boundary so the last block stays decodable
+            cut = block.rfind("\n".encode(codec), 0, remaining)
+            f.write(block[:cut + len("\n".encode(codec))] if cut >= 0 else b"")
+        f.write(tail)
+    os.replace(tmp, path)
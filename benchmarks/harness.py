@@ -0,0 +1,186 @@
+"""Runs one benchmark case in the current process and prints its result as JSON.
+
+The target ainotepad.py is imported from a path so that two builds can be
+measured with the same harness. Modal dialogs are replaced by recorders:
+message boxes return at once, Go To gets its line number from the case, and
+grab_set() is a no-op so nothing waits for input.
+"""
+import contextlib
+import importlib.util
+import inspect
+import json
+import os
+import sys
+import time
+
+from .documents import NEEDLE, WORD
+
+OPERATIONS = ("open", "save", "find", "replace_all", "goto", "font")
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def load_target(path):
+    spec = importlib.util.spec_from_file_location("ainotepad", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["ainotepad"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@contextlib.contextmanager
+def _patched(owner, name, value):
+    saved = getattr(owner, name)
+    setattr(owner, name, value)
+    try:
+        yield
+    finally:
+        setattr(owner, name, saved)
+
+
+class Case:
+    def __init__(self, module, document, timeout=600.0):
+        self.module = module
+        self.document = document
+        self.timeout = timeout
+        self.messages = []
+        self.goto_line = 1
+        self._patch_dialogs()
+        self.app = module.Notepad()
+        self.app.withdraw()
+        self.app.update()
+
+    def _patch_dialogs(self):
+        tk = self.module.tk
+        messagebox = self.module.messagebox
+        for name in ("showinfo", "showwarning", "showerror"):
+            setattr(messagebox, name, self._recorder(name, None))
+        for name in ("askyesno", "askyesnocancel", "askokcancel"):
+            setattr(messagebox, name, self._recorder(name, False))
+        self.module.simpledialog.askinteger = lambda *args, **kw: self.goto_line
+        tk.Toplevel.grab_set = lambda self: None
+        if hasattr(self.module.Notepad, "_offer_recovery"):
+            self.module.Notepad._offer_recovery = lambda self: None
+
+    def _recorder(self, name, result):
+        def record(title=None, message=None, **kw):
+            self.messages.append(f"{name}: {message}")
+            return result
+        return record
+
+    def wait(self, done):
+        deadline = time.perf_counter() + self.timeout
+        while not done():
+            if time.perf_counter() > deadline:
+                raise TimeoutError("operation did not finish")
+            self.app.update()
+
+    def _idle(self):
+        app = self.app
+        if getattr(app, "_loader", None) is not None or getattr(app, "_saver", None) is not None:
+            return False
+        view = getattr(app, "large_view", None)
+        return view is None or view.index.complete
+
+    # -- operations ----------------------------------------------------------
+    def open(self):
+        if "path" in inspect.signature(self.app.open_file).parameters:
+            self.app.open_file(self.document)
+        else:
+            # Builds whose open_file() always asks for the file
+            filedialog = self.module.filedialog
+            with _patched(filedialog.Open, "show", lambda dialog, **kw: self.document), \
+                    _patched(filedialog, "askopenfilename", lambda *args, **kw: self.document):
+                self.app.open_file()
+        self.wait(self._idle)
+        self.app.update()
+
+    def save(self):
+        out = self.document + ".saved"
+        write = self.app._write_to_file
+        try:
+            if "wait" in inspect.signature(write).parameters:
+                write(out, wait=True)
+            else:
+                write(out)
+            self.wait(self._idle)
+        finally:
+            if os.path.exists(out):
+                os.remove(out)
+
+    def find(self):
+        self.app.text.mark_set("insert", "1.0")
+        self.app._do_find_next(NEEDLE, True)
+        self.app.update()
+
+    def replace_all(self):
+        self.app._replace_all(WORD, WORD.upper(), True)
+        self.app.update()
+
+    def goto(self):
+        view = getattr(self.app, "large_view", None)
+        if view is not None:
+            self.goto_line = view.index.line_count
+        else:
+            self.goto_line = int(self.app.text.index("end-1c").split(".")[0])
+        self.app.goto_dialog()
+        self.app.update()
+
+    def font(self):
+        dialog = self.module.FontDialog(self.app)
+        dialog.update_idletasks()
+        dialog.destroy()
+
+
+def run(target, document, operation, timeout=600.0):
+    module = load_target(target)
+    case = Case(module, document, timeout)
+    if operation != "open":
+        case.open()
+    rss_before = peak_rss()
+    start = time.perf_counter()
+    error = None
+    try:
+        getattr(case, operation)()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+    # What the document model holds on top of the Text widget's own copy
+    document = getattr(case.app, "document", None)
+    result = {
+        "seconds": seconds,
+        "peak_rss": peak_rss(),
+        "peak_rss_before": rss_before,
+        "document_bytes": document.memory() if hasattr(document, "memory") else None,
+        "messages": case.messages,
+        "error": error,
+    }
+    case.app.destroy()
+    return result
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.harness")
+    parser.add_argument("--target", required=True)
+    parser.add_argument("--document", required=True)
+    parser.add_argument("--operation", required=True, choices=OPERATIONS)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    args = parser.parse_args(argv)
+    result = run(args.target, args.document, args.operation, args.timeout)
+    json.dump(result, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
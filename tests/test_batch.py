@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+from ainotepad import BatchOptions, _batch_file
+
+
+class BatchReplaceTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def run_batch(self, data, find, replace, regex=False, eol=None):
+        path = os.path.join(self.dir.name, "file.txt")
+        with open(path, "wb") as f:
+            f.write(data)
+        result = _batch_file(path, BatchOptions(find, replace, True, regex, False, None, eol))
+        self.assertIsNone(result["error"])
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_mixed_line_endings_are_kept(self):
+        self.assertEqual(self.run_batch(b"foo\r\nbar\nfoo\r\n", "foo", "baz"), b"baz\r\nbar\nbaz\r\n")
+        self.assertEqual(self.run_batch(b"foo\rbar\rfoo", "foo", "baz"), b"baz\rbar\rbaz")
+
+    def test_matches_see_newlines_across_endings(self):
+        self.assertEqual(self.run_batch(b"a\r\nb\r\nc\n", r"a\nb$", "x", regex=True), b"x\r\nc\n")
+
+    def test_final_newline_state_is_kept(self):
+        self.assertEqual(self.run_batch(b"no newline x", "x", "xy"), b"no newline xy")
+        self.assertEqual(self.run_batch(b"x\n\n\n", "x", "xy"), b"xy\n\n\n")
+
+    def test_normalize_eol(self):
+        self.assertEqual(self.run_batch(b"foo\r\nbar\nfoo\r", "foo", "baz", eol="lf"), b"baz\nbar\nbaz\n")
+
+    def test_ansi_found_late_is_not_replaced_twice(self):
+        data = b"x\n" * 200000 + b"caf\xe9 x\n"
+        self.assertEqual(self.run_batch(data, "x", "xy"), b"xy\n" * 200000 + b"caf\xe9 xy\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
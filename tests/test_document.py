@@ -0,0 +1,128 @@
+import random
+import types
+import unittest
+from unittest import mock
+
+import ainotepad
+from ainotepad import Document, EditorWindow
+
+
+class DocumentTest(unittest.TestCase):
+    def test_insert_delete_get(self):
+        doc = Document("hello world")
+        doc.insert(5, ",")
+        doc.insert(0, ">> ")
+        doc.insert(doc.length, "!")
+        self.assertEqual(doc.get(), ">> hello, world!")
+        doc.delete(3, 9)
+        self.assertEqual(doc.get(), ">>  world!")
+        self.assertEqual(doc.get(4, 9), "world")
+        self.assertEqual(doc.length, 10)
+
+    def test_random_edits_match_a_string(self):
+        rng = random.Random(1)
+        text = "".join(rng.choice("ab\n\U0001f600") for _ in range(2000))
+        doc = Document(text)
+        for _ in range(500):
+            if text and rng.random() < 0.4:
+                start = rng.randrange(len(text))
+                end = min(len(text), start + rng.randrange(1, 300))
+                doc.delete(start, end)
+                text = text[:start] + text[end:]
+            else:
+                offset = rng.randrange(len(text) + 1)
+                chunk = "".join(rng.choice("xy\n") for _ in range(rng.randrange(1, 400)))
+                doc.insert(offset, chunk)
+                text = text[:offset] + chunk + text[offset:]
+        self.assertEqual(doc.get(), text)
+        self.assertEqual(doc.line_count, text.count("\n") + 1)
+        self.assertEqual("".join(doc.chunks(size=97)), text)
+
+    def test_snapshot_is_unaffected_by_later_edits(self):
+        doc = Document("one\ntwo\n")
+        snap = doc.snapshot()
+        doc.insert(0, "zero\n")
+        doc.delete(5, 9)
+        self.assertEqual(snap.get(), "one\ntwo\n")
+        self.assertEqual(doc.get(), "zero\ntwo\n")
+
+    def test_line_start_and_range(self):
+        doc = Document("ab\ncde\n\nf")
+        self.assertEqual([doc.line_start(n) for n in range(1, 5)], [0, 3, 7, 8])
+        self.assertEqual(doc.line_range(2, 3), (3, 7))
+        self.assertEqual(doc.line_range(4, 4), (8, 9))
+        self.assertEqual(doc.position(5), (2, 2))
+
+    def test_index_offset_with_astral_characters(self):
+        # Tk columns count UTF-16 units, so U+1F600 takes two
+        doc = Document("a\U0001f600b\n\U0001f600\U0001f600c")
+        self.assertEqual(doc.index(2), "1.3")
+        self.assertEqual(doc.offset("1.3"), 2)
+        self.assertEqual(doc.index(6), "2.4")
+        self.assertEqual(doc.offset("2.4"), 6)
+        for offset in range(doc.length + 1):
+            self.assertEqual(doc.offset(doc.index(offset)), offset)
+
+    def test_fingerprint_follows_the_text(self):
+        doc = Document("abc\n")
+        doc.insert(2, "\U0001f600xyz")
+        doc.delete(0, 1)
+        text = doc.get()
+        self.assertEqual(doc.fingerprint, Document(text).fingerprint)
+        self.assertEqual(doc.fingerprint[0], len(text))
+        self.assertNotEqual(doc.fingerprint, Document(text + " ").fingerprint)
+        self.assertNotEqual(Document("ab").fingerprint, Document("ba").fingerprint)
+        self.assertEqual(Document().fingerprint, (0, 0))
+
+    def test_fingerprint_modulus_is_random(self):
+        # With a fixed modulus of 2**64-59, 2**64 = 59 makes "abc" and "&bd" collide
+        self.assertNotEqual(ainotepad._HASH_MOD, (1 << 64) - 59)
+        self.assertTrue(ainotepad._is_prime(ainotepad._HASH_MOD))
+        self.assertNotEqual(Document("abc").fingerprint, Document("&bd").fingerprint)
+
+    def test_same_text(self):
+        doc = Document("x" * 600000)
+        other = Document("x" * 300000)
+        other.append("x" * 300000)
+        self.assertTrue(doc.same_text(other))
+        other.insert(500000, "y")
+        other.delete(500001, 500002)
+        self.assertFalse(doc.same_text(other))
+
+    def test_memory_counts_shared_strings_once(self):
+        text = "x" * 1000000
+        doc = Document(text)
+        base = doc.memory()
+        self.assertGreater(base, len(text))
+        for _ in range(10):
+            doc.insert(doc.length // 2, "y")
+        self.assertLess(doc.memory(), base + 10000)
+
+
+class CleanStateTest(unittest.TestCase):
+    def window(self, clean_text, version, text):
+        window = types.SimpleNamespace(undo=types.SimpleNamespace(version=version), document=Document(text))
+        window._clean_state = (1, Document(clean_text))
+        return window
+
+    def modified(self, window):
+        return EditorWindow.modified.fget(window)
+
+    def test_colliding_fingerprint_is_still_modified(self):
+        with mock.patch.object(ainotepad, "_HASH_MOD", (1 << 64) - 59):
+            window = self.window("hello abc world", 2, "hello &bd world")
+            self.assertEqual(window.document.fingerprint, window._clean_state[1].fingerprint)
+            self.assertTrue(self.modified(window))
+
+    def test_retyped_text_is_clean(self):
+        window = self.window("hello", 2, "hello")
+        self.assertFalse(self.modified(window))
+        self.assertEqual(window._clean_state[0], 2)
+
+    def test_back_at_the_saved_version(self):
+        self.assertFalse(self.modified(self.window("a", 1, "b")))
+        self.assertTrue(self.modified(self.window("a", 2, "b")))
+
+
+if __name__ == "__main__":
+    unittest.main()
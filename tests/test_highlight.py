@@ -0,0 +1,139 @@
+import unittest
+
+from ainotepad import SearchHighlighter, compile_search
+
+
+class FakeVar:
+    def __init__(self):
+        self.value = ""
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class FakeText:
+    """Just enough of a Text widget: the text, one tag and idle callbacks."""
+
+    def __init__(self, text=""):
+        self.text = text
+        self.tagged = set()  # offsets of the tagged characters
+        self.jobs = {}
+
+    def offset(self, index):
+        if index == "end":
+            return len(self.text) + 1
+        if index == "end-1c":
+            return len(self.text)
+        line, col = index.split(".")
+        start = 0
+        for _ in range(int(line) - 1):
+            start = self.text.index("\n", start) + 1
+        stop = self.text.find("\n", start)
+        stop = len(self.text) if stop < 0 else stop
+        return stop if col == "end" else min(start + int(col), stop)
+
+    def index(self, index):
+        offset = self.offset(index)
+        line = self.text.count("\n", 0, offset) + 1
+        return f"{line}.{offset - (self.text.rfind(chr(10), 0, offset) + 1)}"
+
+    def get(self, start, end):
+        return self.text[self.offset(start):self.offset(end)]
+
+    def insert(self, index, chars):
+        offset = self.offset(index)
+        self.text = self.text[:offset] + chars + self.text[offset:]
+        self.tagged = {i + len(chars) if i >= offset else i for i in self.tagged}
+
+    def delete(self, start, end):
+        first, stop = self.offset(start), self.offset(end)
+        self.text = self.text[:first] + self.text[stop:]
+        self.tagged = {i - (stop - first) if i >= stop else i
+                       for i in self.tagged if not first <= i < stop}
+
+    def tag_add(self, tag, *indices):
+        for start, end in zip(indices[::2], indices[1::2]):
+            self.tagged.update(range(self.offset(start), self.offset(end)))
+
+    def tag_remove(self, tag, start, end):
+        self.tagged.difference_update(range(self.offset(start), self.offset(end)))
+
+    def tag_configure(self, *args, **kwargs):
+        pass
+
+    def tag_raise(self, *args):
+        pass
+
+    def after_idle(self, callback):
+        job = f"after#{len(self.jobs)}"
+        self.jobs[job] = callback
+        return job
+
+    def after_cancel(self, job):
+        self.jobs.pop(job, None)
+
+    def run_idle(self):
+        while self.jobs:
+            self.jobs.pop(next(iter(self.jobs)))()
+
+
+class FakeApp:
+    def __init__(self, text):
+        self.text = FakeText(text)
+        self.match_status_var = FakeVar()
+
+    def _schedule_ui(self, *what):
+        pass
+
+
+class MultiLineHighlightTest(unittest.TestCase):
+    def setUp(self):
+        self.app = FakeApp("a\nc\nx\n")
+        self.text = self.app.text
+        self.highlighter = SearchHighlighter(self.app)
+        self.highlighter.set_pattern(compile_search("a\\nb", True, True))
+        self.text.run_idle()
+
+    def edit(self, kind, start, end="", chars=""):
+        # The Text proxy reports deletions with the indices before the edit
+        if kind == "insert":
+            self.text.insert(start, chars)
+        else:
+            self.text.delete(start, end)
+        self.highlighter.on_edit(kind, start, end, chars)
+        self.text.run_idle()
+
+    def tagged(self):
+        return "".join(self.text.text[i] for i in sorted(self.text.tagged))
+
+    def test_edit_on_the_last_line_of_a_match(self):
+        self.assertEqual(self.highlighter.total, 0)
+        self.edit("delete", "2.0", "2.1")
+        self.edit("insert", "2.0", chars="b")
+        self.assertEqual(self.highlighter.total, 1)
+        self.assertEqual(self.tagged(), "a\nb")
+        self.highlighter.select_match("1.0")
+        self.assertEqual(self.app.match_status_var.get(), "Match 1 of 1")
+
+    def test_edit_that_breaks_a_match(self):
+        self.edit("insert", "2.0", chars="b")
+        self.assertEqual(self.highlighter.total, 1)
+        self.edit("insert", "1.1", chars="x")
+        self.assertEqual(self.highlighter.total, 0)
+        self.assertEqual(self.tagged(), "")
+        self.assertEqual(self.app.match_status_var.get(), "0 matches")
+
+    def test_count_agrees_with_select_match(self):
+        self.edit("insert", "1.0", chars="a\nb\n")
+        self.edit("insert", "4.0", chars="b")
+        self.assertEqual(self.highlighter.total, 2)
+        self.assertEqual(self.tagged(), "a\nba\nb")
+        self.highlighter.select_match("3.0")
+        self.assertEqual(self.app.match_status_var.get(), "Match 2 of 2")
+
+
+if __name__ == "__main__":
+    unittest.main()
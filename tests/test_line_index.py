@@ -0,0 +1,30 @@
+import threading
+import unittest
+
+from ainotepad import LineIndex
+
+
+class LineIndexTest(unittest.TestCase):
+    def test_offsets_and_lines(self):
+        data = b"".join(b"line %d\n" % n for n in range(1000))
+        index = LineIndex(step=64)
+        for pos in range(0, len(data), 333):      # chunks need not end on lines
+            index.feed(data[pos:pos + 333])
+        index.complete = True
+        self.assertEqual(index.line_count, 1001)
+        starts = [0] + [i + 1 for i, byte in enumerate(data) if byte == 10]
+        for line in (0, 1, 63, 64, 65, 500, 999, 1000):
+            self.assertEqual(index.line_offset(data, line, len(data)), starts[line])
+            self.assertEqual(index.line_of_offset(data, starts[line]), line)
+
+    def test_build(self):
+        data = b"a\nb\nc"
+        index = LineIndex(step=2)
+        index.build(data, len(data), threading.Event(), chunk_size=1)
+        self.assertTrue(index.complete)
+        self.assertEqual(index.line_count, 3)
+        self.assertEqual(index.line_offset(data, 2, len(data)), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from ainotepad import _FileLoader
+
+
+class FileLoaderTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b"one\r\ntwo\n")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def read(self, loader):
+        loader.start()
+        chunks = []
+        while True:
+            item = loader.chunks.get(timeout=10)
+            if item is _FileLoader.EOF:
+                return "".join(chunks)
+            chunks.append(item)
+
+    def test_reads_and_translates(self):
+        self.assertEqual(self.read(_FileLoader(self.path)), "one\ntwo\n")
+        self.assertEqual(self.read(_FileLoader(self.path, translate=False)), "one\r\ntwo\n")
+
+    def test_any_error_still_ends_the_load(self):
+        loader = _FileLoader(self.path)
+        with mock.patch.object(_FileLoader, "_read", side_effect=LookupError("no such codec")):
+            self.read(loader)
+        self.assertIsInstance(loader.error, LookupError)
+
+
+if __name__ == "__main__":
+    unittest.main()
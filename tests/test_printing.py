@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from ainotepad import Document, PageLayout, PageSettings, _PrintJob, format_header, paginate
+
+
+class FakeFont:
+    """A fixed-pitch font 6 points wide and 12 high at scaling 1."""
+
+    def __init__(self, fixed=True):
+        self.fixed = fixed
+
+    def actual(self):
+        return {"size": 10, "weight": "normal", "slant": "roman"}
+
+    def metrics(self):
+        return {"fixed": int(self.fixed), "linespace": 12, "ascent": 10}
+
+    def measure(self, text):
+        return 6 * len(text)
+
+
+def layout(columns, rows, fixed=True):
+    # Letter paper with margins leaving `columns` x `rows` characters and no header/footer
+    width = 612 - columns * 6
+    height = 792 - rows * 12
+    settings = PageSettings(margins=(width / 144, width / 144, height / 144, height / 144),
+                            header="", footer="")
+    return PageLayout(settings, FakeFont(fixed), 1.0)
+
+
+class FormatHeaderTest(unittest.TestCase):
+    when = datetime(2024, 5, 6, 7, 8, 9)
+
+    def test_codes_and_alignment(self):
+        parts = format_header("&l&f&cPage &p&r&&", "/tmp/notes.txt", 3, self.when)
+        self.assertEqual(parts, {"l": "notes.txt", "c": "Page 3", "r": "&"})
+
+    def test_untitled_and_unknown_codes(self):
+        self.assertEqual(format_header("&f&z", None, 1, self.when), {"l": "", "c": "Untitled", "r": ""})
+
+
+class PaginateTest(unittest.TestCase):
+    def test_wrap_after_spaces(self):
+        self.assertEqual(layout(10, 5).wrap("aaaa bbbb cccc"), [10, 14])
+        self.assertEqual(layout(10, 5).wrap("aaa bbbbbbbb cc"), [4, 13, 15])
+        self.assertEqual(layout(10, 5).wrap("abcdefghijklmn"), [10, 14])
+        self.assertEqual(layout(10, 5).wrap(""), [0])
+
+    def test_proportional_wrap_matches_fixed(self):
+        line = "the quick brown fox jumps over the lazy dog " * 3
+        self.assertEqual(layout(12, 5, fixed=False).wrap(line), layout(12, 5).wrap(line))
+
+    def test_pages(self):
+        text = "\n".join("%02d" % n for n in range(7)) + "\n"
+        pages = list(paginate(Document(text), layout(10, 3)))
+        self.assertEqual(pages, [(0, ["00", "01", "02"]), (9, ["03", "04", "05"]), (18, ["06"])])
+
+    def test_resume_from_a_page_start(self):
+        text = "word " * 200 + "\n" + "x" * 95
+        doc, lay = Document(text), layout(20, 4)
+        pages = list(paginate(doc, lay))
+        for start, rows in pages:
+            self.assertEqual(next(paginate(doc, lay, start)), (start, rows))
+        self.assertEqual("".join("".join(rows) for _, rows in pages), text.replace("\n", ""))
+
+
+class PrintJobTest(unittest.TestCase):
+    def print_to_file(self, doc, lay, starts):
+        with tempfile.TemporaryDirectory() as tmp:
+            job = _PrintJob(os.path.join(tmp, "out.pdf"), doc, lay, None, starts)
+            job.run()
+            self.assertIsNone(job.error)
+            with open(job.path, "rb") as f:
+                return f.read(), job.starts
+
+    def test_known_page_starts(self):
+        doc, lay = Document("word " * 200 + "\n" + "x" * 95), layout(20, 4)
+        starts = [offset for offset, _ in paginate(doc, lay)]
+        data, found = self.print_to_file(doc, lay, ())
+        self.assertEqual(found, starts)
+        for known in (starts[:1], starts[:5], starts):
+            self.assertEqual(self.print_to_file(doc, lay, known), (data, starts))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+from ainotepad import line_diff
+
+
+class LineDiffTest(unittest.TestCase):
+    def apply(self, old, hunks):
+        lines = old.splitlines(keepends=True)
+        for first, last, text in hunks:      # bottom-up, so earlier hunks stay valid
+            lines[first:last] = [text]
+        return "".join(lines)
+
+    def test_hunks_turn_old_into_new(self):
+        old = "a\nb\nc\nd\ne\n"
+        for new in ("a\nB\nc\nd\ne\n", "a\nc\ne\n", "x\na\nb\nc\nd\ne\ny\n", "", "a\nb\nc\nd\ne"):
+            self.assertEqual(self.apply(old, line_diff(old, new)), new)
+
+    def test_unchanged(self):
+        self.assertEqual(line_diff("a\nb\n", "a\nb\n"), [])
+
+    def test_common_lines_are_trimmed(self):
+        self.assertEqual(line_diff("a\nb\nc\n", "a\nx\nc\n"), [(1, 2, "x\n")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+from ainotepad import replace_all_in_text
+
+
+class ReplaceAllTest(unittest.TestCase):
+    def apply(self, text, *args):
+        start, end, replacement, count = replace_all_in_text(text, *args)
+        return text[:start] + replacement + text[end:], count
+
+    def test_match_case(self):
+        self.assertEqual(self.apply("a cat, a Cat", "cat", "dog", True), ("a dog, a Cat", 1))
+
+    def test_ignore_case_is_literal(self):
+        self.assertEqual(self.apply("Cat cat.", "cat.", "x\\1", False), ("Cat x\\1", 1))
+
+    def test_regex_groups(self):
+        self.assertEqual(self.apply("a=1\nb=2", r"^(\w)=(\d)$", r"\2=\1", True, True), ("1=a\n2=b", 2))
+
+    def test_span_covers_first_to_last_match(self):
+        self.assertEqual(replace_all_in_text("xxaxxbxx", "x", "", True), (0, 8, "ab", 6))
+        self.assertEqual(replace_all_in_text("..ab..", "ab", "ba", True), (2, 4, "ba", 1))
+
+    def test_no_match(self):
+        self.assertEqual(replace_all_in_text("abc", "x", "y", False), (0, 0, "", 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from ainotepad import UndoHistory
+
+
+class FakeApp:
+    def _raw_text(self, *args):
+        return "x"
+
+
+class UndoHistoryTest(unittest.TestCase):
+    def test_typing_is_coalesced(self):
+        undo = UndoHistory(FakeApp())
+        for col, ch in enumerate("abc"):
+            undo.on_edit("insert", f"1.{col}", None, ch)
+        self.assertEqual(len(undo.undo_stack), 1)
+        self.assertEqual(undo.undo_stack[-1].get(), [("i", "1.0", "abc")])
+
+    def test_seal_keeps_the_saved_version_reachable(self):
+        undo = UndoHistory(FakeApp())
+        undo.on_edit("insert", "1.0", None, "a")
+        undo.on_edit("insert", "1.1", None, "b")
+        saved = undo.version
+        undo.seal()
+        undo.on_edit("insert", "1.2", None, "c")
+        self.assertEqual(len(undo.undo_stack), 2)
+        self.assertEqual(undo.undo_stack[-2].version, saved)
+
+    def test_pack_keeps_the_steps(self):
+        undo = UndoHistory(FakeApp())
+        undo.on_edit("insert", "1.0", None, "hello world\n" * 100)
+        undo.on_edit("insert", "2.0", None, "b")
+        steps = [[list(delta) for delta in group.get()] for group in undo.undo_stack]
+        undo.pack()
+        self.assertTrue(all(group.deltas is None for group in undo.undo_stack))
+        self.assertEqual([group.get() for group in undo.undo_stack], steps)
+
+
+if __name__ == "__main__":
+    unittest.main()